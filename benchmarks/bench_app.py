@@ -0,0 +1,275 @@
+"""
+Benchmark de bout en bout de l'application, hors ligne.
+
+    python benchmarks/bench_app.py --clients 1,10,100 --output results.json
+
+Génère des vidéos de test avec ffmpeg (MP4 progressif, HLS, DASH), les sert
+depuis une origine HTTP locale et pilote l'application (processus uvicorn
+séparé, dont le démarrage est chronométré) comme le ferait un client :
+/formats (extracteur générique de yt-dlp), /download à plusieurs niveaux
+de concurrence, /file et les opérations de l'éditeur. Résultats en JSON
+pour suivre les régressions.
+"""
+import argparse
+import functools
+import http.client
+import http.server
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench_file_serving import free_port, run_scenario, start_server
+
+SOURCES = {
+    "progressive": "progressive.mp4",
+    "hls": "hls/index.m3u8",
+    "dash": "dash/index.mpd",
+}
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class OriginServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # Clients qui coupent la connexion (yt-dlp, ffmpeg)
+
+
+def generate_media(directory: str, duration: int, size: str):
+    """Vidéo H.264/AAC de test déclinée en MP4 progressif, HLS et DASH."""
+    source = os.path.join(directory, "progressive.mp4")
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y",
+         "-f", "lavfi", "-i", f"testsrc2=duration={duration}:size={size}:rate=25",
+         "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+         "-c:v", "libx264", "-preset", "veryfast", "-g", "50", "-c:a", "aac",
+         "-movflags", "+faststart", source],
+        check=True,
+    )
+    os.makedirs(os.path.join(directory, "hls"))
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y", "-i", source, "-c", "copy",
+         "-f", "hls", "-hls_time", "2", "-hls_playlist_type", "vod",
+         os.path.join(directory, "hls", "index.m3u8")],
+        check=True,
+    )
+    os.makedirs(os.path.join(directory, "dash"))
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y", "-i", source, "-c", "copy",
+         "-map", "0:v", "-map", "0:a", "-f", "dash", "-seg_duration", "2",
+         os.path.join(directory, "dash", "index.mpd")],
+        check=True,
+    )
+    return source
+
+
+def start_origin(directory: str) -> tuple:
+    """Origine HTTP locale remplaçant les sites vidéo."""
+    port = free_port()
+    server = OriginServer(("127.0.0.1", port), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, port
+
+
+def request_json(port: int, method: str, path: str, body: dict = None, timeout: float = 600) -> tuple:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    payload = json.dumps(body) if body is not None else None
+    conn.request(method, path, body=payload, headers={"Content-Type": "application/json"} if payload else {})
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    try:
+        return response.status, json.loads(data)
+    except ValueError:
+        return response.status, None
+
+
+def summarize(durations: list) -> dict:
+    if not durations:
+        return {"count": 0}
+    ordered = sorted(durations)
+    return {
+        "count": len(ordered),
+        "min": round(ordered[0], 4),
+        "p50": round(statistics.median(ordered), 4),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def bench_formats(port: int, origin: str, repeats: int) -> list:
+    """Première extraction (cache froid) puis lectures servies par le cache."""
+    results = []
+    for name, path in SOURCES.items():
+        url = f"{origin}/{path}?formats={time.time_ns()}"
+        cold = []
+        start = time.perf_counter()
+        status, _ = request_json(port, "GET", f"/formats?url={url}")
+        cold.append(time.perf_counter() - start)
+        warm = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            request_json(port, "GET", f"/formats?url={url}")
+            warm.append(time.perf_counter() - start)
+        results.append({"source": name, "status": status, "cold": summarize(cold), "cached": summarize(warm)})
+    return results
+
+
+def download_once(port: int, url: str, format: str) -> tuple:
+    """Soumet un téléchargement et attend la fin du job ; retourne (durée, job)."""
+    start = time.perf_counter()
+    status, job = request_json(port, "POST", "/download", {"url": url, "format": format})
+    if status != 202:
+        return time.perf_counter() - start, {"status": "failed", "error": job}
+    while job["status"] in ("queued", "running"):
+        time.sleep(0.05)
+        _, job = request_json(port, "GET", f"/jobs/{job['job_id']}")
+    return time.perf_counter() - start, job
+
+
+def bench_downloads(port: int, origin: str, source: str, clients: int, format: str) -> dict:
+    """`clients` téléchargements simultanés d'URLs distinctes (pas de dédoublonnage par le store)."""
+    durations, errors, total_bytes = [], [], 0
+    lock = threading.Lock()
+    run_id = time.time_ns()
+
+    def client(index: int):
+        nonlocal total_bytes
+        url = f"{origin}/{SOURCES[source]}?client={run_id}-{index}"
+        elapsed, job = download_once(port, url, format)
+        with lock:
+            if job["status"] == "finished":
+                durations.append(elapsed)
+                total_bytes += job.get("downloaded_bytes") or 0
+            else:
+                errors.append(job.get("error"))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "source": source,
+        "format": format,
+        "clients": clients,
+        "errors": len(errors),
+        "first_error": next(iter(errors), None),
+        "seconds": round(elapsed, 4),
+        "jobs_per_second": round(len(durations) / elapsed, 3) if elapsed else None,
+        "mb_per_second": round(total_bytes / 1024 ** 2 / elapsed, 2) if elapsed else None,
+        "latency": summarize(durations),
+    }
+
+
+def bench_editor(port: int, downloads_dir: str, source: str, repeats: int) -> list:
+    """Chaque opération travaille sur sa propre copie (les éditions remplacent le fichier)."""
+    operations = {
+        "cut": lambda f: {"filename": f, "start_time": "00:00:01", "end_time": "00:00:04"},
+        "cut_precise": lambda f: {"filename": f, "start_time": "00:00:01.3", "end_time": "00:00:04.7",
+                                  "precise": True},
+        "divide": lambda f: {"filename": f, "segments": 4},
+        "comment": lambda f: {"filename": f, "text": "benchmark", "time": "00:00:01", "duration": 2},
+        "export": lambda f: {"filename": f, "format": "mp4"},
+    }
+    results = []
+    for name, make_body in operations.items():
+        durations, errors = [], []
+        route = "cut" if name.startswith("cut") else name
+        for i in range(repeats):
+            filename = f"edit_{name}_{i}_{time.time_ns()}.mp4"
+            shutil.copy(source, os.path.join(downloads_dir, filename))
+            start = time.perf_counter()
+            status, body = request_json(port, "POST", f"/api/edit/{route}", make_body(filename))
+            if status == 200:
+                durations.append(time.perf_counter() - start)
+            else:
+                errors.append((body or {}).get("detail") if isinstance(body, dict) else status)
+        results.append({"operation": name, "errors": len(errors), "first_error": next(iter(errors), None),
+                        "latency": summarize(durations)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=int, default=10, help="durée de la vidéo de test (secondes)")
+    parser.add_argument("--video-size", default="640x360", help="résolution de la vidéo de test")
+    parser.add_argument("--clients", default="1,10,100", help="niveaux de concurrence pour /download")
+    parser.add_argument("--sources", default="progressive,hls,dash", help="sources téléchargées")
+    parser.add_argument("--formats-repeats", type=int, default=20, help="requêtes /formats servies par le cache")
+    parser.add_argument("--file-clients", type=int, default=4, help="clients simultanés sur /file")
+    parser.add_argument("--file-requests", type=int, default=50, help="requêtes /file par client")
+    parser.add_argument("--edit-repeats", type=int, default=3, help="exécutions de chaque opération d'édition")
+    parser.add_argument("--download-workers", type=int, help="DOWNLOAD_WORKERS du serveur")
+    parser.add_argument("--per-host", type=int, help="MAX_DOWNLOADS_PER_HOST du serveur (origine unique)")
+    parser.add_argument("--output", help="fichier JSON de résultats (sinon stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_app_")
+    media_dir = os.path.join(workdir, "origin")
+    downloads_dir = os.path.join(workdir, "server", "downloads")
+    os.makedirs(media_dir)
+    os.makedirs(downloads_dir)
+    source = generate_media(media_dir, args.duration, args.video_size)
+    shutil.copy(source, os.path.join(downloads_dir, "served.mp4"))
+
+    env = {}
+    if args.download_workers:
+        env["DOWNLOAD_WORKERS"] = str(args.download_workers)
+    if args.per_host:
+        env["MAX_DOWNLOADS_PER_HOST"] = str(args.per_host)
+
+    origin_server, origin_port = start_origin(media_dir)
+    origin = f"http://127.0.0.1:{origin_port}"
+    port = free_port()
+    started = time.perf_counter()
+    server = start_server(os.path.join(workdir, "server"), port, env)
+    startup_seconds = time.perf_counter() - started  # Lancement du processus jusqu'au premier /health
+    try:
+        results = {
+            "benchmark": "app",
+            "config": {
+                "video_duration": args.duration,
+                "video_size": args.video_size,
+                "source_bytes": os.path.getsize(source),
+                "server_env": env,
+            },
+            "startup_seconds": round(startup_seconds, 4),
+            "formats": bench_formats(port, origin, args.formats_repeats),
+            "download": [
+                bench_downloads(port, origin, name, int(clients), "best")
+                for name in args.sources.split(",")
+                for clients in args.clients.split(",")
+            ],
+            "file": run_scenario(
+                "file_full", port, server.pid, args.file_clients, args.file_requests,
+                lambda: ("/file/served.mp4", {}, 200)),
+            "editor": bench_editor(port, downloads_dir, source, args.edit_repeats),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+        origin_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
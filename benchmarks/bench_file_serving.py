@@ -0,0 +1,180 @@
+"""
+Benchmark du service de fichiers (/file/{filename}).
+
+    python benchmarks/bench_file_serving.py --size-mb 512 --clients 4
+
+Lance l'application dans un processus uvicorn séparé, sert un fichier de
+test et mesure le débit ainsi que le temps CPU consommé par le serveur
+(lu dans /proc, Linux uniquement) pour chaque scénario. Résultats en JSON.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = "code pour telecharger des videos:app"
+READ_SIZE = 1024 * 1024
+# Tous les clients du benchmark partagent une IP : limites de débit par client désactivées
+SERVER_ENV = {f"RATE_LIMIT_{name}": "0" for name in ("INTERACTIVE", "SERVE", "DOWNLOAD", "EDIT")}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_cpu_seconds(pid: int) -> float:
+    """Temps CPU utilisateur + système du processus serveur."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def start_server(workdir: str, port: int, env: dict = None) -> subprocess.Popen:
+    for directory in ("static", "templates"):
+        os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", APP, "--app-dir", REPO_DIR,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env={**os.environ, **SERVER_ENV, **(env or {})},
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Le serveur n'a pas démarré")
+
+
+def fetch(port: int, path: str, headers: dict) -> tuple:
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request("GET", path, headers=headers)
+    response = conn.getresponse()
+    received = 0
+    while True:
+        chunk = response.read(READ_SIZE)
+        if not chunk:
+            break
+        received += len(chunk)
+    conn.close()
+    return response.status, received
+
+
+def run_scenario(name: str, port: int, pid: int, clients: int, requests_per_client: int, make_request) -> dict:
+    totals = {"bytes": 0, "requests": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def client():
+        for _ in range(requests_per_client):
+            path, headers, expected = make_request()
+            status, received = fetch(port, path, headers)
+            with lock:
+                totals["requests"] += 1
+                totals["bytes"] += received
+                if status != expected:
+                    totals["errors"] += 1
+
+    cpu_before = server_cpu_seconds(pid)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    cpu = server_cpu_seconds(pid) - cpu_before
+    gigabytes = totals["bytes"] / 1024 ** 3
+    return {
+        "scenario": name,
+        "clients": clients,
+        "requests": totals["requests"],
+        "errors": totals["errors"],
+        "bytes": totals["bytes"],
+        "seconds": round(elapsed, 4),
+        "mb_per_second": round(totals["bytes"] / 1024 ** 2 / elapsed, 2) if elapsed else None,
+        "requests_per_second": round(totals["requests"] / elapsed, 2) if elapsed else None,
+        "server_cpu_seconds": round(cpu, 4),
+        "server_cpu_seconds_per_gb": round(cpu / gigabytes, 4) if gigabytes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=256, help="taille du fichier servi")
+    parser.add_argument("--clients", type=int, default=4, help="clients simultanés")
+    parser.add_argument("--requests", type=int, default=4, help="requêtes complètes par client")
+    parser.add_argument("--range-requests", type=int, default=200, help="requêtes Range par client")
+    parser.add_argument("--output", help="fichier JSON de résultats (sinon stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_file_")
+    os.makedirs(os.path.join(workdir, "downloads"))
+    filename = "bench.mp4"
+    size = args.size_mb * 1024 * 1024
+    with open(os.path.join(workdir, "downloads", filename), "wb") as f:
+        block = os.urandom(READ_SIZE)
+        for _ in range(args.size_mb):
+            f.write(block)
+
+    port = free_port()
+    server = start_server(workdir, port)
+    path = f"/file/{filename}"
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        conn.request("HEAD", path)
+        etag = conn.getresponse().getheader("etag")
+        conn.close()
+
+        def seek():
+            start = random.randrange(0, size - READ_SIZE)
+            return path, {"Range": f"bytes={start}-{start + READ_SIZE - 1}"}, 206
+
+        def multi_range():
+            starts = sorted(random.sample(range(0, size - 65536, 65536), 4))
+            ranges = ",".join(f"{s}-{s + 65535}" for s in starts)
+            return path, {"Range": f"bytes={ranges}"}, 206
+
+        scenarios = [
+            ("full", args.requests, lambda: (path, {}, 200)),
+            ("single_range_1mb", args.range_requests, seek),
+            ("multi_range_4x64kb", args.range_requests, multi_range),
+            ("revalidate_304", args.range_requests, lambda: (path, {"If-None-Match": etag}, 304)),
+        ]
+        results = {
+            "benchmark": "file_serving",
+            "file_size_bytes": size,
+            "results": [
+                run_scenario(name, port, server.pid, args.clients, count, make_request)
+                for name, count, make_request in scenarios
+            ],
+        }
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
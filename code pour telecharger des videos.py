@@ -1,21 +1,41 @@
 # main.py  uvicorn "code pour telecharger des videos:app" --reload
+import time
+IMPORT_STARTED = time.perf_counter()  # Début du chargement du module (voir startup_timings)
 from fastapi import FastAPI, Request, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel, HttpUrl
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, HttpUrl
 from typing import Optional, List
-import yt_dlp
 import uuid
 import os
 import logging
-from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
 import asyncio
 import re
 import urllib.parse
 import subprocess
 import shutil
+import threading
+import copy
+import json
+import functools
+import importlib
+import hashlib
+import bisect
+import math
+import heapq
+import base64
+import io
+import zipfile
+import sqlite3
+import mimetypes
+import socket
+from contextlib import contextmanager
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
 
 # Configuration du logging
 logging.basicConfig(
@@ -45,21 +65,665 @@ templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Constants
-DOWNLOAD_DIR = "./downloads"
-TEMP_DIR = "./temp"
+# Dossiers et état partagés : un volume commun permet plusieurs workers/instances
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "./downloads")
+TEMP_DIR = os.getenv("TEMP_DIR", "./temp")
+STATE_URL = os.getenv("STATE_URL", "sqlite:///./state.db")  # sqlite:///chemin ou redis://hôte:port/0
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+JOB_PUBLISH_INTERVAL = 0.5  # Secondes minimum entre deux publications de la progression d'un job
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "0.5"))  # Rythme maximal des événements SSE par job
+SSE_HEARTBEAT_SECONDS = 15  # Commentaire envoyé sur un flux inactif (évite la coupure par les proxys)
+SSE_RETRY_MS = 3000  # Délai de reconnexion proposé aux clients EventSource
+STORE_LOCK_TTL = 3600  # Bail du verrou partagé d'un téléchargement
+CLEANUP_INTERVAL = 300  # Secondes entre deux nettoyages (par le worker leader)
 STATIC_DIR = "./static"
 TEMPLATES_DIR = "./templates"
 MAX_FILE_AGE_MINUTES = 30  # Fichiers supprimés après 30 minutes
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))  # Téléchargements simultanés
+MAX_DOWNLOADS_PER_HOST = int(os.getenv("MAX_DOWNLOADS_PER_HOST", "2"))  # Par domaine source
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))  # Éléments par lot
+FRAGMENT_CONCURRENCY = int(os.getenv("FRAGMENT_CONCURRENCY", "4"))  # Fragments HLS/DASH simultanés
+STORE_INDEX_FILE = os.getenv("STORE_INDEX_FILE", "./downloads_index.json")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 ** 3)))  # 10 Go
+UPLOAD_EXPIRY_HOURS = int(os.getenv("UPLOAD_EXPIRY_HOURS", "24"))  # Uploads incomplets
+MEDIA_INDEX_FILE = os.getenv("MEDIA_INDEX_FILE", "./media_index.db")  # Index ffprobe des fichiers
+PREVIEW_DIR = os.getenv("PREVIEW_DIR", "./previews")  # Posters et planches de vignettes, par empreinte du contenu
+PREVIEW_TTL_HOURS = int(os.getenv("PREVIEW_TTL_HOURS", "168"))  # Aperçus non consultés
+PREVIEW_TILE_WIDTH = 160  # Largeur d'une vignette de la planche
+PREVIEW_COLUMNS = 10  # Vignettes par ligne de la planche
+PREVIEW_MAX_TILES = 100  # Vignettes maximales par fichier (espacées sur toute la durée)
+PREVIEW_POSTER_WIDTH = 640  # Largeur maximale du poster
+PREVIEW_POSTER_POSITION = 0.1  # Poster : image clé la plus proche de 10 % de la durée
+HLS_DIR = os.getenv("HLS_DIR", "./hls")  # Segments HLS produits à la demande
+HLS_CACHE_MAX_BYTES = int(os.getenv("HLS_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))  # 2 Go, éviction LRU
+HLS_SEGMENT_SECONDS = float(os.getenv("HLS_SEGMENT_SECONDS", "6"))  # Durée minimale d'un segment
+HLS_PROXY_HEIGHT = int(os.getenv("HLS_PROXY_HEIGHT", "360"))  # Rendu allégé pour l'éditeur (0 : aucun)
+HLS_PROXY_BITRATE = int(os.getenv("HLS_PROXY_BITRATE", "600000"))  # Débit vidéo du rendu allégé
+STORE_MAX_BYTES = int(os.getenv("STORE_MAX_BYTES", str(5 * 1024 ** 3)))  # 5 Go
+STORE_TTL_MINUTES = int(os.getenv("STORE_TTL_MINUTES", str(MAX_FILE_AGE_MINUTES)))  # Inactivité
+STORE_FULL_POLICY = os.getenv("STORE_FULL_POLICY", "queue")  # Quota atteint : "queue" (attendre) ou "reject" (507)
+STORE_QUEUE_TIMEOUT = int(os.getenv("STORE_QUEUE_TIMEOUT", "600"))  # Attente maximale d'une place dans le store
+TEMP_ORPHAN_MINUTES = int(os.getenv("TEMP_ORPHAN_MINUTES", "60"))  # Fichiers temporaires sans propriétaire
+STORE_SYNC_INTERVAL = 5  # Secondes entre deux partages de l'occupation du store entre workers
+STORE_USAGE_TTL = 30  # Occupation publiée par un worker (réservations, épinglages), oubliée s'il disparaît
+FFMPEG_MAX_CONCURRENCY = int(os.getenv("FFMPEG_MAX_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // 2))))
+FFMPEG_TIMEOUT_SECONDS = int(os.getenv("FFMPEG_TIMEOUT_SECONDS", "1800"))  # Par opération
+STREAM_CHUNK_SIZE = 64 * 1024  # Taille des blocs envoyés en mode streaming
+FILE_CHUNK_SIZE = 1024 * 1024  # Blocs lus par /file sans extension zero-copy
+DIRECT_FFMPEG_PROTOCOLS = ('http', 'https', 'm3u8', 'm3u8_native')  # Lisibles par ffmpeg
+AUDIO_REQUEST_FORMATS = ('mp3', 'bestaudio', 'audio')
+# Conteneurs audio : codecs copiables sans ré-encodage, options de transcodage, muxer sur un pipe
+AUDIO_REMUX_CODECS = {
+    'm4a': ('aac',),
+    'mp3': ('mp3',),
+    'opus': ('opus',),
+    'ogg': ('opus', 'vorbis'),
+    'webm': ('opus', 'vorbis'),
+    'flac': ('flac',),
+}
+AUDIO_ENCODE_ARGS = {
+    'm4a': ['-c:a', 'aac', '-b:a', '192k'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '192k'],
+    'opus': ['-c:a', 'libopus', '-b:a', '128k'],
+    'ogg': ['-c:a', 'libopus', '-b:a', '128k'],
+    'webm': ['-c:a', 'libopus', '-b:a', '128k'],
+    'flac': ['-c:a', 'flac'],
+}
+AUDIO_PIPE_MUXERS = {
+    'm4a': ['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov'],
+    'mp3': ['-f', 'mp3'],
+    'opus': ['-f', 'opus'],
+    'ogg': ['-f', 'ogg'],
+    'webm': ['-f', 'webm'],
+    'flac': ['-f', 'flac'],
+}
+AUDIO_CODEC_CONTAINERS = {'aac': 'm4a', 'mp3': 'mp3', 'opus': 'opus', 'vorbis': 'ogg', 'flac': 'flac'}
+# Classement des formats vidéo
+VIDEO_REQUEST_FORMATS = {'best': None, 'mp4': 'mp4', 'webm': 'webm'}  # Demande -> conteneur imposé
+VIDEO_CODEC_EFFICIENCY = {'av1': 1.8, 'hevc': 1.5, 'vp9': 1.4, 'h264': 1.0, 'vp8': 0.9}  # Équivalent H.264
+VIDEO_CONTAINER_CODECS = {  # Conteneur -> (codecs vidéo, codecs audio) fusionnables sans ré-encodage
+    'mp4': (('h264', 'hevc', 'av1'), ('aac', 'mp3')),
+    'webm': (('vp9', 'vp8', 'av1'), ('opus', 'vorbis')),
+}
+# Conteneurs de sortie des éditions : codecs copiables (None : tous), encodeurs vidéo et audio par défaut
+EDIT_CONTAINERS = {
+    'mp4': (*VIDEO_CONTAINER_CODECS['mp4'], 'libx264', 'aac'),
+    'mov': (*VIDEO_CONTAINER_CODECS['mp4'], 'libx264', 'aac'),
+    'mkv': (None, None, 'libx264', 'aac'),
+    'webm': (*VIDEO_CONTAINER_CODECS['webm'], 'libvpx-vp9', 'libopus'),
+}
+TARGET_BITS_PER_PIXEL = 0.07  # Débit H.264 jugé suffisant, en bits par pixel et par image
+SAME_QUALITY_RATIO = 0.95  # Scores équivalents : le plus petit fichier l'emporte
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", "600"))  # Secondes
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "256"))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+YDL_POOL_SIZE = int(os.getenv("YDL_POOL_SIZE", str(DOWNLOAD_WORKERS)))  # Instances yt-dlp inactives par profil
+YDL_POOL_IDLE_SECONDS = int(os.getenv("YDL_POOL_IDLE_SECONDS", "300"))  # Instance (et connexions) fermée au-delà
+# Admission des requêtes : classes par priorité décroissante
+ADMISSION_CLASSES = ('interactive', 'serve', 'download', 'edit')
+RATE_LIMITS = {  # Par client et par classe : « requêtes par seconde,rafale » (0 : illimité)
+    'interactive': os.getenv("RATE_LIMIT_INTERACTIVE", "10,40"),
+    'serve': os.getenv("RATE_LIMIT_SERVE", "50,200"),
+    'download': os.getenv("RATE_LIMIT_DOWNLOAD", "1,20"),
+    'edit': os.getenv("RATE_LIMIT_EDIT", "0.2,10"),
+}
+API_KEYS = {k.strip() for k in os.getenv("API_KEYS", "").split(",") if k.strip()}  # Client = clé plutôt qu'IP
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", "64"))  # Requêtes en cours par worker
+ADMISSION_SHARES = {'interactive': 1.0, 'serve': 0.9, 'download': 0.6, 'edit': 0.3}  # Occupation maximale admise
+ADMISSION_QUEUE_SECONDS = float(os.getenv("ADMISSION_QUEUE_SECONDS", "2"))  # Attente d'une place avant 429
+ADMISSION_MAX_CLIENTS = 10000  # Seaux à jetons gardés en mémoire (les moins récents sont oubliés)
+FILE_RATE_PER_CONNECTION = int(os.getenv("FILE_RATE_PER_CONNECTION", "0"))  # Octets/s par réponse /file (0 : illimité)
+FILE_RATE_TOTAL = int(os.getenv("FILE_RATE_TOTAL", "0"))  # Octets/s de toutes les réponses /file du worker
 
 def init_directories():
     """Initialise les dossiers nécessaires pour l'application"""
-    directories = [DOWNLOAD_DIR, TEMP_DIR, STATIC_DIR, TEMPLATES_DIR]
+    directories = [DOWNLOAD_DIR, TEMP_DIR, PREVIEW_DIR, HLS_DIR, STATIC_DIR, TEMPLATES_DIR]
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
         logging.info(f"Dossier créé/vérifié : {directory}")
 
 init_directories()
 
+# Métriques au format texte Prometheus (exposées sur /metrics)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+EVENT_LOOP_LAG_INTERVAL = 1.0  # Secondes entre deux mesures du retard de la boucle
+
+class Metrics:
+    """
+    Registre minimal de compteurs, histogrammes et jauges, sans dépendance.
+    Les jauges sont des fonctions évaluées à chaque lecture de /metrics ;
+    elles retournent une valeur ou un dictionnaire {labels: valeur}.
+    """
+
+    def __init__(self):
+        self._help: dict[str, tuple] = {}  # nom -> (type, description)
+        self._counters: dict[str, dict] = {}
+        self._histograms: dict[str, dict] = {}  # nom -> {labels: [compteurs par bucket, somme, total]}
+        self._gauges: dict[str, callable] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str):
+        self._help[name] = ("counter", help_text)
+        self._counters[name] = {}
+
+    def histogram(self, name: str, help_text: str):
+        self._help[name] = ("histogram", help_text)
+        self._histograms[name] = {}
+
+    def gauge(self, name: str, help_text: str, func):
+        self._help[name] = ("gauge", help_text)
+        self._gauges[name] = func
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms[name].setdefault(key, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+            for i in range(bisect.bisect_left(LATENCY_BUCKETS, value), len(LATENCY_BUCKETS)):
+                series[0][i] += 1  # Buckets cumulatifs (le = inférieur ou égal)
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {k: (list(v[0]), v[1], v[2]) for k, v in series.items()}
+                          for name, series in self._histograms.items()}
+        for name, (kind, help_text) in self._help.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                lines.extend(f"{name}{format_labels(k)} {v}" for k, v in counters[name].items())
+            elif kind == "histogram":
+                for key, (buckets, total, count) in histograms[name].items():
+                    for bound, n in zip(LATENCY_BUCKETS, buckets):
+                        lines.append(f"{name}_bucket{format_labels(key + (('le', bound),))} {n}")
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{format_labels(key)} {total}")
+                    lines.append(f"{name}_count{format_labels(key)} {count}")
+            else:
+                try:
+                    value = self._gauges[name]()
+                except Exception as e:
+                    logging.error(f"Erreur de la métrique {name}: {str(e)}")
+                    continue
+                if isinstance(value, dict):
+                    lines.extend(f"{name}{format_labels(tuple(k))} {v}" for k, v in value.items())
+                else:
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+metrics = Metrics()
+metrics.histogram("http_request_duration_seconds", "Durée des requêtes HTTP jusqu'au dernier octet, par route")
+metrics.counter("http_requests_total", "Requêtes HTTP par route, méthode et code")
+metrics.histogram("stage_duration_seconds", "Durée des étapes (extraction, download, postprocess, rename, serve, ffmpeg)")
+metrics.counter("downloaded_bytes_total", "Octets téléchargés depuis les sources")
+metrics.counter("served_bytes_total", "Octets envoyés par /file")
+metrics.histogram("event_loop_lag_seconds", "Retard de la boucle asyncio sur un sommeil planifié")
+metrics.counter("ydl_leases_total", "Instances YoutubeDL prêtées par profil (new : construite, reused : réutilisée)")
+metrics.counter("admission_rejected_total", "Requêtes refusées (429) par classe et motif (rate, capacity)")
+metrics.histogram("admission_wait_seconds", "Attente d'une place avant admission, par classe")
+
+class MetricsMiddleware:
+    """Middleware ASGI : latence jusqu'au dernier octet, par modèle de route (pas par URL)."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def route_label(self, scope) -> str:
+        if self._routes is None:
+            self._routes = {getattr(r, 'endpoint', None) or getattr(r, 'app', None): r.path
+                            for r in app.routes}
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = self.route_label(scope)
+            metrics.observe("http_request_duration_seconds", time.perf_counter() - start, route=route)
+            metrics.inc("http_requests_total", route=route, method=scope["method"], status=status)
+
+# Admission des requêtes : débit par client, capacité par classe de priorité
+class TokenBucket:
+    """
+    Seau à jetons : `rate` jetons par seconde, au plus `burst` en réserve.
+    Utilisé depuis la boucle d'événements uniquement (pas de verrou).
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount: float = 1) -> float:
+        """Prend `amount` jetons s'ils sont disponibles (0) ; sinon, secondes avant qu'ils le soient."""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def reserve(self, amount: float) -> float:
+        """Prend `amount` jetons, quitte à s'endetter ; retourne l'attente avant de les utiliser."""
+        self._refill()
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+def parse_rate_limit(value: str) -> Optional[tuple]:
+    """« requêtes par seconde,rafale » -> (rate, burst) ; vide ou débit nul : pas de limite."""
+    rate, _, burst = (value or "0").partition(',')
+    rate = float(rate)
+    if rate <= 0:
+        return None
+    return rate, max(float(burst or rate), 1.0)
+
+def request_class(method: str, path: str) -> str:
+    """Classe de priorité d'une requête (ADMISSION_CLASSES)."""
+    if path.startswith('/api/edit/'):
+        return 'edit'
+    if path.startswith('/api/upload'):
+        return 'download' if method == 'POST' else 'serve'  # Les morceaux tus sont des transferts
+    if path.startswith('/download'):
+        return 'download'
+    # /api/media/{fichier} peut lancer une analyse ffprobe complète des images clés
+    if path.startswith(('/file/', '/api/hls/', '/api/previews/', '/api/media/', '/static/')) \
+            or path.endswith('/preview'):
+        return 'serve'
+    return 'interactive'
+
+def client_identity(scope) -> str:
+    """Clé d'API reconnue (en-tête X-API-Key), sinon adresse IP du client."""
+    for name, value in scope["headers"]:
+        if name == b"x-api-key":
+            key = value.decode('latin-1')
+            if key in API_KEYS:
+                return f"key:{key}"
+    client = scope.get("client")
+    return f"ip:{client[0]}" if client else "ip:inconnu"
+
+class AdmissionController:
+    """
+    Admission des requêtes HTTP du worker, en deux contrôles :
+    - débit : un seau à jetons par client (clé d'API ou IP) et par classe ;
+    - capacité : au plus `max_active` requêtes en cours, et une classe n'est
+      admise que tant que l'occupation totale reste sous sa part
+      (ADMISSION_SHARES) : sous charge, les éditions puis les téléchargements
+      attendent les premiers et les requêtes interactives passent toujours.
+    Une requête sans place attend au plus `queue_timeout` secondes ; les
+    places libérées vont aux requêtes en attente les plus prioritaires.
+    """
+
+    def __init__(self, limits: dict, max_active: int, shares: dict, queue_timeout: float,
+                 max_clients: int = ADMISSION_MAX_CLIENTS):
+        self.limits = {name: parse_rate_limit(value) for name, value in limits.items()}
+        self.max_active = max(1, max_active)
+        self.shares = shares
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+        self.active = {name: 0 for name in ADMISSION_CLASSES}
+        self._total = 0
+        self._buckets: OrderedDict = OrderedDict()  # (client, classe) -> TokenBucket, ordre LRU
+        self._waiters = []  # Tas de [priorité, ordre d'arrivée, classe, future]
+        self._sequence = 0
+
+    def check_rate(self, client: str, request_class: str) -> float:
+        """0 si le client peut envoyer une requête de cette classe, sinon secondes à attendre."""
+        limit = self.limits.get(request_class)
+        if limit is None:
+            return 0.0
+        key = (client, request_class)
+        bucket = self._buckets.pop(key, None) or TokenBucket(*limit)
+        self._buckets[key] = bucket
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return bucket.try_take()
+
+    async def acquire(self, request_class: str) -> bool:
+        """Réserve une place ; False si aucune ne s'est libérée à temps."""
+        priority = ADMISSION_CLASSES.index(request_class)
+        self._discard_cancelled()
+        if (not self._waiters or self._waiters[0][0] > priority) and self._has_room(request_class):
+            self._admit(request_class)
+            return True
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._waiters, [priority, self._sequence, request_class, future])
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(request_class)  # Place attribuée juste avant l'annulation
+            raise
+        finally:
+            metrics.observe("admission_wait_seconds", time.perf_counter() - start, **{"class": request_class})
+        return True
+
+    def release(self, request_class: str):
+        self.active[request_class] -= 1
+        self._total -= 1
+        self._wake()
+
+    def stats(self) -> dict:
+        return {"active": dict(self.active), "waiting": sum(1 for w in self._waiters if not w[3].done()),
+                "clients": len(self._buckets)}
+
+    def _has_room(self, request_class: str) -> bool:
+        return self._total < self.shares.get(request_class, 1.0) * self.max_active
+
+    def _admit(self, request_class: str):
+        self.active[request_class] += 1
+        self._total += 1
+
+    def _discard_cancelled(self):
+        while self._waiters and self._waiters[0][3].done():
+            heapq.heappop(self._waiters)
+
+    def _wake(self):
+        # Par priorité : si la première requête en attente n'a pas de place, les suivantes
+        # (parts plus petites) n'en ont pas non plus
+        self._discard_cancelled()
+        while self._waiters and self._has_room(self._waiters[0][2]):
+            _, _, request_class, future = heapq.heappop(self._waiters)
+            self._admit(request_class)
+            future.set_result(None)
+            self._discard_cancelled()
+
+admission = AdmissionController(RATE_LIMITS, ADMISSION_MAX_ACTIVE, ADMISSION_SHARES, ADMISSION_QUEUE_SECONDS)
+metrics.gauge("admission_active", "Requêtes admises en cours, par classe",
+              lambda: {(("class", k),): v for k, v in admission.active.items()})
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI appliquant l'AdmissionController avant le routage ;
+    refus en 429 avec Retry-After. /metrics n'est pas limité, les flux SSE
+    (longs mais peu coûteux) ne comptent que pour le débit. Une requête
+    `serve` rend sa place dès l'envoi des en-têtes : son corps (fichier
+    déjà prêt, débit plafonné) avance au rythme du client. Les autres
+    classes la gardent jusqu'au bout : le corps d'un streaming, d'un zip
+    de lot ou d'une édition est produit pendant l'envoi.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+        name = request_class(scope["method"], scope["path"])
+        retry_after = admission.check_rate(client_identity(scope), name)
+        if retry_after:
+            return await self.reject(scope, receive, send, name, "rate", retry_after)
+        if scope["path"].endswith('/events'):
+            return await self.app(scope, receive, send)
+        if not await admission.acquire(name):
+            return await self.reject(scope, receive, send, name, "capacity", admission.queue_timeout)
+        held = [True]
+
+        def release():
+            if held:
+                held.pop()
+                admission.release(name)
+
+        async def send_released(message):
+            if message["type"] == "http.response.start":
+                release()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_released if name == 'serve' else send)
+        finally:
+            release()
+
+    async def reject(self, scope, receive, send, name: str, reason: str, retry_after: float):
+        metrics.inc("admission_rejected_total", **{"class": name, "reason": reason})
+        detail = ("Trop de requêtes, réessayez plus tard" if reason == "rate"
+                  else "Serveur surchargé, réessayez plus tard")
+        response = JSONResponse({"detail": detail}, status_code=429,
+                                headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+        await response(scope, receive, send)
+
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+async def measure_event_loop_lag():
+    """Un retard élevé signale du travail bloquant exécuté sur la boucle."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        metrics.observe("event_loop_lag_seconds", max(time.perf_counter() - start - EVENT_LOOP_LAG_INTERVAL, 0.0))
+
+def directory_usage(directory: str) -> tuple:
+    """Taille totale et nombre de fichiers d'un dossier (non récursif)."""
+    size = count = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                size += entry.stat(follow_symlinks=False).st_size
+                count += 1
+    return size, count
+
+# État partagé entre workers (jobs, cache d'extraction, clés du store, verrous)
+class SQLiteState:
+    """
+    Stockage clé/valeur avec expiration dans un fichier SQLite (WAL).
+    Suffit pour plusieurs workers d'une même machine ou d'un même volume.
+    Les verrous sont des baux : ils expirent si leur détenteur disparaît.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl if ttl else None))
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def scan(self, prefix: str) -> dict:
+        """Clés non expirées commençant par `prefix` -> valeurs."""
+        rows = self._connect().execute(
+            "SELECT key, value FROM state WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)",
+            (prefix, prefix + "\uffff", time.time())).fetchall()
+        return dict(rows)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Prend (ou prolonge) le bail `name` s'il est libre, expiré ou déjà à `owner`."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO state (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE state.expires_at <= ? OR state.value = excluded.value",
+            (name, owner, now + ttl, now))
+        return cursor.rowcount > 0
+
+    def release(self, name: str, owner: str):
+        self._connect().execute("DELETE FROM state WHERE key = ? AND value = ?", (name, owner))
+
+    def purge(self):
+        self._connect().execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+
+class RedisState:
+    """Même interface sur Redis, pour plusieurs machines (dépendance optionnelle `redis`)."""
+
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_URL redis:// nécessite le paquet redis (pip install redis)")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._release = self.client.register_script(self.RELEASE_SCRIPT)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def scan(self, prefix: str) -> dict:
+        keys = list(self.client.scan_iter(match=f"{prefix}*"))
+        values = self.client.mget(keys) if keys else []
+        return {k: v for k, v in zip(keys, values) if v is not None}
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        if self.client.set(name, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        # Déjà détenu par nous : on prolonge le bail
+        return self.client.get(name) == owner and bool(self.client.pexpire(name, int(ttl * 1000)))
+
+    def release(self, name: str, owner: str):
+        self._release(keys=[name], args=[owner])
+
+    def purge(self):
+        pass  # Redis expire les clés lui-même
+
+def make_state(url: str):
+    if url.startswith(("redis://", "rediss://")):
+        return RedisState(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteState(url[len("sqlite:///"):])
+    raise ValueError(f"STATE_URL non supporté: {url}")
+
+state = make_state(STATE_URL)
+
+class StateWriter:
+    """
+    Écritures différées du backend partagé (état des jobs, derniers accès
+    du store), faites par un thread dédié : les appelants, boucle
+    d'événements comprise, n'attendent jamais un verrou SQLite ou un
+    aller-retour Redis. Les écritures d'une même clé en attente sont
+    fusionnées, la dernière l'emporte.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._pending: OrderedDict = OrderedDict()  # clé -> (valeur, ttl) ; valeur None : suppression
+        self._busy = False
+        self._changed = threading.Condition(threading.Lock())
+        self._thread: Optional[threading.Thread] = None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._enqueue(key, (value, ttl))
+
+    def delete(self, key: str):
+        self._enqueue(key, (None, None))
+
+    def flush(self, timeout: float = 5):
+        """Attend l'écriture de tout ce qui est en attente (arrêt du worker)."""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while self._pending or self._busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self._changed.wait(remaining)
+
+    def _enqueue(self, key: str, item: tuple):
+        with self._changed:
+            self._pending.pop(key, None)
+            self._pending[key] = item
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+                self._thread.start()
+            self._changed.notify_all()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._busy = False
+                self._changed.notify_all()
+                while not self._pending:
+                    self._changed.wait()
+                batch, self._pending = self._pending, OrderedDict()
+                self._busy = True
+            for key, (value, ttl) in batch.items():
+                try:
+                    if value is None:
+                        self.backend.delete(key)
+                    else:
+                        self.backend.set(key, value, ttl=ttl)
+                except Exception as e:
+                    logging.error(f"Écriture de l'état partagé {key} impossible: {str(e)}")
+
+state_writer = StateWriter(state)
+
+@contextmanager
+def shared_lock(name: str, ttl: float, poll_interval: float = 0.5):
+    """Verrou entre workers (appelé depuis un thread : l'attente est bloquante)."""
+    owner = f"{WORKER_ID}:{threading.get_ident()}"
+    while not state.acquire(name, owner, ttl):
+        time.sleep(poll_interval)
+    try:
+        yield
+    finally:
+        state.release(name, owner)
+
 # Liste des domaines bloqués
 BLOCKED_DOMAINS = [
     "netflix.com",
@@ -82,6 +746,13 @@ BLOCKED_DOMAINS = [
 class DownloadRequest(BaseModel):
     url: HttpUrl
     format: str = "mp4"
+    accept: Optional[List[str]] = None  # Audio : codecs/conteneurs acceptés, par ordre de préférence
+
+    def audio_targets(self) -> Optional[List[str]]:
+        """Conteneurs audio acceptables, ou None pour une demande vidéo."""
+        if self.format.lower() not in AUDIO_REQUEST_FORMATS:
+            return None
+        return audio_targets(self.accept or ['mp3'])
 
     @property
     def sanitized_format(self):
@@ -92,6 +763,14 @@ class DownloadRequest(BaseModel):
         domain = parsed_url.netloc.lower()
         return any(blocked in domain for blocked in BLOCKED_DOMAINS)
 
+class BatchDownloadRequest(BaseModel):
+    urls: List[HttpUrl] = []
+    playlist: Optional[HttpUrl] = None  # Développée en extraction "flat"
+    format: str = "mp4"
+    accept: Optional[List[str]] = None
+    parallelism: Optional[int] = None  # Éléments téléchargés simultanément (défaut : DOWNLOAD_WORKERS)
+    output: str = "ndjson"  # "ndjson" (flux d'état) ou "zip" (archive construite à la volée)
+
 class DownloadResponse(BaseModel):
     filename: str
     format: str
@@ -114,14 +793,37 @@ class VideoInfo(BaseModel):
     thumbnail: Optional[str]
     duration: Optional[float]
 
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+
+class JobStatus(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    stage: Optional[str]
+    downloaded_bytes: int = 0
+    total_bytes: Optional[int]
+    progress: Optional[float]
+    speed: Optional[float]
+    eta: Optional[float]
+    fragment_index: Optional[int] = None  # HLS/DASH
+    fragment_count: Optional[int] = None
+    frame: Optional[int] = None  # ffmpeg
+    encode_speed: Optional[float] = None  # ffmpeg, multiple du temps réel
+    result: Optional[dict]
+    error: Optional[str]
+
 class CutRequest(BaseModel):
     filename: str
     start_time: str
     end_time: str
+    precise: bool = False  # Coupe à l'image près (ré-encode uniquement les GOP partiels)
 
 class DivideRequest(BaseModel):
     filename: str
-    segments: int
+    segments: int = Field(..., ge=1)  # 0 diviserait par zéro, un négatif irait jusqu'à ffmpeg
+    exact: bool = False  # Découpe exacte (ré-encodage) plutôt qu'alignée sur les images clés
 
 class CommentRequest(BaseModel):
     filename: str
@@ -133,455 +835,3933 @@ class ExportRequest(BaseModel):
     filename: str
     format: str
 
-async def cleanup_old_files():
-    """Supprime les fichiers plus vieux que MAX_FILE_AGE_MINUTES"""
-    while True:
-        try:
-            current_time = datetime.now()
-            for filename in os.listdir(DOWNLOAD_DIR):
-                file_path = os.path.join(DOWNLOAD_DIR, filename)
-                file_modified = datetime.fromtimestamp(os.path.getmtime(file_path))
-                if current_time - file_modified > timedelta(minutes=MAX_FILE_AGE_MINUTES):
-                    os.remove(file_path)
-                    logging.info(f"Fichier supprimé: {filename}")
-        except Exception as e:
-            logging.error(f"Erreur lors du nettoyage: {str(e)}")
-        await asyncio.sleep(300)  # Vérifie toutes les 5 minutes
+class PipelineOperation(BaseModel):
+    op: str  # cut, comment ou export
+    start_time: Optional[str] = None  # cut
+    end_time: Optional[str] = None
+    text: Optional[str] = None  # comment
+    time: Optional[str] = None
+    duration: Optional[float] = None
+    format: Optional[str] = None  # export
 
-@app.on_event("startup")
-async def startup_event():
-    asyncio.create_task(cleanup_old_files())
+class PipelineRequest(BaseModel):
+    filename: str
+    operations: List[PipelineOperation]
 
-def get_best_format(ydl, url, requested_format):
+# File d'attente des jobs de téléchargement
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_FINISHED = "finished"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_DONE_STATES = (JOB_FINISHED, JOB_FAILED, JOB_CANCELLED)
+
+class JobCancelled(Exception):
+    """Levée dans un worker lorsque son job a été annulé."""
+
+class Job:
+    """État d'un traitement long (téléchargement, édition) suivi via /jobs/{id}."""
+
+    def __init__(self, kind: str, host: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.host = host
+        self.status = JOB_QUEUED
+        self.stage: Optional[str] = None
+        self.downloaded_bytes = 0
+        self.total_bytes: Optional[int] = None
+        self.speed: Optional[float] = None
+        self.eta: Optional[float] = None
+        self.progress: Optional[float] = None  # Renseigné quand la taille n'est pas connue (ffmpeg)
+        self.fragment_index: Optional[int] = None
+        self.fragment_count: Optional[int] = None
+        self.frame: Optional[int] = None
+        self.encode_speed: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.children: List[str] = []  # Jobs annulés avec celui-ci (éléments d'un lot)
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self._callbacks = []
+        self._published_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, **fields):
+        with self._lock:
+            changed = any(getattr(self, k) != fields[k] for k in ('status', 'stage') if k in fields)
+            for key, value in fields.items():
+                setattr(self, key, value)
+        self.publish(force=changed)
+        progress_hub.mark(self.id)
+
+    def publish(self, force: bool = False):
+        """
+        Copie l'état dans le backend partagé pour que /jobs/{id} réponde
+        depuis n'importe quel worker (écriture différée, non bloquante). La
+        progression est limitée à une écriture toutes les JOB_PUBLISH_INTERVAL
+        secondes.
+        """
+        now = time.monotonic()
+        if not force and now - self._published_at < JOB_PUBLISH_INTERVAL:
+            return
+        self._published_at = now
+        ttl = MAX_FILE_AGE_MINUTES * 60 if self.finished_at else 24 * 3600
+        state_writer.set(f"job:{self.id}", json.dumps(self.snapshot().dict()), ttl=ttl)
+
+    def finish(self, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            callbacks, self._callbacks = self._callbacks, []
+        self.publish(force=True)
+        progress_hub.mark(self.id)
+        self.done_event.set()
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Appelle `callback(job)` à la fin du job (immédiatement s'il est déjà fini)."""
+        with self._lock:
+            if self.finished_at is None:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def snapshot(self) -> JobStatus:
+        with self._lock:
+            progress = None
+            if self.status == JOB_FINISHED:
+                progress = 1.0
+            elif self.progress is not None:
+                progress = self.progress
+            elif self.total_bytes:
+                progress = min(self.downloaded_bytes / self.total_bytes, 1.0)
+            return JobStatus(
+                job_id=self.id,
+                kind=self.kind,
+                status=self.status,
+                stage=self.stage,
+                downloaded_bytes=self.downloaded_bytes,
+                total_bytes=self.total_bytes,
+                progress=progress,
+                speed=self.speed,
+                eta=self.eta,
+                fragment_index=self.fragment_index,
+                fragment_count=self.fragment_count,
+                frame=self.frame,
+                encode_speed=self.encode_speed,
+                result=self.result,
+                error=self.error
+            )
+
+class JobManager:
     """
-    Détermine le meilleur format disponible pour la vidéo.
+    Exécute les jobs dans un pool de threads borné.
+    Les jobs d'un même domaine sont limités à `per_host_limit` exécutions
+    simultanées : un job en attente sur un domaine saturé n'occupe pas de
+    worker et laisse passer les jobs des autres domaines.
     """
-    try:
-        # Configuration avancée pour yt-dlp
-        ydl.params.update({
-            'nocheckcertificate': True,
-            'no_warnings': False,
-            'extract_flat': False,
-            'youtube_include_dash_manifest': True,
-            'format': 'best',
-        })
-        
-        # Extraction des informations sans téléchargement
-        info = ydl.extract_info(url, download=False)
-        
-        if requested_format.lower() == "mp3":
-            # Pour MP3, on cherche le meilleur format audio
-            return 'bestaudio/best'
-        
-        # Pour les vidéos, on cherche le meilleur format compatible
-        available_formats = info.get('formats', [])
-        
-        # Filtrer les formats vidéo
-        video_formats = [f for f in available_formats if f.get('vcodec') != 'none']
-        
-        if not video_formats:
-            return 'best'  # Si aucun format vidéo n'est trouvé
-            
-        # Trier par qualité (résolution)
-        video_formats.sort(key=lambda f: (
-            f.get('height', 0) if f.get('height') else 0,
-            f.get('tbr', 0) if f.get('tbr') else 0
-        ), reverse=True)
-        
-        # Sélectionner le meilleur format disponible
-        best_format = video_formats[0]
-        format_id = best_format.get('format_id', 'best')
-        
-        return f"{format_id}+bestaudio/best"
-        
-    except Exception as e:
-        logging.error(f"Erreur lors de la vérification des formats: {str(e)}")
-        return 'best'  # Format par défaut en cas d'erreur
 
-@app.post("/download", response_model=DownloadResponse)
-async def download_video(data: DownloadRequest):
-    if data.is_blocked_url():
-        raise HTTPException(
-            status_code=403,
-            detail="Cette source est protégée par des droits d'auteur et ne peut pas être téléchargée"
-        )
+    def __init__(self, max_workers: int, per_host_limit: int):
+        self.max_workers = max(1, max_workers)
+        self.per_host_limit = max(1, per_host_limit)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="download")
+        self.jobs: dict[str, Job] = {}
+        self._pending: deque = deque()
+        self._running = 0
+        self._running_per_host: dict[str, int] = {}
+        self._lock = threading.Lock()
 
-    try:
-        # Configuration mise à jour pour le téléchargement
-        ydl_opts = {
-            'format': data.format,
-            'outtmpl': os.path.join(DOWNLOAD_DIR, '%(title)s-%(format_id)s.%(ext)s'),
-            'quiet': True,
-            'noplaylist': True,
-            'writethumbnail': True,
-            'nocheckcertificate': True,
-            'no_check_certificate': True,
-            'prefer_insecure': True
-        }
+    def submit(self, kind: str, func, *args, host: Optional[str] = None) -> Job:
+        """Met en file `func(job, *args)` et retourne le job immédiatement."""
+        job = Job(kind, host)
+        job.publish(force=True)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._pending.append((job, func, args))
+        self._dispatch()
+        return job
 
-        # Si c'est un format audio uniquement
-        if data.format.lower() in ['bestaudio', 'mp3']:
-            ydl_opts.update({
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'extractaudio': True,
-                'audioformat': 'mp3',
-                'audioquality': '0',  # Meilleure qualité
-                'final_ext': 'mp3',  # Force l'extension finale en mp3
-            })
+    def register(self, kind: str) -> Job:
+        """Enregistre un job exécuté hors du pool (ex: ffmpeg sur la boucle asyncio)."""
+        job = Job(kind)
+        job.status = JOB_RUNNING
+        job.publish(force=True)
+        with self._lock:
+            self.jobs[job.id] = job
+        return job
 
-        logging.info(f"Début du téléchargement: {data.url} (format: {data.format})")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(str(data.url), download=True)
-            filename = ydl.prepare_filename(info)
-            
-            # Nettoyer le nom de fichier des caractères spéciaux
-            clean_filename = os.path.basename(filename)
-            clean_filename = "".join(c for c in clean_filename if c.isalnum() or c in ('-', '_', '.'))
-            
-            # Si c'est un format audio, s'assurer que l'extension est .mp3
-            if data.format == 'bestaudio' and not clean_filename.endswith('.mp3'):
-                clean_filename = os.path.splitext(clean_filename)[0] + '.mp3'
-            
-            # Renommer le fichier si nécessaire
-            if os.path.basename(filename) != clean_filename:
-                new_path = os.path.join(DOWNLOAD_DIR, clean_filename)
-                os.rename(filename, new_path)
-                filename = new_path
-        
-        response_data = DownloadResponse(
-            filename=os.path.basename(filename),
-            format=data.format,
-            title=info.get('title'),
-            duration=info.get('duration'),
-            thumbnail=info.get('thumbnail')
-        )
-        
-        logging.info(f"Téléchargement réussi: {response_data.filename}")
-        return response_data
-    
-    except Exception as e:
-        error_msg = str(e)
-        logging.error(f"Erreur de téléchargement: {error_msg}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Erreur lors du téléchargement: {error_msg}"
-        )
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
 
-@app.get("/file/{filename}")
-def get_file(filename: str):
-    file_path = os.path.join(DOWNLOAD_DIR, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Fichier non trouvé")
-    
-    return FileResponse(
-        file_path,
-        media_type='application/octet-stream',
-        filename=filename
-    )
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is None or job.status in JOB_DONE_STATES:
+            return job
+        job.cancel_event.set()
+        for child_id in job.children:
+            self.cancel(child_id)
+        with self._lock:
+            entry = next((e for e in self._pending if e[0] is job), None)
+            if entry is not None:
+                self._pending.remove(entry)
+        if entry is not None:
+            job.finish(JOB_CANCELLED, error="Job annulé")
+        return job
 
-@app.get("/health")
-def health_check():
-    return {"status": "ok"}
+    def prune(self, max_age_seconds: float):
+        """Oublie les jobs terminés depuis plus de `max_age_seconds`."""
+        limit = time.time() - max_age_seconds
+        with self._lock:
+            for job_id, job in list(self.jobs.items()):
+                if job.finished_at is not None and job.finished_at < limit:
+                    del self.jobs[job_id]
 
-def filter_best_formats(formats):
+    def shutdown(self):
+        for job in list(self.jobs.values()):
+            job.cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            while self._running < self.max_workers:
+                entry = next(
+                    (e for e in self._pending
+                     if self._running_per_host.get(e[0].host, 0) < self.per_host_limit),
+                    None
+                )
+                if entry is None:
+                    break
+                self._pending.remove(entry)
+                job = entry[0]
+                self._running += 1
+                self._running_per_host[job.host] = self._running_per_host.get(job.host, 0) + 1
+                started.append(entry)
+        # Hors du verrou : la publication et les abonnés SSE ne retardent pas les autres threads
+        for entry in started:
+            entry[0].update(status=JOB_RUNNING)
+            self.executor.submit(self._run, *entry)
+
+    def _run(self, job: Job, func, args):
+        try:
+            result = func(job, *args)
+            job.finish(JOB_FINISHED, result=result)
+        except JobCancelled:
+            job.finish(JOB_CANCELLED, error="Job annulé")
+        except Exception as e:
+            if job.cancel_event.is_set():
+                job.finish(JOB_CANCELLED, error="Job annulé")
+            else:
+                job.finish(JOB_FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._running_per_host[job.host] -= 1
+                if not self._running_per_host[job.host]:
+                    del self._running_per_host[job.host]
+            self._dispatch()
+
+job_manager = JobManager(DOWNLOAD_WORKERS, MAX_DOWNLOADS_PER_HOST)
+
+class ProgressHub:
     """
-    Sélectionne les formats vidéo selon la qualité :
-    - La plus haute qualité disponible
-    - 3 qualités moyennes
-    - Une qualité plus basse
-    - La meilleure qualité audio
+    Diffusion de la progression des jobs aux clients SSE.
+    Les mises à jour (hooks yt-dlp, sortie `-progress` de ffmpeg) ne font
+    que marquer le job ; toutes les `interval` secondes, l'état de chaque
+    job modifié et suivi est sérialisé une seule fois puis remis à ses
+    abonnés, qui ne conservent que le dernier message. Le coût ne dépend
+    ni du rythme des hooks ni du nombre d'abonnés. Les jobs d'un autre
+    worker sont relus dans l'état partagé au même rythme.
     """
-    video_formats = []
-    audio_formats = []
-    
-    # Séparer les formats vidéo et audio
-    for f in formats:
-        try:
-            if f.get('vcodec', 'none') != 'none' and f.get('acodec', 'none') != 'none':
-                height = int(f.get('height', 0) or 0)
-                fps = float(f.get('fps', 0) or 0)
-                filesize = float(f.get('filesize', 0) or 0)
-                # Score basé sur la résolution, FPS et taille
-                score = height + (fps / 30)
-                if height > 0:  # Ignorer les formats sans résolution
-                    video_formats.append((score, height, filesize, f))
-            elif f.get('vcodec', 'none') == 'none' and f.get('acodec', 'none') != 'none':
-                # Format audio uniquement
-                abr = float(f.get('abr', 0) or 0)
-                if abr > 0:  # Ignorer les formats sans bitrate
-                    audio_formats.append((abr, f))
-        except (TypeError, ValueError):
-            continue
 
-    selected_formats = []
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._subscribers: dict[str, set] = {}  # job -> files d'un message (dernier état)
+        self._last: dict[str, str] = {}  # job -> dernier message diffusé
+        self._dirty: set = set()
+        self._dirty_lock = threading.Lock()
 
-    # Sélection des formats vidéo
-    if video_formats:
-        # Trier par score décroissant
-        video_formats.sort(key=lambda x: x[0], reverse=True)
-        
-        # 1. La plus haute qualité
-        selected_formats.append(video_formats[0][3])
-        
-        # 2. Trois qualités moyennes
-        if len(video_formats) > 4:
-            middle_range = video_formats[1:-1]  # Exclure le plus haut et le plus bas
-            step = len(middle_range) // 3
-            if step > 0:
-                for i in range(3):
-                    idx = min(i * step, len(middle_range) - 1)
-                    if middle_range[idx][3] not in selected_formats:
-                        selected_formats.append(middle_range[idx][3])
-        
-        # 3. Une qualité basse (mais pas la plus basse)
-        if len(video_formats) > 2:
-            low_quality_idx = max(len(video_formats) // 4, 1)
-            if video_formats[-low_quality_idx][3] not in selected_formats:
-                selected_formats.append(video_formats[-low_quality_idx][3])
+    @property
+    def subscribers(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
 
-    # Ajouter le meilleur format audio
-    if audio_formats:
-        # Trier par bitrate décroissant
-        audio_formats.sort(key=lambda x: x[0], reverse=True)
-        best_audio = audio_formats[0][1]
-        selected_formats.append(best_audio)
+    def mark(self, job_id: str):
+        """Signale un changement ; appelable depuis n'importe quel thread."""
+        with self._dirty_lock:
+            self._dirty.add(job_id)
 
-    return selected_formats
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
 
-@app.get("/formats")
-async def get_formats(url: str):
-    """Récupère les formats disponibles pour une URL donnée."""
-    try:
-        # Configuration mise à jour pour yt-dlp
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': False,  # Activer les avertissements pour le débogage
-            'extract_flat': False,
-            'format': 'best',
-            'nocheckcertificate': True,
-            'no_check_certificate': True,
-            'prefer_insecure': True,
-            'ignoreerrors': True,  # Ignorer les erreurs non critiques
-            'youtube_include_dash_manifest': True,  # Inclure les formats DASH
-            'youtube_include_hls_manifest': True,   # Inclure les formats HLS
-            'verbose': True,  # Activer le mode verbeux pour le débogage
-        }
-        
-        logging.info(f"Tentative de récupération des formats pour l'URL: {url}")
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(url, download=False)
-                if info is None:
-                    raise ValueError("Impossible d'extraire les informations de la vidéo")
-                
-                logging.info(f"Formats trouvés: {len(info.get('formats', []))}")
-                
-                # Filtrer pour obtenir les meilleurs formats
-                best_formats = filter_best_formats(info.get('formats', []))
-                
-                if not best_formats:
-                    raise ValueError("Aucun format compatible n'a été trouvé")
-                
-                # Convertir en FormatInfo
-                formats = []
-                for f in best_formats:
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[job_id]
+                self._last.pop(job_id, None)
+
+    @staticmethod
+    def format(snapshot: JobStatus) -> tuple:
+        """(terminé, message SSE) ; l'état complet est envoyé à chaque fois."""
+        done = snapshot.status in JOB_DONE_STATES
+        event = "done" if done else "progress"
+        return done, f"event: {event}\ndata: {json.dumps(snapshot.dict())}\n\n"
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+            for job_id in list(self._subscribers):
+                job = job_manager.get(job_id)
+                if job is not None:
+                    if job_id not in dirty:
+                        continue
+                    snapshot = job.snapshot()
+                else:
                     try:
-                        format_note = []
-                        
-                        if f.get('vcodec', 'none') != 'none':
-                            height = int(f.get('height', 0) or 0)
-                            if height > 0:
-                                format_note.append(f"{height}p")
-                            
-                            fps = float(f.get('fps', 0) or 0)
-                            if fps > 30:
-                                format_note.append(f"{int(fps)}fps")
-                        
-                        if f.get('acodec', 'none') != 'none':
-                            if f.get('vcodec', 'none') == 'none':
-                                format_note.append("Audio")
-                            abr = float(f.get('abr', 0) or 0)
-                            if abr > 0:
-                                format_note.append(f"{int(abr)}kbps")
-                        
-                        formats.append(FormatInfo(
-                            format_id=f.get('format_id', ''),
-                            ext=f.get('ext', ''),
-                            resolution=f"{int(f.get('height', 0) or 0)}p" if f.get('height') else None,
-                            filesize=float(f.get('filesize', 0) or 0),
-                            format_note=' - '.join(format_note) if format_note else "Format inconnu",
-                            vcodec=f.get('vcodec'),
-                            acodec=f.get('acodec')
-                        ))
-                    except (TypeError, ValueError) as e:
-                        logging.warning(f"Erreur lors du traitement d'un format: {str(e)}")
+                        snapshot = await run_in_threadpool(remote_job, job_id)
+                    except Exception as e:
+                        logging.error(f"Lecture du job {job_id} impossible: {str(e)}")
+                        continue
+                    if snapshot is None:
                         continue
+                done, message = self.format(snapshot)
+                if self._last.get(job_id) == message:
+                    continue
+                self._last[job_id] = message
+                for queue in self._subscribers.get(job_id, ()):
+                    if queue.full():
+                        queue.get_nowait()  # L'abonné lent ne reçoit que le dernier état
+                    queue.put_nowait((done, message))
 
-                if not formats:
-                    raise ValueError("Aucun format valide n'a été trouvé après le filtrage")
+progress_hub = ProgressHub(PROGRESS_INTERVAL)
 
-                return VideoInfo(
-                    title=info.get('title', ''),
-                    formats=formats,
-                    thumbnail=info.get('thumbnail'),
-                    duration=info.get('duration')
-                )
+def make_progress_hook(job: Job):
+    """Hook yt-dlp qui reporte la progression dans le job et gère l'annulation."""
+    started = {}  # Fichier -> début du téléchargement
 
-            except yt_dlp.utils.DownloadError as e:
-                logging.error(f"Erreur yt-dlp lors de l'extraction: {str(e)}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Erreur lors de l'extraction des informations: {str(e)}"
-                )
+    def hook(d):
+        import yt_dlp
+        if job.cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled("Job annulé")
+        if d.get('status') == 'downloading':
+            started.setdefault(d.get('filename'), time.perf_counter())
+            job.update(
+                stage='downloading',
+                downloaded_bytes=d.get('downloaded_bytes') or 0,
+                total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                speed=d.get('speed'),
+                eta=d.get('eta'),
+                fragment_index=d.get('fragment_index'),
+                fragment_count=d.get('fragment_count')
+            )
+        elif d.get('status') == 'finished':
+            job.update(downloaded_bytes=d.get('downloaded_bytes') or job.downloaded_bytes)
+            metrics.inc("downloaded_bytes_total", d.get('downloaded_bytes') or d.get('total_bytes') or 0)
+            start = started.pop(d.get('filename'), None)
+            if start is not None:
+                metrics.observe("stage_duration_seconds", time.perf_counter() - start, stage="download")
+    return hook
 
-    except Exception as e:
-        logging.error(f"Erreur lors de la récupération des formats: {str(e)}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Erreur lors de la récupération des formats: {str(e)}"
-        )
+def make_postprocessor_hook(job: Job):
+    started = {}  # Post-traitement -> début
 
-@app.get("/", response_class=HTMLResponse)
-async def root(request: Request):
-    try:
-        return templates.TemplateResponse("index.html", {"request": request})
-    except Exception as e:
-        logging.error(f"Erreur lors du rendu de index.html: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    def hook(d):
+        import yt_dlp
+        if job.cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled("Job annulé")
+        # MoveFiles ne fait que renommer le fichier vers sa destination finale
+        stage = "rename" if d.get('postprocessor') == 'MoveFiles' else "postprocess"
+        if d.get('status') == 'started':
+            job.update(stage='postprocessing')
+            started[d.get('postprocessor')] = time.perf_counter()
+        elif d.get('status') == 'finished' and d.get('postprocessor') in started:
+            metrics.observe("stage_duration_seconds", time.perf_counter() - started.pop(d.get('postprocessor')),
+                            stage=stage)
+    return hook
 
-@app.get("/video_editor", response_class=HTMLResponse)
-async def editor(request: Request):
-    try:
-        return templates.TemplateResponse("video_editor.html", {"request": request})
-    except Exception as e:
-        logging.error(f"Erreur lors du rendu de video_editor.html: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+# Stockage local des fichiers téléchargés, adressé par contenu demandé
+class StoreEntry:
+    """Fichier de DOWNLOAD_DIR connu du store."""
 
-# Fonctions d'édition vidéo
-def cut_video(input_file: str, output_file: str, start_time: str, end_time: str) -> bool:
-    try:
-        cmd = [
-            'ffmpeg', '-i', input_file,
-            '-ss', start_time,
-            '-to', end_time,
-            '-c', 'copy',
-            output_file
-        ]
-        subprocess.run(cmd, check=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Erreur lors du découpage de la vidéo: {str(e)}")
-        return False
+    def __init__(self, filename: str, key: Optional[str] = None, size: int = 0,
+                 created_at: Optional[float] = None, last_access: Optional[float] = None,
+                 meta: Optional[dict] = None, extra_files: Optional[List[str]] = None):
+        self.filename = filename
+        self.key = key
+        self.size = size
+        self.created_at = created_at or time.time()
+        self.last_access = last_access or self.created_at
+        self.meta = meta or {}
+        self.extra_files = extra_files or []
+        self.pins = 0
+        self.heap_expiry: Optional[float] = None  # Échéance de l'élément valide dans le tas
 
-def divide_video(input_file: str, segments: int, output_pattern: str) -> List[str]:
-    try:
-        # Obtenir la durée totale de la vidéo
-        cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', input_file]
-        duration = float(subprocess.check_output(cmd).decode().strip())
-        
-        # Calculer la durée de chaque segment
-        segment_duration = duration / segments
-        output_files = []
-        
-        for i in range(segments):
-            start_time = i * segment_duration
-            output_file = output_pattern.format(i + 1)
-            
-            cmd = [
-                'ffmpeg', '-i', input_file,
-                '-ss', str(start_time),
-                '-t', str(segment_duration),
-                '-c', 'copy',
-                output_file
-            ]
-            subprocess.run(cmd, check=True)
-            output_files.append(os.path.basename(output_file))
-        
-        return output_files
-    except (subprocess.CalledProcessError, ValueError) as e:
-        logging.error(f"Erreur lors de la division de la vidéo: {str(e)}")
-        return []
+    def to_dict(self) -> dict:
+        return {
+            "filename": self.filename,
+            "key": self.key,
+            "size": self.size,
+            "created_at": self.created_at,
+            "last_access": self.last_access,
+            "meta": self.meta,
+            "extra_files": self.extra_files,
+        }
 
-def add_comment_to_video(input_file: str, output_file: str, text: str, time: str, duration: int) -> bool:
-    try:
-        # Convertir le temps en secondes
-        h, m, s = map(int, time.split(':'))
-        start_seconds = h * 3600 + m * 60 + s
-        
-        cmd = [
-            'ffmpeg', '-i', input_file,
-            '-vf', f"drawtext=text='{text}':fontcolor=white:fontsize=24:box=1:boxcolor=black@0.5:boxborderw=5:x=(w-text_w)/2:y=h-th-10:enable='between(t,{start_seconds},{start_seconds + duration})'",
-            '-c:a', 'copy',
-            output_file
-        ]
-        subprocess.run(cmd, check=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Erreur lors de l'ajout du commentaire: {str(e)}")
-        return False
+class StoreFullError(Exception):
+    """Le quota du store est occupé par des fichiers en cours d'utilisation."""
 
-# Routes pour l'édition vidéo
-@app.post("/api/edit/cut")
-async def edit_cut_video(request: CutRequest):
-    input_file = os.path.join(DOWNLOAD_DIR, request.filename)
-    if not os.path.exists(input_file):
-        raise HTTPException(status_code=404, detail="Fichier non trouvé")
-    
-    output_file = os.path.join(TEMP_DIR, f"cut_{uuid.uuid4()}.mp4")
-    if cut_video(input_file, output_file, request.start_time, request.end_time):
-        shutil.move(output_file, input_file)
-        return {"success": True, "message": "Vidéo découpée avec succès"}
-    else:
-        raise HTTPException(status_code=500, detail="Erreur lors du découpage de la vidéo")
+def is_partial_download(filename: str) -> bool:
+    """Fichier intermédiaire de yt-dlp (.part, fragments, fusion en cours)."""
+    return filename.endswith(('.part', '.ytdl')) or '.part-Frag' in filename or '.temp.' in filename
 
-@app.post("/api/edit/divide")
-async def edit_divide_video(request: DivideRequest):
-    input_file = os.path.join(DOWNLOAD_DIR, request.filename)
-    if not os.path.exists(input_file):
-        raise HTTPException(status_code=404, detail="Fichier non trouvé")
-    
-    output_pattern = os.path.join(TEMP_DIR, f"segment_{uuid.uuid4()}_{{0}}.mp4")
-    output_files = divide_video(input_file, request.segments, output_pattern)
-    
-    if output_files:
-        return {"success": True, "files": output_files}
-    else:
-        raise HTTPException(status_code=500, detail="Erreur lors de la division de la vidéo")
+class MediaStore:
+    """
+    Index des fichiers de DOWNLOAD_DIR.
+    Les téléchargements sont indexés par une clé dérivée de (extracteur,
+    id vidéo, sélecteur de format, chaîne de post-traitement) : une requête
+    identique est servie depuis le disque sans retourner à la source.
+    Les fichiers en cours d'envoi sont épinglés et ne sont jamais évincés.
+    L'éviction supprime les fichiers inactifs depuis `ttl` secondes puis les
+    moins récemment utilisés tant que le total dépasse `max_bytes`. Un tas
+    ordonné par échéance la rend incrémentale (pas de parcours du dossier),
+    et le quota est appliqué dès l'ajout d'un fichier. Les téléchargements
+    réservent leur taille estimée : si le quota est occupé par des fichiers
+    épinglés et d'autres réservations, ils attendent ou sont refusés.
+    Avec plusieurs workers sur un même dossier, `remote` partage les clés,
+    les derniers accès et les verrous de téléchargement, et chaque worker y
+    publie ses réservations et ses fichiers épinglés (voir `sync`). Seul le
+    leader évince et écrit l'index : il relit le dossier, où tous les workers
+    ajoutent leurs fichiers, et respecte les épinglages des autres workers,
+    si bien que le quota est global.
+    """
 
-@app.post("/api/edit/comment")
-async def edit_add_comment(request: CommentRequest):
+    def __init__(self, directory: str, index_file: str, max_bytes: int, ttl: float, remote=None, writer=None):
+        self.directory = directory
+        self.index_file = index_file
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.remote = remote
+        self.writer = writer or remote  # Écritures de l'état partagé, hors du thread appelant
+        self.leader = remote is None  # Élu par le nettoyage périodique quand l'état est partagé
+        self.worker_id = WORKER_ID
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[str, StoreEntry] = {}  # nom de fichier -> entrée
+        self._by_key: dict[str, str] = {}  # clé -> nom de fichier
+        self._key_locks: dict[str, list] = {}  # clé -> [verrou, utilisateurs]
+        self._expiry: list = []  # Tas (échéance, nom de fichier), invalidé paresseusement
+        self._bytes = 0
+        self._pinned_bytes = 0
+        self._reserved = 0
+        self._others_reserved = 0  # Réservations des autres workers (dernière lecture de `remote`)
+        self._others_pinned: dict[str, int] = {}  # Fichiers épinglés par les autres workers -> taille
+        self._remove_callbacks = []
+        self._dirty = False  # Index modifié depuis la dernière écriture (voir `flush`)
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)  # Signalée quand de la place se libère
+
+    @staticmethod
+    def make_key(source: str, format_selector: str, postprocessors: str) -> str:
+        raw = "\x1f".join((source, format_selector, postprocessors))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def on_remove(self, callback):
+        """`callback(chemins)` est appelé après chaque suppression de fichiers."""
+        self._remove_callbacks.append(callback)
+
+    def load(self):
+        """Recharge l'index et le réconcilie avec le contenu du dossier."""
+        entries = []
+        try:
+            with open(self.index_file) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.error(f"Index du store illisible, reconstruction: {str(e)}")
+        with self._lock:
+            for data in entries:
+                try:
+                    entry = StoreEntry(**data)
+                except (TypeError, ValueError) as e:
+                    # Entrée d'une autre version ou corrompue : le fichier sera réadopté par reconcile
+                    logging.warning(f"Entrée d'index du store ignorée: {data!r} ({str(e)})")
+                    continue
+                if os.path.isfile(self._path(entry.filename)):
+                    self._index(entry)
+        self.reconcile()
+        self.save()
+        self.flush()
+
+    def reconcile(self) -> bool:
+        """
+        Aligne l'index sur le dossier : adopte les fichiers inconnus (ajoutés
+        par un autre worker ou hors de l'application), oublie les disparus et
+        reprend la taille des fichiers modifiés. Retourne True si l'index a changé.
+        """
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for item in entries:
+                # Les fichiers cachés (uploads) et partiels (téléchargements) ne font pas partie du store
+                if item.name.startswith('.') or is_partial_download(item.name):
+                    continue
+                try:
+                    if item.is_file():
+                        files[item.name] = item.stat()
+                except FileNotFoundError:
+                    pass
+        changed = False
+        with self._lock:
+            for entry in list(self._entries.values()):
+                stat = files.get(entry.filename)
+                if stat is None:
+                    self._unindex(entry)
+                    changed = True
+                elif stat.st_size != entry.size:
+                    self._unindex(entry)
+                    entry.size = stat.st_size
+                    self._index(entry)
+                    changed = True
+            for filename, stat in files.items():
+                if filename not in self._entries:
+                    self._index(StoreEntry(filename, size=stat.st_size,
+                                           created_at=stat.st_mtime, last_access=stat.st_mtime))
+                    changed = True
+        return changed
+
+    def sync(self):
+        """
+        Publie l'occupation de ce worker (réservations, fichiers épinglés) et
+        lit celle des autres. Le leader relit aussi le dossier partagé et
+        applique le quota à l'ensemble des fichiers. Écrit enfin l'index
+        s'il a changé.
+        """
+        if self.remote is not None:
+            self._publish_usage()
+            self._read_usage()
+            if self.leader:
+                changed = self.reconcile()
+                if not self.make_room() and changed:
+                    self.save()
+        self.flush()
+
+    def save(self):
+        """
+        Marque l'index comme modifié. Il est écrit par `flush`, appelé par
+        `sync` toutes les STORE_SYNC_INTERVAL secondes et à l'arrêt : une
+        écriture (complète) par intervalle, pas une par ajout ou éviction.
+        """
+        self._dirty = True
+
+    def flush(self):
+        """Écrit l'index s'il a changé depuis la dernière écriture."""
+        if not self.leader:
+            return  # Un seul écrivain : l'index d'un autre worker ne connaît pas tous les fichiers
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            data = [e.to_dict() for e in self._entries.values()]
+        tmp_file = f"{self.index_file}.{os.getpid()}.tmp"  # Plusieurs workers peuvent écrire
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.index_file)
+
+    @contextmanager
+    def key_lock(self, key: str):
+        """Sérialise les téléchargements d'une même clé (aussi entre workers)."""
+        with self._lock:
+            slot = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            slot[1] += 1
+        try:
+            with slot[0]:
+                if self.remote is None:
+                    yield
+                else:
+                    with shared_lock(f"store-lock:{key}", STORE_LOCK_TTL):
+                        yield
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._key_locks[key]
+
+    def lookup(self, key: str) -> Optional[StoreEntry]:
+        with self._lock:
+            filename = self._by_key.get(key)
+            entry = self._entries.get(filename) if filename else None
+            if entry is not None and not os.path.isfile(self._path(filename)):
+                self._unindex(entry)
+                entry = None
+        if entry is None:
+            entry = self._adopt_remote(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.last_access = time.time()
+            return entry
+
+    def _adopt_remote(self, key: str) -> Optional[StoreEntry]:
+        """Fichier téléchargé par un autre worker dans le dossier partagé."""
+        if self.remote is None:
+            return None
+        data = self.remote.get(f"store:{key}")
+        if data is None:
+            return None
+        data = json.loads(data)
+        path = self._path(data["filename"])
+        if not os.path.isfile(path):
+            self.writer.delete(f"store:{key}")
+            return None
+        entry = StoreEntry(data["filename"], key=key, size=os.path.getsize(path),
+                           meta=data.get("meta"), extra_files=data.get("extra_files"))
+        with self._lock:
+            previous = self._entries.get(entry.filename)
+            if previous is not None:
+                entry.pins = previous.pins
+                self._unindex(previous)
+            self._index(entry)
+        return entry
+
+    def get(self, filename: str) -> Optional[StoreEntry]:
+        with self._lock:
+            return self._entries.get(filename)
+
+    def add(self, filename: str, key: Optional[str] = None, meta: Optional[dict] = None,
+            extra_files: Optional[List[str]] = None) -> StoreEntry:
+        """Indexe un fichier présent dans le dossier (téléchargement, upload...)."""
+        entry = StoreEntry(filename, key=key, size=os.path.getsize(self._path(filename)),
+                           meta=meta, extra_files=extra_files)
+        with self._lock:
+            previous = self._entries.get(filename)
+            if previous is not None:
+                entry.pins = previous.pins
+                self._unindex(previous)
+            self._index(entry)
+        if key and self.remote is not None:
+            self.writer.set(f"store:{key}", json.dumps(
+                {"filename": filename, "meta": entry.meta, "extra_files": entry.extra_files}))
+        self.make_room(keep=filename)  # Le fichier ajouté va être servi
+        self.save()
+        return entry
+
+    def refresh(self, filename: str):
+        """
+        Prend en compte un fichier modifié sur place : sa taille change et il
+        ne correspond plus au téléchargement d'origine, sa clé est retirée.
+        """
+        old_key = None
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None:
+                self._unindex(entry)
+                old_key, entry.key = entry.key, None
+                entry.size = os.path.getsize(self._path(filename))
+                entry.last_access = time.time()
+                self._index(entry)
+        if old_key and self.remote is not None:
+            self.writer.delete(f"store:{old_key}")
+        self.make_room(keep=filename)
+        self.save()
+
+    def pin(self, filename: str) -> Optional[StoreEntry]:
+        first = False
+        with self._lock:
+            # Fichier ajouté par un autre worker : indexé ici pour que l'épinglage soit publié
+            entry = self._entries.get(filename) or self._adopt_file(filename)
+            if entry is not None:
+                if not entry.pins:
+                    self._pinned_bytes += entry.size
+                    first = True
+                entry.pins += 1
+                entry.last_access = time.time()
+        if self.remote is not None:
+            # Le leader tient compte des accès servis par les autres workers
+            self.writer.set(f"store-access:{filename}", str(time.time()), ttl=self.ttl)
+            if first:
+                self._publish_usage()
+        return entry
+
+    def unpin(self, filename: str):
+        last = False
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and entry.pins > 0:
+                entry.pins -= 1
+                entry.last_access = time.time()
+                if not entry.pins:
+                    self._pinned_bytes -= entry.size
+                    self._room.notify_all()
+                    last = True
+        if last and self.remote is not None:
+            self._publish_usage()
+
+    @contextmanager
+    def using(self, filename: str):
+        """Épingle un fichier pendant un traitement (édition, archive...)."""
+        self.pin(filename)
+        try:
+            yield
+        finally:
+            self.unpin(filename)
+
+    def has_room(self, size: int = 1) -> bool:
+        """Vrai si `size` octets peuvent être accueillis, quitte à évincer."""
+        with self._lock:
+            return self._committed() + max(size, 1) <= self.max_bytes
+
+    @contextmanager
+    def reserve(self, size: int, timeout: float = 0, cancel_event: Optional[threading.Event] = None):
+        """
+        Réserve la taille d'un fichier à venir (au moins un octet si elle est
+        inconnue). Attend au plus `timeout` secondes qu'une place se libère
+        (fin d'envoi, fin d'une autre réservation), sinon StoreFullError.
+        Un fichier plus gros que le quota passe seul. Le contexte fournit une
+        fonction libérant la réservation avant l'ajout du fichier au store.
+        """
+        size = min(max(size, 1), self.max_bytes)
+        deadline = time.monotonic() + timeout
+        with self._room:
+            while self._committed() + size > self.max_bytes:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise JobCancelled()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise StoreFullError("Espace de stockage insuffisant, réessayez plus tard")
+                self._room.wait(min(remaining, 1.0))
+            self._reserved += size
+        reserved = [size]
+        self._publish_usage()
+
+        def release():
+            with self._room:
+                if not reserved:
+                    return
+                self._reserved -= reserved.pop()
+                self._room.notify_all()
+            self._publish_usage()
+
+        try:
+            self.make_room()
+            yield release
+        finally:
+            release()
+
+    def make_room(self, keep: Optional[str] = None) -> List[str]:
+        """
+        Évince immédiatement ce qui dépasse le quota (réservations comprises),
+        sauf `keep`. Sur un autre worker que le leader, ne fait rien : le
+        leader applique le quota au prochain `sync`.
+        """
+        if not self.leader:
+            return []
+        if self.remote is not None:
+            self._read_usage()  # Épinglages et réservations à jour des autres workers
+        with self._lock:
+            if self._bytes + self._reserved + self._others_reserved <= self.max_bytes:
+                return []
+            victims = self._select_victims(time.time(), keep)
+        return self._delete(victims)
+
+    def evict(self) -> List[str]:
+        """
+        Supprime les entrées expirées puis les moins utilisées au-delà du quota.
+        Un fichier supprimé pendant son envoi par un autre worker reste lisible
+        par le descripteur déjà ouvert (sémantique POSIX de unlink).
+        """
+        if not self.leader:
+            return []
+        if self.remote is not None:
+            self._read_usage()
+        now = time.time()
+        with self._lock:
+            victims = self._select_victims(now)
+        if self.remote is not None and victims:
+            # Un fichier servi récemment par un autre worker n'est pas expiré
+            for entry in list(victims):
+                accessed = self.remote.get(f"store-access:{entry.filename}")
+                if accessed is not None and float(accessed) + self.ttl > now:
+                    victims.remove(entry)
+                    entry.last_access = float(accessed)
+                    entry.heap_expiry = None
+                    with self._lock:
+                        if entry.filename not in self._entries:
+                            self._index(entry)
+            with self._lock:
+                victims += self._select_victims(now)  # Quota toujours dépassé
+        return self._delete(victims)
+
+    def _select_victims(self, now: float, keep: Optional[str] = None) -> List[StoreEntry]:
+        """
+        Dépile le tas tant que la tête est expirée ou que le quota est dépassé.
+        Un élément périmé (fichier consulté depuis) est replacé à sa nouvelle
+        échéance ; les fichiers épinglés sont conservés. Verrou tenu.
+        """
+        victims, pinned = [], []
+        while self._expiry:
+            expires_at, filename = self._expiry[0]
+            if expires_at > now and self._bytes + self._reserved + self._others_reserved <= self.max_bytes:
+                break
+            heapq.heappop(self._expiry)
+            entry = self._entries.get(filename)
+            if entry is None or entry.heap_expiry != expires_at:
+                continue  # Entrée supprimée ou remplacée
+            actual = entry.last_access + self.ttl
+            if actual > expires_at:
+                entry.heap_expiry = actual
+                heapq.heappush(self._expiry, (actual, filename))
+            elif entry.pins or filename in self._others_pinned or filename == keep:
+                pinned.append((expires_at, filename))
+            else:
+                self._unindex(entry)
+                victims.append(entry)
+        for item in pinned:  # Épinglés (ou conservé), replacés à leur échéance
+            heapq.heappush(self._expiry, item)
+        if len(self._expiry) > 2 * len(self._entries) + 64:
+            self._expiry = [(e.heap_expiry, e.filename) for e in self._entries.values()]
+            heapq.heapify(self._expiry)
+        return victims
+
+    def _delete(self, victims: List[StoreEntry]) -> List[str]:
+        if not victims:
+            return []
+        paths = []
+        for entry in victims:
+            if entry.key and self.remote is not None:
+                self.writer.delete(f"store:{entry.key}")
+            for path in [self._path(entry.filename)] + entry.extra_files:
+                try:
+                    os.remove(path)
+                    paths.append(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.error(f"Suppression impossible de {path}: {str(e)}")
+            logging.info(f"Fichier supprimé: {entry.filename}")
+        for callback in self._remove_callbacks:
+            callback(paths)
+        self.save()
+        return [e.filename for e in victims]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "pinned": sum(1 for e in self._entries.values() if e.pins),
+                "pinned_bytes": self._pinned_bytes,
+                "reserved_bytes": self._reserved,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def _committed(self) -> int:
+        """Octets qui ne peuvent pas être libérés : épinglés (par tous les workers) et réservés. Verrou tenu."""
+        others_pinned = sum(size for filename, size in self._others_pinned.items()
+                            if not getattr(self._entries.get(filename), 'pins', 0))
+        return self._pinned_bytes + self._reserved + self._others_reserved + others_pinned
+
+    def _adopt_file(self, filename: str) -> Optional[StoreEntry]:
+        """Indexe un fichier du dossier encore inconnu de ce worker. Verrou tenu."""
+        if filename.startswith('.') or is_partial_download(filename):
+            return None
+        path = self._path(filename)
+        try:
+            if not os.path.isfile(path):
+                return None
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = StoreEntry(filename, size=stat.st_size, created_at=stat.st_mtime)
+        self._index(entry)
+        return entry
+
+    def _publish_usage(self):
+        if self.remote is None:
+            return
+        with self._lock:
+            usage = {"reserved": self._reserved,
+                     "pinned": {e.filename: e.size for e in self._entries.values() if e.pins}}
+        self.writer.set(f"store-usage:{self.worker_id}", json.dumps(usage), ttl=STORE_USAGE_TTL)
+
+    def _read_usage(self):
+        reserved, pinned = 0, {}
+        for key, value in self.remote.scan("store-usage:").items():
+            if key == f"store-usage:{self.worker_id}":
+                continue
+            try:
+                usage = json.loads(value)
+            except ValueError:
+                continue
+            reserved += usage.get("reserved", 0)
+            pinned.update(usage.get("pinned", {}))
+        with self._room:
+            self._others_reserved, self._others_pinned = reserved, pinned
+            self._room.notify_all()
+
+    def _index(self, entry: StoreEntry):
+        self._entries[entry.filename] = entry
+        if entry.key:
+            self._by_key[entry.key] = entry.filename
+        self._bytes += entry.size
+        if entry.pins:
+            self._pinned_bytes += entry.size
+        if entry.heap_expiry is None:
+            entry.heap_expiry = entry.last_access + self.ttl
+            heapq.heappush(self._expiry, (entry.heap_expiry, entry.filename))
+
+    def _unindex(self, entry: StoreEntry):
+        if self._entries.get(entry.filename) is not entry:
+            return
+        del self._entries[entry.filename]
+        if entry.key and self._by_key.get(entry.key) == entry.filename:
+            del self._by_key[entry.key]
+        self._bytes -= entry.size
+        if entry.pins:
+            self._pinned_bytes -= entry.size
+            self._room.notify_all()
+
+media_store = MediaStore(DOWNLOAD_DIR, STORE_INDEX_FILE, STORE_MAX_BYTES, STORE_TTL_MINUTES * 60, remote=state,
+                         writer=state_writer)
+
+class TempFiles:
+    """
+    Fichiers de travail de TEMP_DIR (cut_*, segment_*, export_*, audio_*,
+    stream_*...). Chaque opération réserve un préfixe unique ; tout ce qui
+    le porte encore à la fin de l'opération, réussie ou non, est supprimé.
+    Les fichiers sans opération en cours (arrêt brutal, autre worker
+    disparu) sont récupérés au démarrage et par le nettoyage périodique,
+    passé `TEMP_ORPHAN_MINUTES` sans modification.
+    """
+
+    def __init__(self, directory: str, partial_directory: str):
+        self.directory = directory
+        self.partial_directory = partial_directory  # Fichiers partiels de yt-dlp
+        self._active: set = set()
+        self._lock = threading.Lock()
+
+    def claim(self, prefix: str) -> str:
+        """Chemin de base unique (sans extension) pour une opération."""
+        stem = f"{prefix}_{uuid.uuid4()}"
+        with self._lock:
+            self._active.add(stem)
+        return os.path.join(self.directory, stem)
+
+    def release(self, base: str):
+        """Fin de l'opération : supprime les fichiers restants du préfixe."""
+        stem = os.path.basename(base)
+        with self._lock:
+            self._active.discard(stem)
+        for item in os.scandir(self.directory):
+            if item.name.startswith(stem):
+                try:
+                    os.remove(item.path)
+                except FileNotFoundError:
+                    pass
+
+    @contextmanager
+    def track(self, prefix: str, suffix: str = ""):
+        base = self.claim(prefix)
+        try:
+            yield base + suffix
+        finally:
+            self.release(base)
+
+    def sweep(self, max_age: float) -> tuple:
+        """Supprime les orphelins plus vieux que `max_age` ; retourne (fichiers, octets)."""
+        now = time.time()
+        with self._lock:
+            active = tuple(self._active)
+        count = size = 0
+        candidates = [(item, True) for item in os.scandir(self.directory)]
+        candidates += [(item, False) for item in os.scandir(self.partial_directory)]
+        for item, temporary in candidates:
+            if temporary and item.name.startswith(active):
+                continue
+            if not temporary and not is_partial_download(item.name):
+                continue
+            try:
+                stat = item.stat()
+                if not item.is_file() or now - stat.st_mtime < max_age:
+                    continue
+                os.remove(item.path)
+            except FileNotFoundError:
+                continue
+            count += 1
+            size += stat.st_size
+        if count:
+            logging.info(f"Fichiers temporaires orphelins supprimés: {count} ({size} octets)")
+        return count, size
+
+temp_files = TempFiles(TEMP_DIR, DOWNLOAD_DIR)
+
+async def cleanup_old_files():
+    """Évince les fichiers inactifs ou excédentaires du store"""
+    while True:
+        try:
+            # Un seul worker nettoie le volume partagé ; son bail expire s'il disparaît
+            media_store.leader = await run_in_threadpool(state.acquire, "leader:cleanup", WORKER_ID,
+                                                         CLEANUP_INTERVAL * 2)
+            if media_store.leader:
+                await run_in_threadpool(media_store.evict)
+                await run_in_threadpool(temp_files.sweep, TEMP_ORPHAN_MINUTES * 60)
+                await run_in_threadpool(expire_uploads, UPLOAD_EXPIRY_HOURS * 3600)
+                await run_in_threadpool(preview_cache.sweep, PREVIEW_TTL_HOURS * 3600, TEMP_ORPHAN_MINUTES * 60)
+                await run_in_threadpool(state.purge)
+            await run_in_threadpool(release_finished_uploads)
+            job_manager.prune(MAX_FILE_AGE_MINUTES * 60)
+            await run_in_threadpool(ydl_pool.prune)
+        except Exception as e:
+            logging.error(f"Erreur lors du nettoyage: {str(e)}")
+        await asyncio.sleep(CLEANUP_INTERVAL)
+
+async def sync_store():
+    """Partage l'occupation du store entre workers (le leader y applique le quota global) et écrit l'index."""
+    while True:
+        try:
+            await run_in_threadpool(media_store.sync)
+        except Exception as e:
+            logging.error(f"Erreur lors de la synchronisation du store: {str(e)}")
+        await asyncio.sleep(STORE_SYNC_INTERVAL)
+
+startup_timings = {}  # Phase -> secondes : import du module, démarrage complet, préchauffage de yt-dlp
+
+async def warm_up():
+    """Charge yt-dlp en tâche de fond : le worker répond déjà pendant ce temps."""
+    start = time.perf_counter()
+    try:
+        await run_in_threadpool(ydl_pool.warm)
+    except Exception as e:
+        logging.warning(f"Préchauffage de yt-dlp impossible: {str(e)}")
+        return
+    startup_timings["warmup"] = time.perf_counter() - start
+    logging.info(f"yt-dlp préchauffé en {startup_timings['warmup']:.2f} s")
+
+@app.on_event("startup")
+async def startup_event():
+    global main_loop
+    main_loop = asyncio.get_running_loop()
+    await run_in_threadpool(media_store.load)
+    await run_in_threadpool(temp_files.sweep, TEMP_ORPHAN_MINUTES * 60)
+    await run_in_threadpool(hls_packager.load)
+    asyncio.create_task(cleanup_old_files())
+    asyncio.create_task(sync_store())
+    asyncio.create_task(measure_event_loop_lag())
+    asyncio.create_task(watch_cancellations())
+    asyncio.create_task(progress_hub.run())
+    asyncio.create_task(warm_up())
+    startup_timings["startup"] = time.perf_counter() - IMPORT_STARTED
+    logging.info(f"Démarrage en {startup_timings['startup']:.2f} s "
+                 f"(import du module : {startup_timings.get('import', 0):.2f} s)")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_manager.shutdown()
+    ydl_pool.close()
+    await run_in_threadpool(media_store.flush)
+    await run_in_threadpool(state_writer.flush)
+
+# Cache des extractions de métadonnées
+# Options d'extraction partagées par /formats et /download
+PROBE_YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': False,  # Activer les avertissements pour le débogage
+    'extract_flat': False,
+    # Sélection toujours satisfaite : 'best' échoue sans format combiné (DASH, HLS séparés)
+    'format': 'bestvideo*+bestaudio/best',
+    'noplaylist': True,
+    'nocheckcertificate': True,
+    'no_check_certificate': True,
+    'prefer_insecure': True,
+    'ignoreerrors': True,  # Ignorer les erreurs non critiques
+    'youtube_include_dash_manifest': True,  # Inclure les formats DASH
+    'youtube_include_hls_manifest': True,   # Inclure les formats HLS
+    'verbose': True,  # Activer le mode verbeux pour le débogage
+}
+# Options communes des téléchargements (le format et le modèle de nom varient par requête)
+DOWNLOAD_YDL_OPTS = {
+    'quiet': True,
+    'noplaylist': True,
+    'nocheckcertificate': True,
+    'no_check_certificate': True,
+    'prefer_insecure': True,
+    'concurrent_fragment_downloads': FRAGMENT_CONCURRENCY,  # HLS/DASH
+}
+PLAYLIST_YDL_OPTS = {'quiet': True, 'extract_flat': 'in_playlist', 'skip_download': True,
+                     'nocheckcertificate': True, 'ignoreerrors': True}
+YDL_PROFILES = {
+    'probe': PROBE_YDL_OPTS,
+    'video': DOWNLOAD_YDL_OPTS,
+    'audio': {**DOWNLOAD_YDL_OPTS, 'format': 'bestaudio/best'},
+    'playlist': PLAYLIST_YDL_OPTS,
+}
+# Options lues seulement à la construction de YoutubeDL : elles doivent faire partie du profil
+YDL_INIT_OPTIONS = ('postprocessors', 'post_hooks', 'download_archive', 'cookiefile', 'cookiesfrombrowser',
+                    'proxy', 'http_headers', 'verbose', 'logger')
+
+class YoutubeDLPool:
+    """
+    Instances YoutubeDL prêtes à l'emploi, par profil d'options (probe,
+    video, audio, playlist). Construire une instance coûte ~0,1 s (analyse
+    des options, sélecteur de format) ; réutilisée, elle garde aussi sa
+    session HTTP (connexions keep-alive vers les origines) et ses cookies.
+    Une instance n'est prêtée qu'à un thread à la fois : les options propres
+    à une requête (format, modèle de nom, hooks...) sont appliquées au prêt
+    et retirées au retour. Au-delà de `max_idle` instances inactives par
+    profil, ou après `idle_timeout` secondes sans usage, elles sont fermées.
+    """
+
+    def __init__(self, profiles: dict, max_idle: int, idle_timeout: float):
+        self.profiles = profiles
+        self.max_idle = max(1, max_idle)
+        self.idle_timeout = idle_timeout
+        self._idle = {name: [] for name in profiles}  # Profil -> [(instance, état initial, rendue à)]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self, profile: str, options: Optional[dict] = None):
+        """Prête une instance du profil, avec `options` en plus des options du profil."""
+        with self._lock:
+            idle = self._idle[profile]
+            item = idle.pop() if idle else None
+        if item is None:
+            item = self._create(profile)
+            metrics.inc("ydl_leases_total", profile=profile, instance="new")
+        else:
+            metrics.inc("ydl_leases_total", profile=profile, instance="reused")
+        ydl, initial, _ = item
+        try:
+            self._apply(ydl, initial, options or {})
+            yield ydl
+        finally:
+            self._reset(ydl, initial)
+            with self._lock:
+                idle = self._idle[profile]
+                if len(idle) < self.max_idle:
+                    idle.append((ydl, initial, time.monotonic()))
+                    ydl = None
+            if ydl is not None:
+                ydl.close()
+
+    def warm(self):
+        """Importe yt-dlp et ses extracteurs, puis prépare une instance par profil."""
+        _specific_extractors()
+        for profile in self.profiles:
+            with self.lease(profile):
+                pass
+
+    def prune(self):
+        """Ferme les instances inactives depuis plus de `idle_timeout` secondes."""
+        limit = time.monotonic() - self.idle_timeout
+        expired = []
+        with self._lock:
+            for profile, idle in self._idle.items():
+                expired += [ydl for ydl, _, returned_at in idle if returned_at < limit]
+                idle[:] = [item for item in idle if item[2] >= limit]
+        for ydl in expired:
+            ydl.close()
+
+    def close(self):
+        with self._lock:
+            items = [item for idle in self._idle.values() for item in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for ydl, _, _ in items:
+            ydl.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {profile: len(idle) for profile, idle in self._idle.items()}
+
+    def _create(self, profile: str) -> tuple:
+        import yt_dlp
+        ydl = yt_dlp.YoutubeDL(copy.deepcopy(self.profiles[profile]))
+        return ydl, (dict(ydl.params), ydl.format_selector), None
+
+    @staticmethod
+    def _apply(ydl, initial: tuple, options: dict):
+        params, _ = initial
+        for name, value in options.items():
+            if name in YDL_INIT_OPTIONS:
+                if params.get(name) != value:
+                    raise ValueError(f"L'option yt-dlp {name} doit être définie dans le profil")
+            elif name == 'format':
+                if value != params.get('format'):
+                    ydl.params['format'] = value
+                    ydl.format_selector = ydl.build_format_selector(value)
+            elif name == 'outtmpl':
+                ydl.params['outtmpl'] = {'default': value}
+                ydl._parse_outtmpl()
+            elif name == 'progress_hooks':
+                for hook in value:
+                    ydl.add_progress_hook(hook)
+            elif name == 'postprocessor_hooks':
+                for hook in value:
+                    ydl.add_postprocessor_hook(hook)
+            else:
+                ydl.params[name] = value
+
+    @staticmethod
+    def _reset(ydl, initial: tuple):
+        # Compteurs et hooks internes de YoutubeDL remis à leur état de construction
+        params, format_selector = initial
+        ydl.params.clear()
+        ydl.params.update(params)
+        ydl.format_selector = format_selector
+        ydl._progress_hooks.clear()
+        ydl._postprocessor_hooks.clear()
+        ydl._num_downloads = 0
+        ydl._download_retcode = 0
+        ydl._playlist_urls.clear()
+
+ydl_pool = YoutubeDLPool(YDL_PROFILES, YDL_POOL_SIZE, YDL_POOL_IDLE_SECONDS)
+
+@functools.lru_cache(maxsize=1)
+def _specific_extractors():
+    import yt_dlp
+    return [ie for ie in yt_dlp.extractor.gen_extractor_classes() if ie.ie_key() != 'Generic']
+
+@functools.lru_cache(maxsize=4096)
+def normalize_url(url: str) -> str:
+    """
+    Clé de cache d'une URL : `extracteur:id` quand un extracteur dédié
+    reconnaît l'URL (youtu.be/X et youtube.com/watch?v=X&t=3 donnent la
+    même clé), sinon l'URL normalisée (hôte en minuscules, paramètres triés,
+    fragment supprimé).
+    """
+    for ie in _specific_extractors():
+        try:
+            if ie.suitable(url):
+                video_id = ie.get_temp_id(url)
+                if video_id:
+                    return f"{ie.ie_key()}:{video_id}"
+                break
+        except Exception:
+            continue
+    parsed = urllib.parse.urlsplit(url.strip())
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path or '/', query, ''))
+
+class ExtractionCache:
+    """
+    Cache LRU des résultats de `extract_info(download=False)`.
+    Les entrées expirent après `ttl` secondes et sont évincées au-delà de
+    `max_entries` entrées ou `max_bytes` octets (taille JSON estimée).
+    Les requêtes simultanées sur une même URL partagent une seule extraction.
+    Avec un backend `remote`, les extractions sont aussi partagées entre workers.
+    Les infos retournées sont partagées : ne pas les modifier sans copie.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int, remote=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.remote = remote
+        self.hits = 0
+        self.misses = 0
+        self.remote_hits = 0  # Extractions faites par un autre worker
+        self.shared = 0  # Requêtes ayant rejoint une extraction en cours
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()  # clé -> (expiration, taille, info)
+        self._inflight: dict[str, Future] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_extract(self, url: str, extract) -> dict:
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self._remove(key)
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            info = self._remote_get(key)
+            if info is None:
+                info = extract(url)
+                self._remote_put(key, info)
+            future.set_result(info)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        self._put(key, info)
+        return info
+
+    def invalidate(self, url: str):
+        with self._lock:
+            self._remove(normalize_url(url))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.shared
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "remote_hits": self.remote_hits,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.shared) / lookups if lookups else 0.0,
+            }
+
+    def _remote_get(self, key: str) -> Optional[dict]:
+        if self.remote is None:
+            return None
+        try:
+            data = self.remote.get(f"extraction:{key}")
+        except Exception as e:
+            logging.error(f"Cache d'extraction partagé indisponible: {str(e)}")
+            return None
+        if data is None:
+            return None
+        with self._lock:
+            self.remote_hits += 1
+        return json.loads(data)
+
+    def _remote_put(self, key: str, info: dict):
+        if self.remote is None:
+            return
+        data = json.dumps(info, default=str)
+        if len(data) <= self.max_bytes:
+            try:
+                self.remote.set(f"extraction:{key}", data, ttl=self.ttl)
+            except Exception as e:
+                logging.error(f"Cache d'extraction partagé indisponible: {str(e)}")
+
+    def _put(self, key: str, info: dict):
+        size = len(json.dumps(info, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, size, info)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_TTL, EXTRACTION_CACHE_MAX_ENTRIES, EXTRACTION_CACHE_MAX_BYTES,
+                                   remote=state)
+
+def extract_metadata(url: str) -> dict:
+    """Extraction complète des métadonnées (sans téléchargement)."""
+    with metrics.time("stage_duration_seconds", stage="extraction"), ydl_pool.lease('probe') as ydl:
+        info = ydl.extract_info(url, download=False)
+        if info is None:
+            raise ValueError("Impossible d'extraire les informations de la vidéo")
+        info = ydl.sanitize_info(info)
+    info['_ranking'] = rank_formats(info)  # Calculé une fois, partagé par le cache
+    return info
+
+def get_video_info(url: str) -> dict:
+    """Métadonnées d'une URL, servies depuis le cache quand c'est possible."""
+    return extraction_cache.get_or_extract(url, extract_metadata)
+
+def video_codec(fmt: dict) -> Optional[str]:
+    vcodec = (fmt.get('vcodec') or '').lower()
+    for prefixes, codec in ((('avc', 'h264'), 'h264'), (('vp09', 'vp9'), 'vp9'), (('vp8',), 'vp8'),
+                            (('av01', 'av1'), 'av1'), (('hvc1', 'hev1', 'h265', 'hevc'), 'hevc')):
+        if vcodec.startswith(prefixes):
+            return codec
+    return None
+
+def estimated_size(fmt: dict, duration: Optional[float]) -> Optional[float]:
+    """Taille annoncée, sinon débit × durée."""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    rate = fmt.get('tbr') or (fmt.get('vbr') or 0) + (fmt.get('abr') or 0)
+    if not size and rate and duration:
+        size = rate * 125 * duration  # kbit/s -> octets
+    return size or None
+
+def merged_container(vcodec: Optional[str], acodec: Optional[str]) -> Optional[str]:
+    for container, (video_codecs, audio_codecs) in VIDEO_CONTAINER_CODECS.items():
+        if vcodec in video_codecs and (acodec is None or acodec in audio_codecs):
+            return container
+    return None
+
+def rank_formats(info: dict) -> dict:
+    """
+    Classement calculé une fois par extraction (stocké dans l'info en cache).
+    Chaque format vidéo seul est associé au meilleur audio fusionnable dans
+    le même conteneur ; les formats progressifs sont candidats tels quels.
+    Le score est la hauteur pondérée par la fidélité : débit équivalent
+    H.264 (selon l'efficacité du codec) rapporté au débit nécessaire pour
+    la résolution et la cadence, plafonné à 1, en racine carrée (la qualité
+    perçue croît moins vite que le débit). Résultat compact (sans les dicts
+    de formats) : sélecteur yt-dlp, codecs, taille estimée, score.
+    """
+    duration = info.get('duration')
+    formats = info.get('formats') or [info]
+    audio = sorted((f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')),
+                   key=lambda f: f.get('abr') or f.get('tbr') or 0, reverse=True)
+    best_audio = {}  # Conteneur -> meilleur audio compatible
+    for fmt in audio:
+        for container, (_, audio_codecs) in VIDEO_CONTAINER_CODECS.items():
+            if audio_codec(fmt) in audio_codecs:
+                best_audio.setdefault(container, fmt)
+
+    candidates = []
+    for fmt in formats:
+        if fmt.get('vcodec') == 'none' or not fmt.get('format_id'):
+            continue
+        vcodec = video_codec(fmt)
+        pair = None
+        if fmt.get('acodec') == 'none':
+            container = merged_container(vcodec, None)
+            pair = best_audio.get(container) or next(iter(audio), None)
+            if pair is None:
+                continue  # Vidéo muette
+        acodec = audio_codec(pair or fmt)
+
+        height = fmt.get('height') or 0
+        width = fmt.get('width') or height * 16 / 9
+        fps = fmt.get('fps') or 30
+        kbps = fmt.get('vbr') or ((fmt.get('tbr') or 0) - (0 if pair else fmt.get('abr') or 0))
+        if kbps > 0 and height:
+            needed = width * height * fps * TARGET_BITS_PER_PIXEL / 1000
+            fidelity = min(kbps * VIDEO_CODEC_EFFICIENCY.get(vcodec, 1.0) / needed, 1.0) ** 0.5
+        else:
+            fidelity = 0.75  # Débit inconnu : ni favorisé ni écarté
+        sizes = [estimated_size(fmt, duration)] + ([estimated_size(pair, duration)] if pair else [])
+
+        candidates.append({
+            'type': 'video',
+            'selector': f"{fmt['format_id']}+{pair['format_id']}" if pair else fmt['format_id'],
+            'ext': (merged_container(vcodec, acodec) or 'mkv') if pair else fmt.get('ext'),
+            'height': height or None,
+            'fps': fps,
+            'vcodec': vcodec or fmt.get('vcodec'),
+            'acodec': acodec or (pair or fmt).get('acodec'),
+            'abr': (pair or fmt).get('abr'),
+            'size': sum(sizes) if all(sizes) else None,
+            'fidelity': round(fidelity, 3),
+            'score': round(height * (0.5 + 0.5 * fidelity) * (1.1 if fps > 30 else 1.0), 2),
+            'note': fmt.get('format_note'),
+        })
+    candidates.sort(key=lambda c: (-c['score'], c['size'] or float('inf')))
+
+    audio_candidates = [{
+        'type': 'audio',
+        'selector': f['format_id'],
+        'ext': f.get('ext'),
+        'acodec': audio_codec(f) or f.get('acodec'),
+        'abr': f.get('abr'),
+        'size': estimated_size(f, duration),
+    } for f in audio]
+    return {'video': candidates, 'audio': audio_candidates}
+
+def get_ranking(info: dict) -> dict:
+    return info.get('_ranking') or rank_formats(info)
+
+def select_formats(ranking: dict, max_height: Optional[int] = None, max_filesize: Optional[float] = None,
+                   vcodecs: Optional[List[str]] = None, container: Optional[str] = None) -> List[dict]:
+    """
+    Échelle de qualités sous contraintes du client : un candidat par
+    palier (hauteur, haute cadence), du meilleur score au plus faible.
+    Dans un palier, le plus petit fichier parmi les scores équivalents.
+    """
+    tiers = {}
+    for candidate in ranking['video']:
+        if max_height and (candidate['height'] or 0) > max_height:
+            continue
+        if max_filesize and candidate['size'] and candidate['size'] > max_filesize:
+            continue
+        if vcodecs and candidate['vcodec'] not in vcodecs:
+            continue
+        if container and candidate['ext'] != container:
+            continue
+        tiers.setdefault((candidate['height'], candidate['fps'] > 30), []).append(candidate)
+
+    ladder = []
+    for tier in tiers.values():
+        best_score = tier[0]['score']  # Les candidats sont déjà triés par score
+        equivalent = [c for c in tier if c['score'] >= best_score * SAME_QUALITY_RATIO]
+        ladder.append(min(equivalent, key=lambda c: c['size'] or float('inf')))
+    ladder.sort(key=lambda c: -c['score'])
+    return ladder
+
+def best_format_selector(info: dict, **constraints) -> str:
+    """Sélecteur yt-dlp du meilleur candidat, avec repli sur `best`."""
+    ladder = select_formats(get_ranking(info), **constraints)
+    return f"{ladder[0]['selector']}/best" if ladder else 'best'
+
+def get_best_format(url, requested_format, **constraints):
+    """
+    Détermine le meilleur format disponible pour la vidéo.
+    """
+    try:
+        if requested_format.lower() in AUDIO_REQUEST_FORMATS:
+            return 'bestaudio/best'
+        # Classement précalculé avec l'extraction en cache
+        info = get_video_info(url)
+        container = VIDEO_REQUEST_FORMATS.get(requested_format.lower())
+        return best_format_selector(info, container=container, **constraints)
+    except Exception as e:
+        logging.error(f"Erreur lors de la vérification des formats: {str(e)}")
+        return 'best'  # Format par défaut en cas d'erreur
+
+def audio_targets(accept: List[str]) -> List[str]:
+    """Normalise une liste de codecs/conteneurs (`aac`, `m4a`, `opus`...) en conteneurs."""
+    targets = []
+    for value in accept:
+        value = value.lower().strip().lstrip('.')
+        container = value if value in AUDIO_REMUX_CODECS else AUDIO_CODEC_CONTAINERS.get(value)
+        if container is None:
+            raise ValueError(f"Format audio non supporté: {value}")
+        if container not in targets:
+            targets.append(container)
+    return targets
+
+def audio_codec(fmt: dict) -> Optional[str]:
+    """Codec audio d'un format ; à défaut (extracteur générique), déduit de l'extension."""
+    acodec = (fmt.get('acodec') or '').lower()
+    if acodec.startswith(('mp4a', 'aac')):
+        return 'aac'
+    for codec in ('opus', 'vorbis', 'mp3', 'flac'):
+        if acodec.startswith(codec):
+            return codec
+    if not acodec:
+        return {'m4a': 'aac', 'mp3': 'mp3', 'opus': 'opus', 'flac': 'flac'}.get(fmt.get('ext'))
+    return None
+
+def plan_audio(info: dict, targets: List[str]) -> dict:
+    """
+    Choisit le flux audio et le traitement le moins coûteux :
+    `none` (le fichier source convient tel quel), `remux` (copie du flux
+    dans le conteneur demandé) ou `transcode` quand aucun flux disponible
+    n'est dans un codec accepté. Les conteneurs sont essayés dans l'ordre
+    de préférence du client, les flux par débit décroissant.
+    """
+    # acodec absent : codec inconnu, le flux peut contenir de l'audio
+    formats = [f for f in info.get('formats') or [info] if f.get('acodec') != 'none']
+    audio_only = [f for f in formats if f.get('vcodec') == 'none']
+    candidates = sorted(audio_only or formats, key=lambda f: f.get('abr') or f.get('tbr') or 0, reverse=True)
+    if not candidates:
+        raise ValueError("Aucun flux audio n'a été trouvé")
+
+    for container in targets:
+        for fmt in candidates:
+            if audio_codec(fmt) in AUDIO_REMUX_CODECS[container]:
+                action = 'none' if fmt.get('ext') == container and fmt.get('vcodec') == 'none' else 'remux'
+                return {'format_id': fmt['format_id'], 'container': container, 'action': action}
+    return {'format_id': candidates[0]['format_id'], 'container': targets[0], 'action': 'transcode'}
+
+def audio_convert_args(plan: dict) -> List[str]:
+    """Options ffmpeg (après l'entrée) pour produire le conteneur du plan."""
+    if plan['action'] == 'remux':
+        return ['-vn', '-c:a', 'copy']
+    return ['-vn', *AUDIO_ENCODE_ARGS[plan['container']]]
+
+def build_download_options(data: DownloadRequest) -> dict:
+    """Options yt-dlp correspondant à une demande de téléchargement."""
+    # Configuration mise à jour pour le téléchargement
+    ydl_opts = {**DOWNLOAD_YDL_OPTS, 'format': data.format}
+
+    # Audio : le flux est choisi par plan_audio une fois les formats connus,
+    # la conversion éventuelle passe par ffmpeg_runner (pas de post-traitement yt-dlp)
+    if data.audio_targets():
+        ydl_opts['format'] = 'bestaudio/best'
+    return ydl_opts
+
+def store_key_for(url: str, ydl_opts: dict, audio_targets: Optional[List[str]] = None) -> str:
+    """
+    Clé du store : source normalisée, format résolu (`format_id`, voir
+    resolve_format_id) et traitements appliqués. Deux sélecteurs menant au
+    même format, en téléchargement comme en streaming, partagent le fichier.
+    """
+    merge = ydl_opts.get('merge_output_format') if '+' in ydl_opts['format'] else None
+    processing = json.dumps({'postprocessors': ydl_opts.get('postprocessors', []), 'audio': audio_targets,
+                             'merge': merge}, sort_keys=True)
+    return MediaStore.make_key(normalize_url(url), ydl_opts['format'], processing)
+
+def resolve_format_id(info: dict, selector: str) -> str:
+    """`format_id` que yt-dlp retiendra pour `selector` (« 137+140 » pour une fusion)."""
+    formats = info.get('formats') or [info]
+    ctx = {
+        'formats': formats,
+        'has_merged_format': any(f.get('vcodec') != 'none' and f.get('acodec') != 'none' for f in formats),
+        'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                               or all(f.get('acodec') == 'none' for f in formats)),
+    }
+    with ydl_pool.lease('probe') as ydl:
+        chosen = next(iter(ydl.build_format_selector(selector)(ctx)), None)
+    if chosen is None:
+        raise ValueError(f"Aucun format ne correspond à {selector}")
+    return chosen['format_id']
+
+def clean_name(name: str) -> str:
+    """Nettoie un nom de fichier des caractères spéciaux."""
+    return "".join(c for c in name if c.isalnum() or c in ('-', '_', '.'))
+
+def store_entry_response(entry: StoreEntry, requested_format: str) -> dict:
+    return DownloadResponse(
+        filename=entry.filename,
+        format=requested_format,
+        title=entry.meta.get('title'),
+        duration=entry.meta.get('duration'),
+        thumbnail=entry.meta.get('thumbnail')
+    ).dict()
+
+def convert_audio(job: Job, filename: str, plan: dict, duration: Optional[float]) -> str:
+    """
+    Remux ou transcode le fichier téléchargé vers le conteneur du plan.
+    Exécuté depuis un worker : ffmpeg passe par ffmpeg_runner sur la boucle
+    principale, et partage donc son plafond de processus simultanés.
+    """
+    job.update(stage='remuxing' if plan['action'] == 'remux' else 'transcoding')
+    output = f"{os.path.splitext(filename)[0]}.{plan['container']}"
+    args = ['-i', filename, *audio_convert_args(plan)]
+    if plan['container'] == 'm4a':
+        args += ['-movflags', '+faststart']
+    with temp_files.track("audio", f".{plan['container']}") as temp_output:
+        asyncio.run_coroutine_threadsafe(
+            ffmpeg_runner.run([*args, temp_output], job=job, duration=duration, priority='download'), main_loop).result()
+        os.replace(temp_output, output)
+    if output != filename:
+        os.remove(filename)
+    return output
+
+def expected_download_size(info: dict, selector: str) -> int:
+    """Taille estimée du fichier produit par `selector` (0 si inconnue)."""
+    duration = info.get('duration')
+    for candidate in (info.get('_ranking') or {}).get('video', []) + (info.get('_ranking') or {}).get('audio', []):
+        if candidate['selector'] == selector:
+            return int(candidate.get('size') or 0)
+    for fmt in info.get('formats') or [info]:
+        if fmt.get('format_id') == selector:
+            return int(estimated_size(fmt, duration) or 0)
+    return 0
+
+def run_download(job: Job, data: DownloadRequest) -> dict:
+    """Téléchargement exécuté dans un worker du pool."""
+    import yt_dlp
+    try:
+        ydl_opts = build_download_options(data)
+        ydl_opts.update({
+            'progress_hooks': [make_progress_hook(job)],
+            'postprocessor_hooks': [make_postprocessor_hook(job)],
+        })
+        targets = data.audio_targets()
+
+        # Extraction (en cache) d'abord : la clé du store porte sur le format résolu
+        job.update(stage='extracting')
+        info = get_video_info(str(data.url))
+        plan = None
+        if targets:
+            plan = plan_audio(info, targets)
+            ydl_opts['format'] = plan['format_id']
+        else:
+            if data.format.lower() in VIDEO_REQUEST_FORMATS:
+                container = VIDEO_REQUEST_FORMATS[data.format.lower()]
+                ydl_opts['format'] = best_format_selector(info, container=container)
+                if container:
+                    ydl_opts['merge_output_format'] = container
+            ydl_opts['format'] = resolve_format_id(info, ydl_opts['format'])
+        key = store_key_for(str(data.url), ydl_opts, targets)
+
+        # Un seul téléchargement par clé : les doublons attendent puis lisent le store
+        with media_store.key_lock(key):
+            entry = media_store.lookup(key)
+            if entry is not None:
+                logging.info(f"Servi depuis le store: {entry.filename}")
+                return store_entry_response(entry, data.format)
+
+            logging.info(f"Début du téléchargement: {data.url} (format: {ydl_opts['format']}, job: {job.id})")
+            if plan is not None:
+                logging.info(f"Audio: format {plan['format_id']} -> {plan['container']} ({plan['action']})")
+
+            # Le suffixe de clé évite les collisions entre titres identiques
+            base_name = f"{clean_name(info.get('title') or 'video')[:100]}-{key[:12]}"
+            ydl_opts['outtmpl'] = os.path.join(DOWNLOAD_DIR, f"{base_name}.%(ext)s")
+            size = expected_download_size(info, ydl_opts['format'])
+            if not media_store.has_room(size):
+                job.update(stage='waiting_storage')
+            timeout = STORE_QUEUE_TIMEOUT if STORE_FULL_POLICY == "queue" else 0
+            with media_store.reserve(size, timeout, job.cancel_event):
+                with ydl_pool.lease('audio' if targets else 'video', ydl_opts) as ydl:
+                    # Réutilise l'extraction en cache : seul le téléchargement reste à faire
+                    info = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                    downloads = info.get('requested_downloads') or [{}]
+                    filename = downloads[0].get('filepath') or ydl.prepare_filename(info)
+
+                if plan is not None and plan['action'] != 'none':
+                    filename = convert_audio(job, filename, plan, info.get('duration'))
+
+            entry = media_store.add(
+                os.path.basename(filename),
+                key=key,
+                meta={
+                    'title': info.get('title'),
+                    'duration': info.get('duration'),
+                    'thumbnail': info.get('thumbnail'),
+                }
+            )
+
+        schedule_probe(os.path.join(DOWNLOAD_DIR, entry.filename))
+        logging.info(f"Téléchargement réussi: {entry.filename}")
+        return store_entry_response(entry, data.format)
+    
+    except (yt_dlp.utils.DownloadCancelled, JobCancelled):
+        logging.info(f"Téléchargement annulé: {data.url} (job: {job.id})")
+        raise JobCancelled()
+    except Exception as e:
+        error_msg = str(e)
+        logging.error(f"Erreur de téléchargement: {error_msg}")
+        raise RuntimeError(f"Erreur lors du téléchargement: {error_msg}")
+
+@app.post("/download", response_model=JobResponse, status_code=202)
+async def download_video(data: DownloadRequest):
+    """Met le téléchargement en file d'attente et retourne l'identifiant du job."""
+    if data.is_blocked_url():
+        raise HTTPException(
+            status_code=403,
+            detail="Cette source est protégée par des droits d'auteur et ne peut pas être téléchargée"
+        )
+
+    try:
+        data.audio_targets()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    check_store_room()
+    host = urllib.parse.urlparse(str(data.url)).netloc.lower()
+    job = job_manager.submit("download", run_download, data, host=host)
+    return JobResponse(job_id=job.id, status=job.status)
+
+def check_store_room(size: int = 1, queueable: bool = True):
+    """
+    Refuse (507) une demande si le store est plein. Les téléchargements mis
+    en file d'attente (`queueable`) ne sont refusés qu'avec la politique
+    `reject` ; sinon ils attendent une place dans leur worker.
+    """
+    if (STORE_FULL_POLICY == "reject" or not queueable) and not media_store.has_room(size):
+        raise HTTPException(status_code=507, detail="Espace de stockage insuffisant, réessayez plus tard",
+                            headers={"Retry-After": str(CLEANUP_INTERVAL)})
+
+def select_stream_format(info: dict, selector: str) -> dict:
+    """
+    Résout un sélecteur yt-dlp en un format unique diffusable sur un pipe.
+    Les fusions vidéo+audio ne peuvent pas être écrites sur la sortie
+    standard : on se rabat alors sur le meilleur format complet.
+    """
+    with ydl_pool.lease('probe') as ydl:
+        for candidate in (selector, 'best'):
+            ctx = {'formats': info.get('formats') or [info], 'has_merged_format': False,
+                   'incomplete_formats': False}
+            chosen = next(iter(ydl.build_format_selector(candidate)(ctx)), None)
+            if chosen is not None and not chosen.get('requested_formats'):
+                return chosen
+    raise ValueError("Aucun format diffusable en streaming n'a été trouvé")
+
+def download_to_file(job: Job, profile: str, info: dict, fmt: dict, target: str, notify) -> dict:
+    """
+    Job du streaming : télécharge le format `fmt` dans `target` avec une
+    instance chaude du pool. Passe par job_manager comme /download (nombre
+    de workers, limite par domaine). `notify` est appelé après chaque bloc
+    écrit ; l'annulation du job arrête le téléchargement au bloc suivant.
+    """
+    options = {'nopart': True, 'continuedl': False, 'overwrites': True, 'noprogress': True,
+               '_no_ytdl_file': True, 'progress_hooks': [make_progress_hook(job), lambda d: notify()]}
+    job.update(stage='downloading')
+    with ydl_pool.lease(profile, options) as ydl:
+        source = {k: v for k, v in info.items() if k not in ('formats', 'requested_formats')}
+        success, _ = ydl.dl(target, {**source, **fmt})
+    if not success:
+        raise RuntimeError("Téléchargement incomplet")
+    return {'size': os.path.getsize(target)}
+
+def read_from(path: str, offset: int, size: int) -> bytes:
+    """Au plus `size` octets de `path` à partir de `offset` (rien si le fichier n'existe pas encore)."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+    except FileNotFoundError:
+        return b""
+
+async def follow_download(path: str, download: asyncio.Future, progress: asyncio.Event):
+    """Blocs écrits dans `path` par un téléchargement en cours, jusqu'à sa fin."""
+    offset = 0
+    batch = STREAM_CHUNK_SIZE * 16
+    while True:
+        await progress.wait()
+        progress.clear()
+        finished = download.done()
+        while True:
+            data = await run_in_threadpool(read_from, path, offset, batch)
+            offset += len(data)
+            for start in range(0, len(data), STREAM_CHUNK_SIZE):
+                yield data[start:start + STREAM_CHUNK_SIZE]
+            if len(data) < batch:
+                break
+        if finished:
+            return
+
+async def read_stream(stream: asyncio.StreamReader):
+    while True:
+        chunk = await stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+async def feed_process(chunks, stdin: asyncio.StreamWriter):
+    """Écrit les blocs de `chunks` sur l'entrée d'un processus, puis la ferme."""
+    try:
+        async for chunk in chunks:
+            stdin.write(chunk)
+            await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stdin.close()
+
+async def stream_media(url: str, key: str, info: dict, fmt: dict, ext: str,
+                       plan: Optional[dict] = None, size: int = 0, host: Optional[str] = None):
+    """
+    Générateur de la réponse streaming.
+    yt-dlp (instance du pool, dans un job de job_manager) écrit la source
+    dans un fichier du TEMP_DIR, suivi par la boucle à chaque bloc écrit :
+    les octets sont envoyés au client au fur et à mesure, et le fichier est
+    promu dans le store à la fin. Une seule copie sur disque. Pour une
+    conversion audio, ffmpeg lit la source (directement ou depuis ce
+    fichier) et sa sortie est écrite dans un fichier partiel.
+    Un transcodage occupe un créneau de ffmpeg_runner, pas un remux.
+    """
+    loop = asyncio.get_running_loop()
+    # Réservée dans le store pendant le transfert (la place a été vérifiée par l'appelant)
+    reservation = media_store.reserve(size)
+    release_reservation = await run_in_threadpool(reservation.__enter__)
+    base = temp_files.claim("stream")
+    source_file = f"{base}.source"  # Écrit par yt-dlp (un nom en .part serait renommé par yt-dlp)
+    part_file = f"{base}.part"  # Écrit par la boucle depuis la sortie de ffmpeg
+    convert = plan is not None and plan['action'] != 'none'
+    if convert:
+        encode_cmd = [*audio_convert_args(plan), *AUDIO_PIPE_MUXERS[plan['container']], 'pipe:1']
+    progress = asyncio.Event()
+    job = None
+    download = None
+    tasks = []
+    processes = []
+    part = None
+    slot = False
+    try:
+        if convert and plan['action'] == 'transcode':
+            await ffmpeg_runner.acquire('download')
+            slot = True
+        if convert and fmt.get('protocol') in DIRECT_FFMPEG_PROTOCOLS:
+            # ffmpeg lit directement la source (requêtes Range possibles,
+            # indispensable pour les MP4 dont l'index est en fin de fichier)
+            headers = "".join(f"{k}: {v}\r\n" for k, v in (fmt.get('http_headers') or {}).items())
+            processes.append(await asyncio.create_subprocess_exec(
+                'ffmpeg', '-loglevel', 'error', '-headers', headers, '-i', fmt['url'], *encode_cmd,
+                stdout=asyncio.subprocess.PIPE, stderr=subprocess.DEVNULL))
+        else:
+            job = job_manager.submit("stream", download_to_file, 'audio' if plan else 'video', info, fmt,
+                                     source_file, lambda: loop.call_soon_threadsafe(progress.set), host=host)
+            download = wait_job(job)
+            download.add_done_callback(lambda _: progress.set())
+            if convert:
+                # Conversion audio à la volée : fichier source suivi -> ffmpeg
+                processes.append(await asyncio.create_subprocess_exec(
+                    'ffmpeg', '-loglevel', 'error', '-i', 'pipe:0', *encode_cmd,
+                    stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=subprocess.DEVNULL))
+                tasks.append(asyncio.create_task(feed_process(
+                    follow_download(source_file, download, progress), processes[-1].stdin)))
+
+        if processes:
+            # Sortie de ffmpeg : c'est la boucle qui écrit le fichier partiel
+            part = await run_in_threadpool(open, part_file, "wb")
+            output = read_stream(processes[-1].stdout)
+        else:
+            output = follow_download(source_file, download, progress)
+        async for chunk in output:
+            if part is not None:
+                await run_in_threadpool(part.write, chunk)
+            if download is None:
+                metrics.inc("downloaded_bytes_total", len(chunk))  # Sinon compté par le job
+            yield chunk
+        if part is not None:
+            await run_in_threadpool(part.close)
+
+        succeeded = all([await p.wait() == 0 for p in processes])
+        if download is not None:
+            await download
+            if job.status != JOB_FINISHED:
+                logging.error(f"Erreur de streaming: {job.error}")
+                succeeded = False
+        if succeeded:
+            filename = f"{clean_name(info.get('title') or 'video')[:100]}-{key[:12]}.{ext}"
+
+            def keep():
+                with metrics.time("stage_duration_seconds", stage="rename"):
+                    os.replace(part_file if processes else source_file, os.path.join(DOWNLOAD_DIR, filename))
+                release_reservation()
+                media_store.add(filename, key=key, meta={
+                    'title': info.get('title'),
+                    'duration': info.get('duration'),
+                    'thumbnail': info.get('thumbnail'),
+                })
+
+            await run_in_threadpool(keep)
+            schedule_probe(os.path.join(DOWNLOAD_DIR, filename))
+            logging.info(f"Streaming terminé et conservé: {filename}")
+        else:
+            logging.error(f"Streaming interrompu par une erreur: {url}")
+    finally:
+        # Client déconnecté ou erreur : nettoyage dans une tâche à part,
+        # qui va jusqu'au bout même si la requête est annulée
+        cleanup = asyncio.create_task(close_stream(
+            base, part, processes, job, download, tasks, slot, reservation))
+        await asyncio.shield(cleanup)
+
+async def close_stream(base: str, part, processes: list, job: Optional[Job], download: Optional[asyncio.Future],
+                       tasks: list, slot: bool, reservation):
+    """Arrête les processus et le téléchargement d'un streaming, puis libère ses ressources."""
+    if job is not None:
+        job_manager.cancel(job.id)
+    for task in tasks:
+        task.cancel()
+    for process in processes:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    # yt-dlp s'arrête au prochain bloc (DownloadCancelled) : on attend la fin
+    # du job avant de supprimer ses fichiers
+    await asyncio.gather(*tasks, *([download] if download is not None else []), return_exceptions=True)
+    if slot:
+        ffmpeg_runner.release()
+    if part is not None:
+        await run_in_threadpool(part.close)
+    await run_in_threadpool(reservation.__exit__, None, None, None)
+    temp_files.release(base)
+
+@app.get("/download/stream")
+async def stream_download(request: Request, url: str, format: str = "mp4", accept: Optional[str] = None):
+    """
+    Téléchargement en streaming : les octets sont envoyés au client au fur
+    et à mesure qu'ils arrivent de la source (réponse chunked).
+    `accept` (audio) : codecs/conteneurs acceptés séparés par des virgules.
+    """
+    data = DownloadRequest(url=url, format=format, accept=accept.split(',') if accept else None)
+    if data.is_blocked_url():
+        raise HTTPException(
+            status_code=403,
+            detail="Cette source est protégée par des droits d'auteur et ne peut pas être téléchargée"
+        )
+
+    try:
+        targets = data.audio_targets()
+        info = await run_in_threadpool(get_video_info, str(data.url))
+        ydl_opts = build_download_options(data)
+        plan = None
+        if targets:
+            plan = plan_audio(info, targets)
+            fmt = next(f for f in info.get('formats') or [info] if f.get('format_id') == plan['format_id'])
+        else:
+            fmt = await run_in_threadpool(select_stream_format, info, ydl_opts['format'])
+        ydl_opts['format'] = fmt['format_id']
+        key = await run_in_threadpool(store_key_for, str(data.url), ydl_opts, targets)
+    except Exception as e:
+        logging.error(f"Erreur de streaming: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Erreur lors du téléchargement: {str(e)}")
+
+    # Déjà en stock : envoi direct depuis le disque
+    entry = await run_in_threadpool(media_store.lookup, key)
+    if entry is not None:
+        return get_file(entry.filename, request)
+
+    # Le client attend les octets : pas de file d'attente possible si le store est plein
+    size = int(estimated_size(fmt, info.get('duration')) or 0)
+    check_store_room(size, queueable=False)
+
+    ext = plan['container'] if plan else fmt.get('ext') or 'mp4'
+    filename = f"{clean_name(info.get('title') or 'video')[:100]}.{ext}"
+    logging.info(f"Début du streaming: {data.url} (format: {fmt['format_id']})")
+    return StreamingResponse(
+        stream_media(str(data.url), key, info, fmt, ext, plan, size,
+                     host=urllib.parse.urlparse(str(data.url)).netloc.lower()),
+        media_type=guess_media_type(filename),
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+def expand_playlist(url: str) -> List[str]:
+    """URLs des éléments d'une playlist, sans extraire chaque vidéo (extraction "flat")."""
+    with ydl_pool.lease('playlist') as ydl:
+        info = ydl.extract_info(url, download=False)
+    if info is None:
+        raise ValueError("Impossible d'extraire la playlist")
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return [url]
+    urls = []
+    for entry in info.get('entries') or []:
+        if entry and (entry.get('url') or entry.get('webpage_url')):
+            urls.append(entry.get('webpage_url') or entry['url'])
+    return urls
+
+def wait_job(job: Job) -> asyncio.Future:
+    """Future asyncio résolue à la fin d'un job exécuté dans le pool."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    job.add_done_callback(lambda j: loop.call_soon_threadsafe(
+        lambda: future.done() or future.set_result(j)))
+    return future
+
+async def run_batch(job: Job, requests: List[DownloadRequest], parallelism: int, events: asyncio.Queue):
+    """
+    Répartit les éléments d'un lot dans le pool de téléchargement.
+    Au plus `parallelism` éléments sont soumis à la fois (la limite par
+    domaine du pool s'applique en plus) ; chaque changement d'état est
+    publié dans `events`, terminé par None.
+    """
+    items = [{"index": i, "url": str(request.url), "job_id": None, "status": JOB_QUEUED}
+             for i, request in enumerate(requests)]
+    semaphore = asyncio.Semaphore(parallelism)
+    done = 0
+
+    async def run_item(item: dict, data: DownloadRequest):
+        nonlocal done
+        async with semaphore:
+            if job.cancel_event.is_set():
+                item.update(status=JOB_CANCELLED, error="Job annulé")
+            else:
+                host = urllib.parse.urlparse(item["url"]).netloc.lower()
+                child = job_manager.submit("download", run_download, data, host=host)
+                job.children.append(child.id)
+                item.update(job_id=child.id, status=JOB_RUNNING)
+                await events.put({"type": "item", **item})
+                await wait_job(child)
+                item.update(status=child.status, error=child.error)
+                if child.result:
+                    item["filename"] = child.result["filename"]
+                    item["title"] = child.result.get("title")
+        done += 1
+        job.update(progress=done / len(items))
+        await events.put({"type": "item", **item})
+
+    try:
+        await asyncio.gather(*(run_item(item, request) for item, request in zip(items, requests)))
+        failed = sum(item["status"] != JOB_FINISHED for item in items)
+        status = JOB_CANCELLED if job.cancel_event.is_set() else JOB_FINISHED
+        job.finish(status, result={"items": items, "failed": failed},
+                   error="Job annulé" if status == JOB_CANCELLED else None)
+    except Exception as e:
+        logging.error(f"Erreur du lot {job.id}: {str(e)}")
+        job.finish(JOB_FAILED, result={"items": items}, error=str(e))
+    finally:
+        await events.put({"type": "batch", **job.snapshot().dict()})
+        await events.put(None)
+
+async def batch_events(events: asyncio.Queue):
+    while True:
+        event = await events.get()
+        if event is None:
+            return
+        yield event
+
+async def batch_ndjson(job: Job, events: asyncio.Queue):
+    yield json.dumps({"type": "batch", **job.snapshot().dict()}) + "\n"
+    async for event in batch_events(events):
+        yield json.dumps(event) + "\n"
+
+class ZipStreamBuffer(io.RawIOBase):
+    """Sortie non positionnable de zipfile, vidée au fil de l'eau vers le client."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def batch_zip(job: Job, events: asyncio.Queue):
+    """
+    Archive zip construite à la volée : chaque fichier y est ajouté dès
+    que son téléchargement se termine (ordre d'arrivée, sans compression,
+    les médias l'étant déjà). Un manifeste `batch.json` clôt l'archive.
+    """
+    buffer = ZipStreamBuffer()
+    archive = zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+    async for event in batch_events(events):
+        filename = event.get("filename")
+        if event["type"] != "item" or not filename or media_store.pin(filename) is None:
+            continue
+        try:
+            path = os.path.join(DOWNLOAD_DIR, filename)
+            member = zipfile.ZipInfo(filename, date_time=time.localtime(os.path.getmtime(path))[:6])
+            with open(path, "rb") as source, archive.open(member, "w", force_zip64=True) as target:
+                while chunk := await run_in_threadpool(source.read, FILE_CHUNK_SIZE):
+                    target.write(chunk)
+                    yield buffer.drain()
+        finally:
+            media_store.unpin(filename)
+        yield buffer.drain()
+    archive.writestr("batch.json", json.dumps(job.snapshot().dict(), indent=2))
+    archive.close()
+    yield buffer.drain()
+
+@app.post("/download/batch")
+async def download_batch(data: BatchDownloadRequest):
+    """
+    Télécharge une liste d'URLs et/ou une playlist. Les éléments sont
+    répartis dans le pool de workers ; la réponse est un flux NDJSON des
+    changements d'état ou une archive zip. Le lot est aussi suivi via
+    /jobs/{job_id} et continue si le client se déconnecte.
+    """
+    if data.output not in ("ndjson", "zip"):
+        raise HTTPException(status_code=400, detail="Sortie non supportée (ndjson ou zip)")
+
+    urls = [str(url) for url in data.urls]
+    if data.playlist is not None:
+        try:
+            urls += await run_in_threadpool(expand_playlist, str(data.playlist))
+        except Exception as e:
+            logging.error(f"Erreur d'extraction de la playlist: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Erreur lors de l'extraction de la playlist: {str(e)}")
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        raise HTTPException(status_code=400, detail="Aucune URL à télécharger")
+    if len(urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Trop d'éléments (maximum {BATCH_MAX_ITEMS})")
+    requests = [DownloadRequest(url=url, format=data.format, accept=data.accept) for url in urls]
+    try:
+        requests[0].audio_targets()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if any(request.is_blocked_url() for request in requests):
+        raise HTTPException(
+            status_code=403,
+            detail="Cette source est protégée par des droits d'auteur et ne peut pas être téléchargée"
+        )
+    check_store_room()
+
+    parallelism = max(1, min(data.parallelism or DOWNLOAD_WORKERS, len(urls)))
+    job = job_manager.register("batch")
+    job.update(progress=0.0, stage=f"{len(urls)} éléments")
+    events: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(run_batch(job, requests, parallelism, events))
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    logging.info(f"Lot {job.id}: {len(urls)} éléments, parallélisme {parallelism}")
+
+    headers = {"X-Job-Id": job.id}
+    if data.output == "zip":
+        headers["Content-Disposition"] = f'attachment; filename="batch-{job.id[:12]}.zip"'
+        return StreamingResponse(batch_zip(job, events), media_type="application/zip", headers=headers)
+    return StreamingResponse(batch_ndjson(job, events), media_type="application/x-ndjson", headers=headers)
+
+def remote_job(job_id: str) -> Optional[JobStatus]:
+    """État publié par un autre worker."""
+    data = state.get(f"job:{job_id}")
+    return JobStatus(**json.loads(data)) if data else None
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is not None:
+        return job.snapshot()
+    snapshot = remote_job(job_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Job non trouvé")
+    return snapshot
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Flux SSE (text/event-stream) de la progression d'un job : un événement
+    `progress` par changement, au plus un toutes les PROGRESS_INTERVAL
+    secondes, puis `done` à la fin. Chaque événement porte l'état complet :
+    après une coupure (proxy, réseau), EventSource se reconnecte et reçoit
+    l'état courant sans que le traitement soit relancé.
+    """
+    # Abonnement avant la lecture de l'état : aucun changement ne peut être manqué
+    queue = progress_hub.subscribe(job_id)
+    try:
+        snapshot = await run_in_threadpool(get_job, job_id)
+    except HTTPException:
+        progress_hub.unsubscribe(job_id, queue)
+        raise
+
+    async def events():
+        try:
+            done, message = progress_hub.format(snapshot)
+            yield f"retry: {SSE_RETRY_MS}\n{message}"
+            while not done:
+                try:
+                    done, message = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield message
+        finally:
+            progress_hub.unsubscribe(job_id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Pas de mise en tampon par nginx
+    })
+
+@app.delete("/jobs/{job_id}", response_model=JobStatus)
+def cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is not None:
+        return job.snapshot()
+    snapshot = remote_job(job_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Job non trouvé")
+    # Job d'un autre worker : il verra la demande dans watch_cancellations
+    if snapshot.status not in JOB_DONE_STATES:
+        state.set(f"job-cancel:{job_id}", WORKER_ID, ttl=3600)
+    return snapshot
+
+async def watch_cancellations():
+    """Applique les annulations demandées à d'autres workers pour nos jobs."""
+    def check():
+        for job in list(job_manager.jobs.values()):
+            if job.status not in JOB_DONE_STATES and state.get(f"job-cancel:{job.id}"):
+                job_manager.cancel(job.id)
+    while True:
+        await asyncio.sleep(1)
+        try:
+            await run_in_threadpool(check)
+        except Exception as e:
+            logging.error(f"Erreur lors de la vérification des annulations: {str(e)}")
+
+# Types MIME absents de certaines tables système
+for _ext, _type in {
+    '.m4a': 'audio/mp4',
+    '.opus': 'audio/ogg',
+    '.oga': 'audio/ogg',
+    '.mka': 'audio/x-matroska',
+    '.mkv': 'video/x-matroska',
+    '.webm': 'video/webm',
+    '.mov': 'video/quicktime',
+    '.ts': 'video/mp2t',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.vtt': 'text/vtt',
+}.items():
+    mimetypes.add_type(_type, _ext)
+
+# Signatures de conteneurs pour les fichiers sans extension reconnue
+MEDIA_SIGNATURES = [
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'\x1a\x45\xdf\xa3', 'video/webm'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'\xff\xfb', 'audio/mpeg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'RIFF', 'video/x-msvideo'),
+    (0, b'\x47', 'video/mp2t'),
+]
+
+def guess_media_type(path: str) -> str:
+    """Type MIME d'un fichier : extension d'abord, puis signature du conteneur."""
+    media_type = mimetypes.guess_type(path)[0]
+    if media_type:
+        return media_type
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(12)
+    except OSError:
+        return 'application/octet-stream'
+    for offset, signature, candidate in MEDIA_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return candidate
+    return 'application/octet-stream'
+
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """Évalue If-None-Match puis If-Modified-Since (RFC 9110 §13.2.2)."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        # Comparaison faible : W/"x" et "x" désignent la même représentation
+        candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return etag.removeprefix('W/') in candidates
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+file_bandwidth = TokenBucket(FILE_RATE_TOTAL, FILE_RATE_TOTAL) if FILE_RATE_TOTAL > 0 else None
+
+class MediaFileResponse(FileResponse):
+    """
+    FileResponse servant les corps complets et les plages simples via
+    l'extension ASGI `http.response.zerocopysend` (sendfile) quand le serveur
+    la propose, et par blocs de FILE_CHUNK_SIZE sinon. Les requêtes
+    multi-plages restent gérées par Starlette.
+    Avec FILE_RATE_PER_CONNECTION ou FILE_RATE_TOTAL, le débit est plafonné
+    (par réponse et pour tout le worker) : les blocs sont alors plus petits
+    et chaque envoi attend les jetons de ses seaux, sans sendfile.
+    Un fichier épinglé (`pinned`) est libéré à la fin de la réponse, même
+    en cas d'erreur (416, 400) ou de déconnexion du client.
+    """
+
+    chunk_size = FILE_CHUNK_SIZE
+    pinned: Optional[str] = None  # Fichier du store épinglé pendant l'envoi
+
+    async def __call__(self, scope, receive, send):
+        buckets = [b for b in (file_bandwidth,) if b is not None]
+        if FILE_RATE_PER_CONNECTION > 0:
+            buckets.append(TokenBucket(FILE_RATE_PER_CONNECTION, FILE_RATE_PER_CONNECTION))
+        if buckets:
+            # Environ quatre blocs par seconde au débit le plus bas : envoi régulier
+            self.chunk_size = min(FILE_CHUNK_SIZE, max(STREAM_CHUNK_SIZE, int(min(b.rate for b in buckets) // 4)))
+        self._zerocopy = not buckets and "http.response.zerocopysend" in scope.get("extensions", {})
+
+        async def counting_send(message):
+            if message["type"] == "http.response.body":
+                size = len(message.get("body", b""))
+                if size and buckets:
+                    delay = max(bucket.reserve(size) for bucket in buckets)
+                    if delay:
+                        await asyncio.sleep(delay)
+                metrics.inc("served_bytes_total", size)
+            elif message["type"] == "http.response.zerocopysend":
+                metrics.inc("served_bytes_total", message["count"])
+            await send(message)
+
+        try:
+            with metrics.time("stage_duration_seconds", stage="serve"):
+                await super().__call__(scope, receive, counting_send)
+        finally:
+            if self.pinned is not None:
+                media_store.unpin(self.pinned)
+
+    async def _handle_simple(self, send, send_header_only: bool) -> None:
+        if not self._zerocopy or send_header_only:
+            return await super()._handle_simple(send, send_header_only)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await self._zerocopy_send(send, 0, int(self.headers["content-length"]))
+
+    async def _handle_single_range(self, send, start: int, end: int, file_size: int, send_header_only: bool) -> None:
+        if not self._zerocopy or send_header_only:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        await self._zerocopy_send(send, start, end - start)
+
+    async def _handle_multiple_ranges(self, send, ranges, file_size: int, send_header_only: bool) -> None:
+        # Starlette place « multipart/byteranges » dans Content-Range au lieu de Content-Type
+        async def fixed_send(message):
+            if message["type"] == "http.response.start":
+                headers = [(k, v) for k, v in message["headers"] if k != b"content-type"]
+                message = {**message, "headers": [
+                    (b"content-type", v) if k == b"content-range" else (k, v) for k, v in headers
+                ]}
+            await send(message)
+        await super()._handle_multiple_ranges(fixed_send, ranges, file_size, send_header_only)
+
+    async def _zerocopy_send(self, send, offset: int, count: int):
+        with open(self.path, "rb") as file:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": file,
+                "offset": offset,
+                "count": count,
+                "more_body": False,
+            })
+
+@app.api_route("/file/{filename}", methods=["GET", "HEAD"])
+def get_file(filename: str, request: Request, download: bool = True):
+    """
+    Sert un fichier du store avec Range (simple et multiple), ETag,
+    Last-Modified et réponses 304. `download=false` sert le fichier en
+    ligne (lecture dans une balise <video>).
+    """
+    file_path = os.path.join(DOWNLOAD_DIR, filename)
+    try:
+        if filename.startswith('.'):
+            raise FileNotFoundError(filename)
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    
+    headers = {'Cache-Control': 'no-cache'}  # Revalidation systématique, peu coûteuse (304)
+    response = MediaFileResponse(
+        file_path,
+        media_type=guess_media_type(file_path),
+        filename=filename,
+        stat_result=stat_result,
+        headers=headers,
+        content_disposition_type='attachment' if download else 'inline'
+    )
+    if is_not_modified(request, response.headers['etag'], stat_result.st_mtime):
+        headers.update({k: response.headers[k] for k in ('etag', 'last-modified')})
+        return Response(status_code=304, headers=headers)
+
+    # Épinglé pendant l'envoi pour ne pas être évincé en cours de route
+    media_store.pin(filename)
+    response.pinned = filename
+    return response
+
+@app.get("/health")
+def health_check():
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métriques au format texte Prometheus."""
+    return Response(await run_in_threadpool(metrics.render),
+                    media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Compteurs des caches d'extraction et de fichiers (hits, misses...)."""
+    return {"extraction": extraction_cache.stats(), "store": media_store.stats(), "ydl_pool": ydl_pool.stats(),
+            "hls": hls_packager.stats(), "admission": admission.stats()}
+
+def filter_best_formats(info: dict, **constraints) -> List[dict]:
+    """
+    Formats proposés au client, depuis le classement en cache :
+    - un format vidéo (fusion vidéo+audio ou progressif) par palier de qualité
+    - le meilleur format audio
+    """
+    ranking = get_ranking(info)
+    selected = select_formats(ranking, **constraints)
+    if ranking['audio']:
+        selected.append(ranking['audio'][0])
+    return selected
+
+@app.get("/formats")
+async def get_formats(url: str, max_height: Optional[int] = None, max_filesize: Optional[int] = None,
+                      vcodecs: Optional[str] = None, container: Optional[str] = None):
+    """
+    Récupère les formats disponibles pour une URL donnée.
+    Contraintes optionnelles du client : hauteur et taille maximales,
+    codecs vidéo décodables (`h264,vp9,av1`), conteneur (`mp4`, `webm`).
+    Les `format_id` retournés sont des sélecteurs yt-dlp utilisables tels quels.
+    """
+    # Import hors de la boucle : si le préchauffage n'est pas fini, le premier
+    # import de yt-dlp et de ses extracteurs prend plusieurs centaines de ms
+    yt_dlp = await run_in_threadpool(importlib.import_module, "yt_dlp")
+    try:
+        logging.info(f"Tentative de récupération des formats pour l'URL: {url}")
+        
+        try:
+            # Extraction hors de la boucle d'événements, partagée avec /download
+            info = await run_in_threadpool(get_video_info, url)
+            
+            logging.info(f"Formats trouvés: {len(info.get('formats', []))}")
+            
+            # Filtrer pour obtenir les meilleurs formats
+            best_formats = filter_best_formats(
+                info,
+                max_height=max_height,
+                max_filesize=max_filesize,
+                vcodecs=vcodecs.lower().split(',') if vcodecs else None,
+                container=container
+            )
+            
+            if not best_formats:
+                raise ValueError("Aucun format compatible n'a été trouvé")
+            
+            # Convertir en FormatInfo
+            formats = []
+            for f in best_formats:
+                format_note = []
+                if f['type'] == 'video':
+                    if f.get('height'):
+                        format_note.append(f"{f['height']}p")
+                    if f['fps'] > 30:
+                        format_note.append(f"{int(f['fps'])}fps")
+                    if f.get('vcodec'):
+                        format_note.append(f['vcodec'].upper())
+                else:
+                    format_note.append("Audio")
+                    if f.get('abr'):
+                        format_note.append(f"{int(f['abr'])}kbps")
+
+                formats.append(FormatInfo(
+                    format_id=f['selector'],
+                    ext=f.get('ext') or '',
+                    resolution=f"{f['height']}p" if f.get('height') else None,
+                    filesize=f.get('size'),
+                    format_note=' - '.join(format_note) or "Format inconnu",
+                    vcodec=f.get('vcodec') if f['type'] == 'video' else 'none',
+                    acodec=f.get('acodec')
+                ))
+
+            return VideoInfo(
+                title=info.get('title', ''),
+                formats=formats,
+                thumbnail=info.get('thumbnail'),
+                duration=info.get('duration')
+            )
+
+        except yt_dlp.utils.DownloadError as e:
+            logging.error(f"Erreur yt-dlp lors de l'extraction: {str(e)}")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Erreur lors de l'extraction des informations: {str(e)}"
+            )
+
+    except Exception as e:
+        logging.error(f"Erreur lors de la récupération des formats: {str(e)}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Erreur lors de la récupération des formats: {str(e)}"
+        )
+
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request):
+    try:
+        return templates.TemplateResponse("index.html", {"request": request})
+    except Exception as e:
+        logging.error(f"Erreur lors du rendu de index.html: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/video_editor", response_class=HTMLResponse)
+async def editor(request: Request):
+    try:
+        return templates.TemplateResponse("video_editor.html", {"request": request})
+    except Exception as e:
+        logging.error(f"Erreur lors du rendu de video_editor.html: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Exécution asynchrone de ffmpeg
+class FFmpegError(Exception):
+    """Échec, délai dépassé ou sortie invalide d'une commande ffmpeg/ffprobe."""
+
+class FFmpegRunner:
+    """
+    Lance ffmpeg avec asyncio.create_subprocess_exec : la boucle d'événements
+    n'est jamais bloquée. Le nombre de processus simultanés est plafonné
+    (FFMPEG_MAX_CONCURRENCY, la moitié des CPU par défaut), chaque commande a
+    un délai maximal et la sortie `-progress` alimente la progression du job.
+    Annuler le job ou la tâche asyncio tue le processus.
+    """
+
+    def __init__(self, max_concurrency: int, timeout: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.active = 0  # Processus ffmpeg en cours
+        self.waiting = 0  # Commandes en attente d'un créneau
+        self._waiters = []  # Tas de [priorité, ordre d'arrivée, future]
+        self._sequence = 0
+
+    async def run(self, args: List[str], job: Optional[Job] = None, duration: Optional[float] = None,
+                  timeout: Optional[float] = None, priority: str = 'edit'):
+        """
+        Exécute `ffmpeg <args>` ; `duration` (secondes de sortie) permet de calculer la progression.
+        `priority` (classe d'ADMISSION_CLASSES) ordonne l'attente d'un créneau.
+        """
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1', '-y', *args]
+        await self.acquire(priority)
+        start = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            try:
+                stderr = await asyncio.wait_for(
+                    self._watch(process, job, duration), timeout or self.timeout)
+            except asyncio.TimeoutError:
+                raise FFmpegError("Délai dépassé pour ffmpeg")
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+            if job is not None and job.cancel_event.is_set():
+                raise JobCancelled()
+            if process.returncode != 0:
+                raise FFmpegError(stderr.decode(errors='replace').strip()[-500:] or f"code {process.returncode}")
+        finally:
+            self.release()
+            metrics.observe("stage_duration_seconds", time.perf_counter() - start, stage="ffmpeg")
+
+    async def acquire(self, priority: str = 'edit'):
+        """
+        Réserve un créneau (aussi pour un ffmpeg lancé hors de `run`, ex: streaming).
+        Les créneaux libérés vont d'abord aux classes prioritaires : un segment
+        HLS ou un aperçu passe devant les ré-encodages de l'éditeur en attente.
+        """
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._waiters, [ADMISSION_CLASSES.index(priority), self._sequence, future])
+        self.waiting += 1
+        try:
+            await future  # Le créneau est transmis par release() : `active` est déjà compté
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():  # Attentes annulées ignorées
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    async def probe(self, args: List[str], timeout: float = 60) -> bytes:
+        """Exécute `ffprobe <args>` et retourne sa sortie standard."""
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'error', *args,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            raise FFmpegError("Délai dépassé pour ffprobe")
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        if process.returncode != 0:
+            raise FFmpegError(stderr.decode(errors='replace').strip()[-500:])
+        return stdout
+
+    async def _watch(self, process, job: Optional[Job], duration: Optional[float]) -> bytes:
+        stderr_task = asyncio.create_task(process.stderr.read())
+        block = {}  # Un bloc `-progress` se termine par la ligne progress=continue|end
+        async for raw_line in process.stdout:
+            if job is not None and job.cancel_event.is_set():
+                process.kill()
+                break
+            key, _, value = raw_line.decode(errors='replace').strip().partition('=')
+            if key != 'progress':
+                block[key] = value
+                continue
+            if job is not None:
+                job.update(**ffmpeg_progress_fields(block, duration))
+            block = {}
+        await process.wait()
+        return await stderr_task
+
+def ffmpeg_progress_fields(block: dict, duration: Optional[float]) -> dict:
+    """Champs du job tirés d'un bloc `-progress` : position, image, vitesse, ETA."""
+    fields = {}
+    if block.get('frame', '').isdigit():
+        fields['frame'] = int(block['frame'])
+    try:
+        speed = float(block.get('speed', '').rstrip('x'))
+    except ValueError:
+        speed = None
+    fields['encode_speed'] = speed
+    try:
+        position = int(block.get('out_time_us', '')) / 1e6
+    except ValueError:
+        return fields
+    if duration:
+        fields['progress'] = min(max(position / duration, 0.0), 1.0)
+        if speed:
+            fields['eta'] = max(duration - position, 0.0) / speed
+    return fields
+
+ffmpeg_runner = FFmpegRunner(FFMPEG_MAX_CONCURRENCY, FFMPEG_TIMEOUT_SECONDS)
+
+def parse_timestamp(value: str) -> float:
+    """Convertit "SS", "MM:SS" ou "HH:MM:SS(.ms)" en secondes."""
+    seconds = 0.0
+    for part in value.strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+# Index persistant des caractéristiques des fichiers (ffprobe)
+class MediaIndex:
+    """
+    Table SQLite des faits ffprobe par fichier : durée, débit, conteneur,
+    flux, images clés et taille. Une entrée est valide tant que la taille et
+    le mtime du fichier n'ont pas changé ; sinon le fichier est ré-analysé.
+    Les analyses simultanées d'un même fichier sont regroupées.
+    """
+
+    def __init__(self, db_file: str):
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                duration REAL,
+                bit_rate INTEGER,
+                format_name TEXT,
+                streams TEXT NOT NULL,
+                keyframes TEXT NOT NULL,
+                probed_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def lookup(self, path: str) -> Optional[dict]:
+        """Entrée à jour pour `path`, sans lancer ffprobe."""
+        path = os.path.normpath(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime, duration, bit_rate, format_name, streams, keyframes, probed_at "
+                "FROM media WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime:
+            return None
+        return {
+            "size": row[0],
+            "mtime": row[1],
+            "duration": row[2],
+            "bit_rate": row[3],
+            "format_name": row[4],
+            "streams": json.loads(row[5]),
+            "keyframes": json.loads(row[6]),
+            "probed_at": row[7],
+        }
+
+    async def get(self, path: str) -> dict:
+        """Entrée pour `path`, analysée par ffprobe si absente ou périmée."""
+        path = os.path.normpath(path)
+        # SELECT et stat dans le threadpool : un disque lent ne bloque pas la boucle
+        entry = await run_in_threadpool(self.lookup, path)
+        if entry is not None:
+            return entry
+        pending = self._inflight.get(path)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[path] = pending
+        try:
+            entry = await self._probe(path)
+            pending.set_result(entry)
+            return entry
+        except BaseException as e:
+            pending.set_exception(e)
+            pending.exception()  # Évite l'avertissement si personne n'attendait
+            raise
+        finally:
+            del self._inflight[path]
+
+    async def index_quietly(self, path: str):
+        """Analyse en tâche de fond (fin de téléchargement, d'upload, d'édition)."""
+        try:
+            await self.get(path)
+        except (FFmpegError, OSError, ValueError) as e:
+            logging.warning(f"Analyse ffprobe impossible pour {path}: {str(e)}")
+
+    def forget(self, paths: List[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM media WHERE path = ?",
+                                   [(os.path.normpath(p),) for p in paths])
+            self._conn.commit()
+
+    def _save(self, path: str, entry: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, entry["size"], entry["mtime"], entry["duration"], entry["bit_rate"],
+                 entry["format_name"], json.dumps(entry["streams"]), json.dumps(entry["keyframes"]),
+                 entry["probed_at"]))
+            self._conn.commit()
+
+    async def _probe(self, path: str) -> dict:
+        stat = await run_in_threadpool(os.stat, path)
+        output = await ffmpeg_runner.probe([
+            '-show_entries',
+            'format=duration,bit_rate,format_name:'
+            'stream=index,codec_type,codec_name,profile,level,width,height,pix_fmt,avg_frame_rate,'
+            'color_range,color_space,color_transfer,color_primaries,bit_rate,sample_rate,channels',
+            '-of', 'json', path])
+        probe = json.loads(output)
+        fmt = probe.get('format', {})
+        streams = probe.get('streams', [])
+        keyframes = []
+        if any(st.get('codec_type') == 'video' for st in streams):
+            # Démultiplexage des paquets du premier flux vidéo, sans décodage
+            output = await ffmpeg_runner.probe([
+                '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+                '-of', 'csv=print_section=0', path], timeout=FFMPEG_TIMEOUT_SECONDS)
+            for line in output.decode().splitlines():
+                pts_time, _, flags = line.partition(',')
+                if flags.startswith('K') and pts_time not in ('', 'N/A'):
+                    keyframes.append(float(pts_time))
+            keyframes.sort()
+
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "duration": float(fmt['duration']) if fmt.get('duration') not in (None, 'N/A') else None,
+            "bit_rate": int(fmt['bit_rate']) if str(fmt.get('bit_rate') or '').isdigit() else None,
+            "format_name": fmt.get('format_name'),
+            "streams": streams,
+            "keyframes": keyframes,
+            "probed_at": time.time(),
+        }
+        await run_in_threadpool(self._save, path, entry)
+        return entry
+
+media_index = MediaIndex(MEDIA_INDEX_FILE)
+media_store.on_remove(media_index.forget)
+
+def disk_usage_metrics() -> dict:
+    usage = {}
+    for name, directory in (("downloads", DOWNLOAD_DIR), ("temp", TEMP_DIR)):
+        usage[(("directory", name),)] = directory_usage(directory)[0]
+    return usage
+
+def cache_hit_ratio_metrics() -> dict:
+    return {
+        (("cache", "extraction"),): extraction_cache.stats()["hit_ratio"],
+        (("cache", "store"),): media_store.stats()["hit_ratio"],
+    }
+
+def job_metrics() -> dict:
+    counts = {}
+    for job in list(job_manager.jobs.values()):
+        key = (("kind", job.kind), ("status", job.status))
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+metrics.gauge("directory_bytes", "Taille des fichiers de DOWNLOAD_DIR et TEMP_DIR", disk_usage_metrics)
+metrics.gauge("disk_free_bytes", "Espace libre du volume de DOWNLOAD_DIR",
+              lambda: shutil.disk_usage(DOWNLOAD_DIR).free)
+metrics.gauge("cache_hit_ratio", "Taux de succès des caches (extraction, store)", cache_hit_ratio_metrics)
+metrics.gauge("ffmpeg_active", "Processus ffmpeg en cours", lambda: ffmpeg_runner.active)
+metrics.gauge("ffmpeg_waiting", "Commandes ffmpeg en attente d'un créneau", lambda: ffmpeg_runner.waiting)
+metrics.gauge("jobs", "Jobs connus par type et état", job_metrics)
+metrics.gauge("progress_subscribers", "Clients SSE abonnés à la progression d'un job",
+              lambda: progress_hub.subscribers)
+metrics.gauge("ydl_pool_idle", "Instances YoutubeDL inactives dans le pool, par profil",
+              lambda: {(("profile", k),): v for k, v in ydl_pool.stats().items()})
+metrics.gauge("startup_seconds", "Durée du démarrage du worker, par phase (import, startup, warmup)",
+              lambda: {(("phase", k),): v for k, v in startup_timings.items()})
+main_loop: Optional[asyncio.AbstractEventLoop] = None  # Renseignée au démarrage
+
+def schedule_probe(path: str):
+    """Planifie l'indexation d'un fichier ; utilisable depuis un thread worker."""
+    if main_loop is not None:
+        asyncio.run_coroutine_threadsafe(media_index.index_quietly(path), main_loop)
+
+async def probe_duration(input_file: str) -> float:
+    duration = (await media_index.get(input_file))["duration"]
+    if duration is None:
+        raise ValueError("Durée inconnue")
+    return duration
+
+async def get_keyframes(input_file: str) -> List[float]:
+    """Horodatages des images clés du premier flux vidéo."""
+    return (await media_index.get(input_file))["keyframes"]
+
+async def probe_streams(input_file: str) -> List[dict]:
+    return (await media_index.get(input_file))["streams"]
+
+FINGERPRINT_SAMPLES = 16  # Blocs lus pour l'empreinte d'un fichier
+FINGERPRINT_CHUNK = 64 * 1024
+
+class ContentFingerprints:
+    """
+    Empreinte du contenu d'un fichier : taille et FINGERPRINT_SAMPLES blocs
+    répartis dans le fichier (lecture bornée à 1 Mio quelle que soit la
+    taille). Deux copies d'un fichier ont la même empreinte, une édition en
+    change. Mémorisée tant que la taille et le mtime du fichier sont inchangés.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()  # (chemin, taille, mtime) -> empreinte
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> str:
+        stat = os.stat(path)
+        key = (os.path.normpath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        digest = hashlib.sha256(str(stat.st_size).encode())
+        with open(path, 'rb') as f:
+            for i in range(FINGERPRINT_SAMPLES):
+                f.seek(stat.st_size * i // FINGERPRINT_SAMPLES)
+                digest.update(f.read(FINGERPRINT_CHUNK))
+        fingerprint = digest.hexdigest()[:32]
+        with self._lock:
+            self._entries[key] = fingerprint
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return fingerprint
+
+content_fingerprints = ContentFingerprints()
+
+PREVIEW_FILES = {'poster.jpg': 'image/jpeg', 'sprite.jpg': 'image/jpeg', 'sprite.vtt': 'text/vtt'}
+
+def vtt_timestamp(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+def select_preview_frames(keyframes: List[float], duration: float) -> tuple:
+    """
+    Images clés retenues pour la planche : chacune à au moins `threshold`
+    secondes de la précédente, soit PREVIEW_MAX_TILES au plus. Même règle que
+    le filtre `select` de la passe ffmpeg, qui retient donc les mêmes images.
+    """
+    # La marge évite qu'un écart égal au seuil soit tranché différemment par ffmpeg
+    threshold = max(round(duration / PREVIEW_MAX_TILES, 3) - 0.001, 0)
+    selected = []
+    for t in keyframes:
+        if not selected or t - selected[-1] >= threshold:
+            selected.append(t)
+    return threshold, selected
+
+class PreviewCache:
+    """
+    Aperçus d'un fichier : un poster et une planche de vignettes des images
+    clés indexée par un fichier WebVTT, produits par une seule passe ffmpeg
+    qui ne décode que les images clés (-skip_frame nokey) et les réduit.
+    Rangés dans PREVIEW_DIR par empreinte du contenu (ContentFingerprints) :
+    deux copies d'un fichier partagent leurs aperçus, une édition en produit
+    de nouveaux. Les générations simultanées d'une même empreinte sont
+    regroupées.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def path(self, fingerprint: str, name: str) -> str:
+        return os.path.join(self.directory, fingerprint, name)
+
+    async def get(self, path: str) -> dict:
+        """Manifeste des aperçus de `path`, générés s'ils n'existent pas encore."""
+        fingerprint = await run_in_threadpool(content_fingerprints.get, path)
+        manifest = await run_in_threadpool(self._load, fingerprint)
+        if manifest is not None:
+            return manifest
+        pending = self._inflight.get(fingerprint)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[fingerprint] = pending
+        try:
+            manifest = await self._render(path, fingerprint)
+            pending.set_result(manifest)
+            return manifest
+        except BaseException as e:
+            pending.set_exception(e)
+            pending.exception()  # Évite l'avertissement si personne n'attendait
+            raise
+        finally:
+            del self._inflight[fingerprint]
+
+    def sweep(self, max_age: float, orphan_age: float):
+        """Supprime les aperçus non consultés et les générations interrompues."""
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                age = now - os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if age > (orphan_age if name.startswith('.') else max_age):
+                shutil.rmtree(path, ignore_errors=True)
+                logging.info(f"Aperçu supprimé: {name}")
+
+    def _load(self, fingerprint: str) -> Optional[dict]:
+        try:
+            with open(self.path(fingerprint, 'manifest.json')) as f:
+                manifest = json.load(f)
+            os.utime(os.path.join(self.directory, fingerprint))  # Dernière consultation, pour sweep
+        except FileNotFoundError:
+            return None
+        return manifest
+
+    async def _render(self, path: str, fingerprint: str) -> dict:
+        entry = await media_index.get(path)
+        video = next((st for st in entry["streams"] if st.get('codec_type') == 'video'), None)
+        if video is None or not video.get('width') or not video.get('height') or not entry["keyframes"]:
+            raise ValueError("Aucun flux vidéo à prévisualiser")
+        duration = entry["duration"] or entry["keyframes"][-1]
+        threshold, times = select_preview_frames(entry["keyframes"], duration)
+        columns = min(len(times), PREVIEW_COLUMNS)
+        rows = -(-len(times) // columns)
+        tile_width = PREVIEW_TILE_WIDTH
+        tile_height = max(2, round(tile_width * video['height'] / video['width'] / 2) * 2)
+        poster_index = min(range(len(times)),
+                           key=lambda i: abs(times[i] - duration * PREVIEW_POSTER_POSITION))
+
+        work_dir = os.path.join(self.directory, f".{fingerprint}.{uuid.uuid4().hex[:8]}")
+        os.makedirs(work_dir)
+        try:
+            # Une passe : images clés seules, réparties entre la planche et le poster
+            await ffmpeg_runner.run([
+                '-skip_frame', 'nokey', '-i', path,
+                '-filter_complex',
+                f"[0:v:0]select='isnan(prev_selected_t)+gte(t-prev_selected_t,{threshold})',split=2[s][p];"
+                f"[s]scale={tile_width}:{tile_height},tile={columns}x{rows}[sprite];"
+                f"[p]select='eq(n,{poster_index})',scale='min({PREVIEW_POSTER_WIDTH},iw)':-2[poster]",
+                '-map', '[sprite]', '-frames:v', '1', '-q:v', '5', os.path.join(work_dir, 'sprite.jpg'),
+                '-map', '[poster]', '-frames:v', '1', '-q:v', '3', os.path.join(work_dir, 'poster.jpg'),
+            ], priority='serve')
+
+            cues = ["WEBVTT", ""]
+            for i, start in enumerate(times):
+                end = times[i + 1] if i + 1 < len(times) else max(duration, start)
+                x, y = i % columns * tile_width, i // columns * tile_height
+                cues += [f"{vtt_timestamp(start)} --> {vtt_timestamp(end)}",
+                         f"sprite.jpg#xywh={x},{y},{tile_width},{tile_height}", ""]
+            with open(os.path.join(work_dir, 'sprite.vtt'), 'w') as f:
+                f.write("\n".join(cues))
+
+            base_url = f"/api/previews/{fingerprint}"
+            manifest = {
+                "fingerprint": fingerprint,
+                "duration": duration,
+                "poster": f"{base_url}/poster.jpg",
+                "sprite": f"{base_url}/sprite.jpg",
+                "vtt": f"{base_url}/sprite.vtt",
+                "tiles": len(times),
+                "columns": columns,
+                "tile_width": tile_width,
+                "tile_height": tile_height,
+            }
+            with open(os.path.join(work_dir, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+            try:
+                os.rename(work_dir, os.path.join(self.directory, fingerprint))
+            except OSError:
+                # Produits entre-temps par un autre worker : les siens font foi
+                existing = await run_in_threadpool(self._load, fingerprint)
+                if existing is None:
+                    raise
+                manifest = existing
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        logging.info(f"Aperçus générés pour {os.path.basename(path)}: {len(times)} vignettes")
+        return manifest
+
+preview_cache = PreviewCache(PREVIEW_DIR)
+
+HLS_COPY_VIDEO_CODECS = ('h264',)  # Lisibles dans un segment MPEG-TS par hls.js et Safari
+HLS_COPY_AUDIO_CODECS = ('aac', 'mp3')
+HLS_SEEK_MARGIN = 0.001  # Recherche juste après l'image clé : l'arrondi de ffprobe ne recule pas d'un GOP
+
+def hls_segments(keyframes: List[float], duration: float, target: float) -> List[tuple]:
+    """
+    Découpage en segments (début, durée, coupure) d'au moins `target`
+    secondes, chacun commençant sur une image clé (ou tous les `target`
+    secondes sans flux vidéo). `coupure`, relative au début, tombe entre la
+    dernière image clé du segment et la suivante : c'est là que le muxer
+    segment de ffmpeg doit couper.
+    """
+    points = keyframes or [i * target for i in range(1, int(duration // target) + 1)]
+    starts, last_keyframes = [0.0], [0.0]
+    for t in points:
+        if t - starts[-1] >= target:
+            starts.append(t)
+            last_keyframes.append(t)
+        elif t > last_keyframes[-1]:
+            last_keyframes[-1] = t
+    segments = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else max(duration, start)
+        if end > start:
+            segments.append((start, end - start, (last_keyframes[i] + end) / 2 - start))
+    return segments
+
+def hls_renditions(entry: dict) -> dict:
+    """
+    Rendus proposés : `source` (flux copiés quand HLS les accepte, sinon
+    H.264/AAC) et, pour une vidéo plus haute que HLS_PROXY_HEIGHT, `proxy`
+    en basse définition pour l'éditeur.
+    """
+    video = next((st for st in entry["streams"] if st.get('codec_type') == 'video'), None)
+    audio = next((st for st in entry["streams"] if st.get('codec_type') == 'audio'), None)
+    if video is None and audio is None:
+        raise ValueError("Aucun flux lisible")
+    bandwidth = entry.get("bit_rate") or (entry["size"] * 8 / entry["duration"] if entry.get("duration") else 0)
+    renditions = {'source': {
+        'video': None if video is None else 'copy' if video.get('codec_name') in HLS_COPY_VIDEO_CODECS else 'h264',
+        'audio': None if audio is None else 'copy' if audio.get('codec_name') in HLS_COPY_AUDIO_CODECS else 'aac',
+        'width': video and video.get('width'),
+        'height': video and video.get('height'),
+        'bandwidth': int(bandwidth) or HLS_PROXY_BITRATE,
+    }}
+    if HLS_PROXY_HEIGHT and video and (video.get('height') or 0) > HLS_PROXY_HEIGHT:
+        renditions['proxy'] = {
+            'video': 'proxy',
+            'audio': audio and 'aac',
+            'width': round(video['width'] * HLS_PROXY_HEIGHT / video['height'] / 2) * 2 if video.get('width') else None,
+            'height': HLS_PROXY_HEIGHT,
+            'bandwidth': HLS_PROXY_BITRATE + (96_000 if audio else 0),
+        }
+    return renditions
+
+def hls_segment_args(input_file: str, rendition: dict, segment: tuple, output_dir: str) -> tuple:
+    """
+    Commande ffmpeg d'un segment MPEG-TS et fichier produit. En copie vidéo,
+    le muxer segment coupe exactement sur l'image clé suivante (une limite
+    -t, appliquée aux DTS, y ajouterait le début du GOP suivant) ; en
+    ré-encodage, la recherche décode et -t est exact.
+    """
+    start, duration, split = segment
+    copy_video = rendition['video'] == 'copy'
+    seek = start + HLS_SEEK_MARGIN if copy_video and start > 0 else start
+    args = ['-ss', f'{seek:.3f}', '-i', input_file]
+    if rendition['video']:
+        args += ['-map', '0:v:0']
+    if rendition['audio']:
+        args += ['-map', '0:a:0']
+    if rendition['video'] == 'copy':
+        args += ['-c:v', 'copy']
+    elif rendition['video'] == 'h264':
+        args += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p']
+    elif rendition['video'] == 'proxy':
+        args += ['-vf', f"scale=-2:{rendition['height']}", '-c:v', 'libx264', '-preset', 'veryfast',
+                 '-b:v', str(HLS_PROXY_BITRATE), '-maxrate', str(HLS_PROXY_BITRATE),
+                 '-bufsize', str(HLS_PROXY_BITRATE * 2), '-pix_fmt', 'yuv420p']
+    if rendition['audio'] == 'copy':
+        args += ['-c:a', 'copy']
+    elif rendition['audio'] == 'aac':
+        args += ['-c:a', 'aac', '-b:a', '96k' if rendition['video'] == 'proxy' else '160k']
+    # Horodatages d'origine : les segments se suivent sur la ligne de temps du fichier
+    args += ['-output_ts_offset', f'{seek:.3f}']
+    if copy_video:
+        args += ['-t', f'{duration + 1:.3f}', '-f', 'segment', '-segment_format', 'mpegts',
+                 '-segment_times', f'{split:.3f}', os.path.join(output_dir, 'part%d.ts')]
+        return args, os.path.join(output_dir, 'part0.ts')
+    args += ['-t', f'{duration:.3f}', '-f', 'mpegts', os.path.join(output_dir, 'part.ts')]
+    return args, os.path.join(output_dir, 'part.ts')
+
+class HlsPackager:
+    """
+    Présente un fichier du store en HLS sans préparation : les playlists
+    viennent des images clés de l'index ffprobe et chaque segment est produit
+    par ffmpeg à sa première demande (copie de flux quand les codecs le
+    permettent). Le temps avant lecture ne dépend donc que de la taille d'un
+    segment. Les segments sont rangés par empreinte du contenu et évincés du
+    moins récemment servi au plus récent au-delà de `max_bytes` ; les
+    générations simultanées d'un même segment sont regroupées.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, segment_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_seconds = segment_seconds
+        self._lru: OrderedDict = OrderedDict()  # Chemin d'un segment -> taille
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def load(self):
+        """Reprend les segments présents sur disque, du plus ancien au plus récent."""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            if os.path.basename(root).startswith('.'):
+                shutil.rmtree(root, ignore_errors=True)  # Génération interrompue
+                continue
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self._touch(path, size)
+        self._evict()
+
+    async def describe(self, path: str) -> tuple:
+        """(empreinte, segments, rendus) d'un fichier, depuis l'index ffprobe."""
+        fingerprint = await run_in_threadpool(content_fingerprints.get, path)
+        entry = await media_index.get(path)
+        if not entry.get("duration"):
+            raise ValueError("Durée inconnue")
+        segments = hls_segments(entry["keyframes"], entry["duration"], self.segment_seconds)
+        return fingerprint, segments, hls_renditions(entry)
+
+    def master_playlist(self, renditions: dict) -> str:
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        for name, rendition in renditions.items():
+            attributes = f"BANDWIDTH={rendition['bandwidth']}"
+            if rendition['width'] and rendition['height']:
+                attributes += f",RESOLUTION={rendition['width']}x{rendition['height']}"
+            lines += [f"#EXT-X-STREAM-INF:{attributes}", f"{name}.m3u8"]
+        return "\n".join(lines) + "\n"
+
+    def media_playlist(self, name: str, fingerprint: str, segments: List[tuple]) -> str:
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{math.ceil(max(duration for _, duration, _ in segments))}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:VOD",
+        ]
+        for index, (_, duration, _) in enumerate(segments):
+            # L'empreinte dans l'URL : une playlist périmée ne mélange pas deux versions du fichier
+            lines += [f"#EXTINF:{duration:.3f},", f"{name}/{fingerprint}/{index}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    async def segment(self, path: str, fingerprint: str, name: str, rendition: dict, segments: List[tuple],
+                      index: int) -> str:
+        """Chemin du segment `index`, produit s'il n'est pas en cache."""
+        target = os.path.join(self.directory, fingerprint, name, f"{index}.ts")
+        try:
+            self._touch(target, os.path.getsize(target))
+            return target
+        except FileNotFoundError:
+            pass
+        pending = self._inflight.get(target)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[target] = pending
+        try:
+            await self._render(path, rendition, segments[index], target)
+            pending.set_result(target)
+            return target
+        except BaseException as e:
+            pending.set_exception(e)
+            pending.exception()  # Évite l'avertissement si personne n'attendait
+            raise
+        finally:
+            del self._inflight[target]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"segments": len(self._lru), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    async def _render(self, path: str, rendition: dict, segment: tuple, target: str):
+        work_dir = os.path.join(os.path.dirname(target), f".{uuid.uuid4().hex[:8]}")
+        os.makedirs(work_dir)
+        try:
+            args, output = hls_segment_args(path, rendition, segment, work_dir)
+            # Un proxy ré-encode : il passe après les segments copiés et les fichiers servis
+            priority = 'download' if rendition['video'] == 'proxy' else 'serve'
+            with metrics.time("stage_duration_seconds", stage="hls_segment"):
+                await ffmpeg_runner.run(args, priority=priority)
+            os.replace(output, target)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        self._touch(target, os.path.getsize(target))
+        await run_in_threadpool(self._evict, target)
+
+    def _touch(self, path: str, size: int):
+        with self._lock:
+            self._bytes += size - self._lru.pop(path, 0)
+            self._lru[path] = size
+
+    def _evict(self, keep: Optional[str] = None):
+        victims = []
+        with self._lock:
+            for path in list(self._lru):
+                if self._bytes <= self.max_bytes:
+                    break
+                if path != keep:
+                    self._bytes -= self._lru.pop(path)
+                    victims.append(path)
+        for path in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            # Dossiers du rendu et de l'empreinte supprimés une fois vides
+            for directory in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+
+hls_packager = HlsPackager(HLS_DIR, HLS_CACHE_MAX_BYTES, HLS_SEGMENT_SECONDS)
+
+# Encodeurs permettant de ré-encoder une bordure compatible avec les flux copiés
+SMART_CUT_VIDEO_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265'}
+SMART_CUT_AUDIO_ENCODERS = {'aac': 'aac', 'mp3': 'libmp3lame', 'ac3': 'ac3'}
+SMART_CUT_PROFILES = {  # Profil ffprobe -> profil de l'encodeur
+    'h264': {'Constrained Baseline': 'baseline', 'Baseline': 'baseline', 'Main': 'main', 'High': 'high',
+             'High 10': 'high10', 'High 4:2:2': 'high422', 'High 4:4:4 Predictive': 'high444'},
+    'hevc': {'Main': 'main', 'Main 10': 'main10', 'Main Still Picture': 'mainstillpicture'},
+}
+SMART_CUT_COLOR_OPTIONS = {'color_range': '-color_range', 'color_space': '-colorspace',
+                           'color_transfer': '-color_trc', 'color_primaries': '-color_primaries'}
+
+def reencode_args(streams: List[dict]) -> List[str]:
+    """Paramètres d'encodage reproduisant les codecs du fichier source."""
+    args = []
+    for stream in streams:
+        if stream.get('codec_type') == 'video':
+            args += ['-c:v', SMART_CUT_VIDEO_ENCODERS.get(stream.get('codec_name'), 'libx264')]
+            if stream.get('pix_fmt'):
+                args += ['-pix_fmt', stream['pix_fmt']]
+        elif stream.get('codec_type') == 'audio':
+            args += ['-c:a', SMART_CUT_AUDIO_ENCODERS.get(stream.get('codec_name'), 'aac')]
+            if stream.get('sample_rate'):
+                args += ['-ar', str(stream['sample_rate'])]
+            if stream.get('channels'):
+                args += ['-ac', str(stream['channels'])]
+    return args
+
+def smart_cut_video_args(video: dict) -> Optional[List[str]]:
+    """
+    Encodage des bordures d'un découpage précis compatible avec le milieu
+    copié : même encodeur, profil, niveau, format de pixels et couleurs que
+    la source. Les paramètres de séquence (SPS/PPS) sont répétés dans chaque
+    image clé pour que le décodeur suive le changement d'un morceau à l'autre.
+    None si la source ne peut pas être reproduite (codec ou profil inconnu).
+    """
+    codec = video.get('codec_name')
+    profile = SMART_CUT_PROFILES.get(codec, {}).get(video.get('profile'))
+    if codec not in SMART_CUT_VIDEO_ENCODERS or profile is None:
+        return None
+    args = ['-c:v', SMART_CUT_VIDEO_ENCODERS[codec], '-profile:v', profile]
+    level = video.get('level')
+    if isinstance(level, int) and level > 0:
+        if codec == 'h264':
+            args += ['-level:v', f"{level / 10:g}"]
+        else:
+            args += ['-x265-params', f"level-idc={level / 30:g}"]
+    if video.get('pix_fmt'):
+        args += ['-pix_fmt', video['pix_fmt']]
+    for key, option in SMART_CUT_COLOR_OPTIONS.items():
+        if video.get(key) not in (None, '', 'unknown'):
+            args += [option, video[key]]
+    return [*args, '-bsf:v', 'dump_extra=freq=keyframe']
+
+# Fonctions d'édition vidéo
+async def cut_video(input_file: str, output_file: str, start_time: str, end_time: str,
+                    job: Optional[Job] = None, precise: bool = False) -> Optional[dict]:
+    """
+    Découpe [start_time, end_time] avec un seek côté entrée (`-ss` avant
+    `-i`) : ffmpeg saute directement à la position sans décoder ce qui
+    précède. Par défaut les flux sont copiés depuis l'image clé précédant le
+    début. En mode précis, seuls les GOP partiels des bordures sont
+    ré-encodés avec les paramètres de la source, le milieu est copié, puis
+    les morceaux sont concaténés ; chaque morceau porte ses SPS/PPS dans le
+    flux (annexe B). Si la source ne peut pas être reproduite, tout
+    l'intervalle est ré-encodé.
+    Retourne les bornes effectives, ou None en cas d'échec.
+    """
+    parts = []
+    base = None
+    try:
+        start = parse_timestamp(start_time)
+        end = parse_timestamp(end_time)
+        if end <= start:
+            raise ValueError("La fin doit être postérieure au début")
+        keyframes = await get_keyframes(input_file)
+        streams_map = ['-map', '0:v?', '-map', '0:a?']
+
+        if not precise:
+            index = bisect.bisect_right(keyframes, start) - 1
+            cut_start = keyframes[index] if index >= 0 else 0.0
+            cmd = ['-ss', f"{cut_start:.6f}", '-i', input_file, '-t', f"{end - cut_start:.6f}",
+                   *streams_map, '-c', 'copy', '-avoid_negative_ts', 'make_zero', output_file]
+            await ffmpeg_runner.run(cmd, job, end - cut_start)
+            return {"start": cut_start, "end": end, "precise": False}
+
+        streams = await probe_streams(input_file)
+        video = next((st for st in streams if st.get('codec_type') == 'video'), {})
+        audio = [st for st in streams if st.get('codec_type') == 'audio']
+        video_args = smart_cut_video_args(video)
+        # Première image clé après le début, dernière avant la fin
+        first = bisect.bisect_left(keyframes, start)
+        last = bisect.bisect_right(keyframes, end) - 1
+        inner_start = keyframes[first] if first < len(keyframes) else None
+        inner_end = keyframes[last] if last >= 0 else None
+
+        if (video_args is not None and inner_start is not None and inner_end is not None
+                and inner_end > inner_start and all(st.get('codec_name') in SMART_CUT_AUDIO_ENCODERS for st in audio)):
+            try:
+                # Morceaux : bordure ré-encodée, milieu copié (SPS/PPS remis dans le flux), bordure ré-encodée
+                base = temp_files.claim("smartcut")
+                encode = [*video_args, *reencode_args(audio)]
+                copy = ['-c', 'copy', '-bsf:v', f"{video['codec_name']}_mp4toannexb"]
+                plan = [(start, inner_start, encode), (inner_start, inner_end, copy), (inner_end, end, encode)]
+                for index, (part_start, part_end, codec_args) in enumerate(plan):
+                    if part_end - part_start < 0.001:
+                        continue
+                    part_file = f"{base}_{index}.mkv"
+                    await ffmpeg_runner.run(
+                        ['-ss', f"{part_start:.6f}", '-i', input_file, '-t', f"{part_end - part_start:.6f}",
+                         *streams_map, *codec_args, '-f', 'matroska', part_file], job)
+                    parts.append(part_file)
+                    if job is not None:
+                        job.update(progress=(index + 1) / (len(plan) + 1))
+
+                list_file = f"{base}.txt"
+                with open(list_file, 'w') as f:
+                    f.writelines(f"file '{os.path.abspath(part)}'\n" for part in parts)
+                await ffmpeg_runner.run(
+                    ['-f', 'concat', '-safe', '0', '-i', list_file, '-c', 'copy', output_file], job)
+                return {"start": start, "end": end, "precise": True}
+            except FFmpegError as e:
+                logging.warning(f"Découpage par morceaux impossible, ré-encodage de l'intervalle: {str(e)}")
+
+        # Pas de GOP complet à copier ou source non reproductible : ré-encodage de l'intervalle
+        cmd = ['-ss', f"{start:.6f}", '-i', input_file, '-t', f"{end - start:.6f}",
+               *streams_map, *reencode_args(streams), output_file]
+        await ffmpeg_runner.run(cmd, job, end - start)
+        return {"start": start, "end": end, "precise": True}
+    except (FFmpegError, ValueError, OSError) as e:
+        logging.error(f"Erreur lors du découpage de la vidéo: {str(e)}")
+        return None
+    finally:
+        if base is not None:
+            temp_files.release(base)
+
+async def divide_video(input_file: str, segments: int, output_pattern: str,
+                       job: Optional[Job] = None, exact: bool = False) -> List[dict]:
+    """
+    Divise la vidéo en une seule passe avec le muxer `segment`.
+    Par défaut les flux sont copiés et chaque coupe tombe sur la première
+    image clé suivant le point visé ; en mode exact, des images clés sont
+    forcées aux points de coupe (ré-encodage). `output_pattern` contient un
+    `%d` remplacé par le numéro du segment.
+    """
+    list_file = output_pattern.replace('%d', 'list').rsplit('.', 1)[0] + '.csv'
+    try:
+        # Obtenir la durée totale de la vidéo
+        duration = await probe_duration(input_file)
+        
+        # Calculer les points de coupe
+        segment_duration = duration / segments
+        cut_points = ','.join(f"{i * segment_duration:.3f}" for i in range(1, segments))
+        
+        cmd = ['-i', input_file, '-map', '0:v?', '-map', '0:a?']
+        if exact:
+            cmd += ['-c:v', 'libx264', '-force_key_frames', cut_points or '0', '-c:a', 'aac']
+        else:
+            cmd += ['-c', 'copy']
+        cmd += [
+            '-f', 'segment',
+            '-segment_times', cut_points or str(duration),
+            '-segment_start_number', '1',
+            '-reset_timestamps', '1',
+            '-segment_list', list_file,
+            '-segment_list_type', 'csv',
+            output_pattern
+        ]
+        await ffmpeg_runner.run(cmd, job, duration)
+
+        # La liste CSV donne, pour chaque segment : fichier, début, fin
+        output_segments = []
+        with open(list_file) as f:
+            for line in f:
+                name, start, end = line.strip().rsplit(',', 2)
+                output_segments.append({
+                    "filename": os.path.basename(name),
+                    "start": float(start),
+                    "duration": round(float(end) - float(start), 3),
+                    "size": os.path.getsize(os.path.join(os.path.dirname(output_pattern), os.path.basename(name))),
+                })
+        return output_segments
+    except (FFmpegError, ValueError, OSError) as e:
+        logging.error(f"Erreur lors de la division de la vidéo: {str(e)}")
+        return []
+    finally:
+        if os.path.exists(list_file):
+            os.remove(list_file)
+
+async def add_comment_to_video(input_file: str, output_file: str, text: str, time: str, duration: int,
+                               job: Optional[Job] = None) -> bool:
+    try:
+        # Convertir le temps en secondes
+        start_seconds = parse_timestamp(time)
+
+        with temp_files.track("comment") as base:
+            # Texte lu depuis un fichier : apostrophes et deux-points n'atteignent pas le graphe de filtres
+            text_file = f"{base}.txt"
+            with open(text_file, 'w', encoding='utf-8') as f:
+                f.write(text)
+            cmd = [
+                '-i', input_file,
+                '-vf', f"drawtext=textfile='{os.path.abspath(text_file)}':expansion=none:fontcolor=white:fontsize=24:box=1:boxcolor=black@0.5:boxborderw=5:x=(w-text_w)/2:y=h-th-10:enable='between(t,{start_seconds},{start_seconds + duration})'",
+                '-c:a', 'copy',
+                output_file
+            ]
+            await ffmpeg_runner.run(cmd, job, await probe_duration(input_file))
+        return True
+    except (FFmpegError, ValueError, OSError) as e:
+        logging.error(f"Erreur lors de l'ajout du commentaire: {str(e)}")
+        return False
+
+async def export_video(input_file: str, output_file: str, job: Optional[Job] = None) -> bool:
+    try:
+        await ffmpeg_runner.run(['-i', input_file, output_file], job, await probe_duration(input_file))
+        return True
+    except (FFmpegError, ValueError) as e:
+        logging.error(f"Erreur lors de l'export de la vidéo: {str(e)}")
+        return False
+
+def plan_pipeline(operations: List[PipelineOperation], duration: float, container: str) -> dict:
+    """
+    Compile une liste ordonnée d'opérations en un seul traitement. Chaque
+    opération s'exprime dans la chronologie produite par les précédentes :
+    les coupes successives se composent en un intervalle de la source, et
+    les commentaires sont ramenés en temps source puis en temps de sortie.
+    """
+    start, end = 0.0, duration
+    comments = []  # (texte, début, fin) en temps source
+    for operation in operations:
+        if operation.op == 'cut':
+            if operation.start_time is None or operation.end_time is None:
+                raise ValueError("cut : start_time et end_time sont requis")
+            cut_start = parse_timestamp(operation.start_time)
+            cut_end = parse_timestamp(operation.end_time)
+            if cut_end <= cut_start:
+                raise ValueError("cut : la fin doit être postérieure au début")
+            start, end = min(start + cut_start, end), min(start + cut_end, end)
+            if end <= start:
+                raise ValueError("cut : intervalle hors de la vidéo")
+        elif operation.op == 'comment':
+            if not operation.text or operation.time is None or not operation.duration:
+                raise ValueError("comment : text, time et duration sont requis")
+            comment_start = start + parse_timestamp(operation.time)
+            comments.append((operation.text, comment_start, comment_start + operation.duration))
+        elif operation.op == 'export':
+            container = (operation.format or '').lower().lstrip('.')
+            if container not in EDIT_CONTAINERS:
+                raise ValueError(f"export : format non supporté ({', '.join(EDIT_CONTAINERS)})")
+        else:
+            raise ValueError(f"Opération inconnue: {operation.op}")
+    return {
+        "start": start,
+        "end": end,
+        # Seuls les commentaires visibles dans l'intervalle final comptent
+        "comments": [(text, max(a, start) - start, min(b, end) - start)
+                     for text, a, b in comments if b > start and a < end],
+        "container": container,
+    }
+
+def pipeline_codec_args(streams: List[dict], container: str, filter_video: bool) -> tuple:
+    """
+    Options de codec par flux : copie si aucun filtre ne touche le flux et
+    que son codec est accepté par le conteneur, sinon encodage (même codec
+    si possible). Retourne (options, décision vidéo, décision audio).
+    """
+    video_codecs, audio_codecs, video_encoder, audio_encoder = EDIT_CONTAINERS[container]
+    args, decisions = [], {"video": None, "audio": None}
+    video = next((st for st in streams if st.get('codec_type') == 'video'), None)
+    audio = next((st for st in streams if st.get('codec_type') == 'audio'), None)
+    if video is not None:
+        codec = video.get('codec_name')
+        if not filter_video and (video_codecs is None or codec in video_codecs):
+            decisions["video"] = 'copy'
+        elif codec in SMART_CUT_VIDEO_ENCODERS and (video_codecs is None or codec in video_codecs):
+            decisions["video"] = SMART_CUT_VIDEO_ENCODERS[codec]
+        else:
+            decisions["video"] = video_encoder
+        args += ['-c:v', decisions["video"]]
+    if audio is not None:
+        codec = audio.get('codec_name')
+        decisions["audio"] = 'copy' if audio_codecs is None or codec in audio_codecs else audio_encoder
+        args += ['-c:a', decisions["audio"]]
+    return args, decisions["video"], decisions["audio"]
+
+def versioned_filename(filename: str, extension: str) -> tuple:
+    """
+    Réserve le prochain nom `<base>.vN.<ext>` libre dans DOWNLOAD_DIR
+    (création exclusive : sûr entre requêtes et workers concurrents).
+    """
+    base = re.sub(r'\.v\d+$', '', os.path.splitext(filename)[0])
+    pattern = re.compile(rf'{re.escape(base)}\.v(\d+)\.')
+    # Numérotation commune à toutes les extensions d'une même source
+    versions = [int(match.group(1)) for match in map(pattern.match, os.listdir(DOWNLOAD_DIR)) if match]
+    version = max(versions, default=0) + 1
+    while True:
+        candidate = f"{base}.v{version}.{extension}"
+        try:
+            os.close(os.open(os.path.join(DOWNLOAD_DIR, candidate), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return candidate, version
+        except FileExistsError:
+            version += 1
+
+async def run_pipeline(input_file: str, request: PipelineRequest, job: Optional[Job] = None) -> dict:
+    """
+    Exécute les opérations en une seule passe ffmpeg : seek en entrée pour
+    la coupe, un graphe de filtres (drawtext chaînés) pour les commentaires,
+    copie des flux non filtrés. Sans filtre vidéo, la coupe copie les flux
+    depuis l'image clé précédant le début ; avec filtre, elle est exacte.
+    Le résultat est un nouveau fichier versionné, la source est conservée.
+    """
+    duration = await probe_duration(input_file)
+    streams = await probe_streams(input_file)
+    container = os.path.splitext(input_file)[1].lower().lstrip('.')
+    plan = plan_pipeline(request.operations, duration, container if container in EDIT_CONTAINERS else 'mkv')
+    comments = plan["comments"]
+    has_video = any(st.get('codec_type') == 'video' for st in streams)
+    if comments and not has_video:
+        raise ValueError("comment : le fichier n'a pas de flux vidéo")
+    codec_args, video_codec_used, audio_codec_used = pipeline_codec_args(streams, plan["container"], bool(comments))
+
+    start, end = plan["start"], plan["end"]
+    if video_codec_used == 'copy' and start > 0:
+        keyframes = await get_keyframes(input_file)
+        index = bisect.bisect_right(keyframes, start) - 1
+        start = keyframes[index] if index >= 0 else 0.0
+
+    with temp_files.track("pipeline") as base:
+        cmd = []
+        if start > 0:
+            cmd += ['-ss', f"{start:.6f}"]
+        cmd += ['-i', input_file]
+        if end < duration:
+            cmd += ['-t', f"{end - start:.6f}"]
+        if comments:
+            filters = []
+            for index, (text, comment_start, comment_end) in enumerate(comments):
+                # Texte lu depuis un fichier : aucun échappement du graphe de filtres à gérer
+                text_file = f"{base}_{index}.txt"
+                with open(text_file, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                filters.append(
+                    f"drawtext=textfile='{os.path.abspath(text_file)}':expansion=none:fontcolor=white:fontsize=24"
+                    f":box=1:boxcolor=black@0.5:boxborderw=5:x=(w-text_w)/2:y=h-th-10"
+                    f":enable='between(t,{comment_start:.3f},{comment_end:.3f})'")
+            # Le flux vidéo filtré remplace le flux d'origine
+            cmd += ['-filter_complex', f"[0:v]{','.join(filters)}[v]", '-map', '[v]', '-map', '0:a?']
+        else:
+            cmd += ['-map', '0:v?', '-map', '0:a?']
+        if video_codec_used == 'copy' or audio_codec_used == 'copy':
+            cmd += ['-avoid_negative_ts', 'make_zero']
+        if plan["container"] in ('mp4', 'mov'):
+            cmd += ['-movflags', '+faststart']
+        output_file = f"{base}.{plan['container']}"
+        await ffmpeg_runner.run([*cmd, *codec_args, output_file], job, end - start)
+
+        filename, version = await run_in_threadpool(store_version, output_file, os.path.basename(input_file),
+                                                    plan["container"])
+    return {
+        "filename": filename,
+        "version": version,
+        "start": start,
+        "end": end,
+        "container": plan["container"],
+        "video": video_codec_used,
+        "audio": audio_codec_used,
+    }
+
+def replace_with_edit(output_file: str, filename: str):
+    """
+    Remplace un fichier du store par sa version éditée. Appelé dans le
+    threadpool : le déplacement copie le fichier si TEMP_DIR est sur un
+    autre disque, et le store écrit son index.
+    """
+    shutil.move(output_file, os.path.join(DOWNLOAD_DIR, filename))
+    media_store.refresh(filename)
+
+def store_version(output_file: str, source: str, extension: str) -> tuple:
+    """Déplace un résultat d'édition vers le prochain nom versionné de `source` (threadpool)."""
+    filename, version = versioned_filename(source, extension)
+    try:
+        shutil.move(output_file, os.path.join(DOWNLOAD_DIR, filename))
+    except OSError:
+        os.remove(os.path.join(DOWNLOAD_DIR, filename))
+        raise
+    return filename, version
+
+async def run_edit_job(job: Job, operation) -> dict:
+    """Exécute `operation(job)` et reporte son issue dans le job."""
+    try:
+        result = await operation(job)
+        job.finish(JOB_FINISHED, result=result)
+        return result
+    except (JobCancelled, asyncio.CancelledError):
+        job.finish(JOB_CANCELLED, error="Job annulé")
+        raise HTTPException(status_code=409, detail="Opération annulée")
+    except HTTPException as e:
+        job.finish(JOB_FAILED, error=e.detail)
+        raise
+    except Exception as e:
+        logging.error(f"Erreur lors de l'édition: {str(e)}")
+        job.finish(JOB_FAILED, error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def submit_edit(operation, wait: bool):
+    """
+    Lance une opération d'édition en tâche de fond suivie par un job.
+    Avec `wait`, la réponse est celle de l'opération (comportement historique),
+    sinon l'identifiant du job est retourné immédiatement.
+    """
+    job = job_manager.register("edit")
+    task = asyncio.create_task(run_edit_job(job, operation))
+    # La tâche survit à une déconnexion du client ; seul DELETE /jobs/{id} l'annule
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    if not wait:
+        return JSONResponse(status_code=202, content=JobResponse(job_id=job.id, status=job.status).dict())
+    result = await asyncio.shield(task)
+    return {**result, "job_id": job.id}
+
+# Routes pour l'édition vidéo
+@app.post("/api/edit/cut")
+async def edit_cut_video(request: CutRequest, wait: bool = True):
     input_file = os.path.join(DOWNLOAD_DIR, request.filename)
     if not os.path.exists(input_file):
         raise HTTPException(status_code=404, detail="Fichier non trouvé")
     
-    output_file = os.path.join(TEMP_DIR, f"comment_{uuid.uuid4()}.mp4")
-    if add_comment_to_video(input_file, output_file, request.text, request.time, request.duration):
-        shutil.move(output_file, input_file)
-        return {"success": True, "message": "Commentaire ajouté avec succès"}
-    else:
-        raise HTTPException(status_code=500, detail="Erreur lors de l'ajout du commentaire")
+    async def operation(job: Job) -> dict:
+        extension = os.path.splitext(request.filename)[1] or '.mp4'
+        with media_store.using(request.filename), temp_files.track("cut", extension) as output_file:
+            bounds = await cut_video(input_file, output_file, request.start_time, request.end_time,
+                                     job, request.precise)
+            if bounds is not None:
+                await run_in_threadpool(replace_with_edit, output_file, request.filename)
+                schedule_probe(input_file)
+                return {"success": True, "message": "Vidéo découpée avec succès", **bounds}
+            else:
+                raise HTTPException(status_code=500, detail="Erreur lors du découpage de la vidéo")
+    return await submit_edit(operation, wait)
+
+@app.post("/api/edit/divide")
+async def edit_divide_video(request: DivideRequest, wait: bool = True):
+    input_file = os.path.join(DOWNLOAD_DIR, request.filename)
+    if not os.path.exists(input_file):
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    
+    async def operation(job: Job) -> dict:
+        with media_store.using(request.filename), temp_files.track("segment", "_%d.mp4") as output_pattern:
+            output_segments = await divide_video(input_file, request.segments, output_pattern, job, request.exact)
+
+            def store_segments():
+                # Les segments rejoignent le store : servis par /file, soumis au quota et à l'expiration
+                for segment in output_segments:
+                    os.replace(os.path.join(TEMP_DIR, segment["filename"]),
+                               os.path.join(DOWNLOAD_DIR, segment["filename"]))
+                    media_store.add(segment["filename"])
+
+            await run_in_threadpool(store_segments)
+            for segment in output_segments:
+                schedule_probe(os.path.join(DOWNLOAD_DIR, segment["filename"]))
+
+        if output_segments:
+            return {
+                "success": True,
+                "files": [segment["filename"] for segment in output_segments],
+                "segments": output_segments
+            }
+        else:
+            raise HTTPException(status_code=500, detail="Erreur lors de la division de la vidéo")
+    return await submit_edit(operation, wait)
+
+@app.post("/api/edit/comment")
+async def edit_add_comment(request: CommentRequest, wait: bool = True):
+    input_file = os.path.join(DOWNLOAD_DIR, request.filename)
+    if not os.path.exists(input_file):
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    
+    async def operation(job: Job) -> dict:
+        with media_store.using(request.filename), temp_files.track("comment", ".mp4") as output_file:
+            if await add_comment_to_video(input_file, output_file, request.text, request.time,
+                                          request.duration, job):
+                await run_in_threadpool(replace_with_edit, output_file, request.filename)
+                schedule_probe(input_file)
+                return {"success": True, "message": "Commentaire ajouté avec succès"}
+            else:
+                raise HTTPException(status_code=500, detail="Erreur lors de l'ajout du commentaire")
+    return await submit_edit(operation, wait)
 
 @app.post("/api/edit/export")
-async def edit_export_video(request: ExportRequest):
+async def edit_export_video(request: ExportRequest, wait: bool = True):
     input_file = os.path.join(DOWNLOAD_DIR, request.filename)
     if not os.path.exists(input_file):
         raise HTTPException(status_code=404, detail="Fichier non trouvé")
     
-    output_file = os.path.join(TEMP_DIR, f"export_{uuid.uuid4()}.{request.format}")
+    async def operation(job: Job) -> dict:
+        with media_store.using(request.filename), temp_files.track("export", f".{request.format}") as output_file:
+            if await export_video(input_file, output_file, job):
+                await run_in_threadpool(replace_with_edit, output_file, request.filename)
+                schedule_probe(input_file)
+                return {"success": True, "message": "Vidéo exportée avec succès"}
+            else:
+                raise HTTPException(status_code=500, detail="Erreur lors de l'export de la vidéo")
+    return await submit_edit(operation, wait)
+
+@app.post("/api/edit/pipeline")
+async def edit_pipeline(request: PipelineRequest, wait: bool = True):
+    """
+    Opérations ordonnées (cut, comment, export) appliquées en une seule
+    passe ffmpeg. Le fichier d'origine est conservé : le résultat est une
+    nouvelle version `<nom>.vN.<ext>` ajoutée au store.
+    """
+    input_file = os.path.join(DOWNLOAD_DIR, request.filename)
+    if not os.path.exists(input_file):
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    if not request.operations:
+        raise HTTPException(status_code=400, detail="Aucune opération")
     try:
-        cmd = ['ffmpeg', '-i', input_file, output_file]
-        subprocess.run(cmd, check=True)
-        shutil.move(output_file, input_file)
-        return {"success": True, "message": "Vidéo exportée avec succès"}
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Erreur lors de l'export de la vidéo: {str(e)}")
-        raise HTTPException(status_code=500, detail="Erreur lors de l'export de la vidéo")
+        plan_pipeline(request.operations, float('inf'), 'mkv')
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def operation(job: Job) -> dict:
+        with media_store.using(request.filename):
+            try:
+                result = await run_pipeline(input_file, request, job)
+            except (FFmpegError, ValueError) as e:
+                logging.error(f"Erreur lors de l'édition: {str(e)}")
+                raise HTTPException(status_code=500, detail="Erreur lors de l'édition de la vidéo")
+        await run_in_threadpool(media_store.add, result["filename"], meta={
+            "source": request.filename,
+            "version": result["version"],
+            "operations": [op.dict(exclude_none=True) for op in request.operations],
+        })
+        schedule_probe(os.path.join(DOWNLOAD_DIR, result["filename"]))
+        return {"success": True, "message": "Vidéo éditée avec succès", **result}
+    return await submit_edit(operation, wait)
+
+@app.get("/api/media/{filename}")
+async def get_media_info(filename: str, keyframes: bool = False):
+    """Caractéristiques d'un fichier du store, depuis l'index ffprobe."""
+    file_path = os.path.join(DOWNLOAD_DIR, filename)
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    try:
+        entry = await media_index.get(file_path)
+    except (FFmpegError, ValueError) as e:
+        logging.error(f"Erreur lors de l'analyse de {filename}: {str(e)}")
+        raise HTTPException(status_code=422, detail="Fichier multimédia illisible")
+    info = {k: v for k, v in entry.items() if k != "keyframes"}
+    info["filename"] = filename
+    info["keyframe_count"] = len(entry["keyframes"])
+    if keyframes:
+        info["keyframes"] = entry["keyframes"]
+    return info
+
+@app.get("/api/media/{filename}/preview")
+async def get_media_preview(filename: str, request: Request):
+    """
+    Poster et planche de vignettes (indexée en WebVTT) d'un fichier du store,
+    générés au premier appel. Les images sont servies sous une URL propre à
+    l'empreinte du contenu, mise en cache sans limite ; ce manifeste est
+    revalidé par ETag.
+    """
+    file_path = os.path.join(DOWNLOAD_DIR, filename)
+    if filename.startswith('.') or not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    try:
+        with media_store.using(filename):
+            manifest = await preview_cache.get(file_path)
+    except (FFmpegError, ValueError) as e:
+        logging.error(f"Erreur lors de la génération des aperçus de {filename}: {str(e)}")
+        raise HTTPException(status_code=422, detail="Aperçu impossible pour ce fichier")
+
+    etag = f'"{manifest["fingerprint"]}"'
+    headers = {'Cache-Control': 'no-cache', 'ETag': etag}
+    if 'if-none-match' in request.headers and is_not_modified(request, etag, 0):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({**manifest, "filename": filename}, headers=headers)
+
+@app.get("/api/previews/{fingerprint}/{name}")
+def get_preview_file(fingerprint: str, name: str):
+    """Fichier d'aperçu ; son URL change avec le contenu, il est donc immuable."""
+    if not re.fullmatch(r'[0-9a-f]{32}', fingerprint) or name not in PREVIEW_FILES:
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    file_path = preview_cache.path(fingerprint, name)
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    return FileResponse(file_path, media_type=PREVIEW_FILES[name],
+                        headers={'Cache-Control': 'public, max-age=31536000, immutable'})
+
+async def describe_hls(filename: str) -> tuple:
+    """Chemin, empreinte, segments et rendus HLS d'un fichier du store (404/422 sinon)."""
+    file_path = os.path.join(DOWNLOAD_DIR, filename)
+    if filename.startswith('.') or not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    try:
+        return (file_path, *await hls_packager.describe(file_path))
+    except (FFmpegError, ValueError) as e:
+        logging.error(f"Erreur lors de l'analyse de {filename}: {str(e)}")
+        raise HTTPException(status_code=422, detail="Fichier multimédia illisible")
+
+@app.get("/api/hls/{filename}/{playlist}.m3u8")
+async def get_hls_playlist(filename: str, playlist: str):
+    """
+    Playlist HLS d'un fichier du store : `master` liste les rendus (`source`,
+    et `proxy` en basse définition pour une vidéo haute), chaque rendu liste
+    ses segments. Rien n'est encodé avant la demande d'un segment.
+    """
+    _, fingerprint, segments, renditions = await describe_hls(filename)
+    if playlist == "master":
+        content = hls_packager.master_playlist(renditions)
+    elif playlist in renditions:
+        content = hls_packager.media_playlist(playlist, fingerprint, segments)
+    else:
+        raise HTTPException(status_code=404, detail="Rendu inconnu")
+    return Response(content, media_type="application/vnd.apple.mpegurl", headers={'Cache-Control': 'no-cache'})
+
+@app.get("/api/hls/{filename}/{rendition}/{fingerprint}/{index}.ts")
+async def get_hls_segment(filename: str, rendition: str, fingerprint: str, index: int):
+    """Segment MPEG-TS, produit à sa première demande puis servi depuis le cache."""
+    file_path, current, segments, renditions = await describe_hls(filename)
+    if fingerprint != current:
+        raise HTTPException(status_code=404, detail="Le fichier a changé depuis la playlist")
+    if rendition not in renditions or not 0 <= index < len(segments):
+        raise HTTPException(status_code=404, detail="Segment inconnu")
+    try:
+        with media_store.using(filename):
+            segment_path = await hls_packager.segment(file_path, fingerprint, rendition, renditions[rendition],
+                                                      segments, index)
+    except FFmpegError as e:
+        logging.error(f"Erreur lors de la production du segment {index} de {filename}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Erreur lors de la production du segment")
+    # L'URL porte l'empreinte du contenu : le segment ne change jamais
+    return FileResponse(segment_path, media_type="video/mp2t",
+                        headers={'Cache-Control': 'public, max-age=31536000, immutable'})
 
 @app.post("/api/upload")
 async def upload_file(file: UploadFile = File(...)):
@@ -591,8 +4771,241 @@ async def upload_file(file: UploadFile = File(...)):
         
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
+        media_store.add(filename)
+        schedule_probe(file_path)
         
         return {"filename": filename}
     except Exception as e:
         logging.error(f"Erreur lors de l'upload du fichier: {str(e)}")
         raise HTTPException(status_code=500, detail="Erreur lors de l'upload du fichier")
+
+# Uploads reprenables par morceaux (protocole tus 1.0 : creation, checksum, termination)
+TUS_VERSION = "1.0.0"
+TUS_CHECKSUM_ALGORITHMS = {"sha1": hashlib.sha1, "sha256": hashlib.sha256, "md5": hashlib.md5}
+TUS_HEADERS = {
+    "Tus-Resumable": TUS_VERSION,
+    "Tus-Version": TUS_VERSION,
+    "Tus-Extension": "creation,checksum,termination",
+    "Tus-Max-Size": str(MAX_UPLOAD_BYTES),
+    "Tus-Checksum-Algorithm": ",".join(TUS_CHECKSUM_ALGORITHMS),
+}
+_upload_locks: dict[str, asyncio.Lock] = {}
+_upload_reservations: dict = {}  # Identifiant -> réservation du store ouverte par ce worker (voir reserve_upload)
+
+def upload_paths(upload_id: str) -> tuple:
+    """Fichier partiel et métadonnées d'un upload, directement dans DOWNLOAD_DIR."""
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+        raise HTTPException(status_code=404, detail="Upload non trouvé")
+    base = os.path.join(DOWNLOAD_DIR, f".upload_{upload_id}")
+    return f"{base}.part", f"{base}.json"
+
+def load_upload(upload_id: str) -> tuple:
+    part_file, meta_file = upload_paths(upload_id)
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+        offset = os.path.getsize(part_file)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload non trouvé")
+    return meta, offset, part_file, meta_file
+
+def reserve_upload(upload_id: str, length: int):
+    """
+    Réserve `Upload-Length` dans le store jusqu'à la fin de l'upload : des
+    uploads parallèles ne peuvent pas dépasser ensemble le quota. 507 si
+    la place manque.
+    """
+    reservation = media_store.reserve(length)
+    try:
+        reservation.__enter__()
+    except StoreFullError:
+        raise HTTPException(status_code=507, detail="Espace de stockage insuffisant, réessayez plus tard",
+                            headers={"Retry-After": str(CLEANUP_INTERVAL)})
+    _upload_reservations[upload_id] = reservation
+
+def release_upload(upload_id: str):
+    """Libère la réservation d'un upload terminé, supprimé ou expiré."""
+    reservation = _upload_reservations.pop(upload_id, None)
+    if reservation is not None:
+        reservation.__exit__(None, None, None)
+
+def forget_upload(upload_id: str):
+    """Oublie l'état local (verrou, réservation) d'un upload qui n'existe plus."""
+    lock = _upload_locks.get(upload_id)
+    if lock is None or not lock.locked():
+        _upload_locks.pop(upload_id, None)
+    release_upload(upload_id)
+
+def release_finished_uploads():
+    """Oublie les uploads terminés, supprimés ou expirés par un autre worker."""
+    for upload_id in set(_upload_reservations) | set(_upload_locks):
+        if not os.path.exists(upload_paths(upload_id)[1]):
+            forget_upload(upload_id)
+
+def parse_upload_metadata(header: str) -> dict:
+    """Décode l'en-tête Upload-Metadata : `clé valeur_base64,clé2 valeur2`."""
+    metadata = {}
+    for pair in filter(None, (p.strip() for p in header.split(','))):
+        key, _, value = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(value).decode() if value else ''
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Upload-Metadata invalide")
+    return metadata
+
+@app.options("/api/uploads")
+def upload_options():
+    return Response(status_code=204, headers=TUS_HEADERS)
+
+@app.post("/api/uploads", status_code=201)
+def create_upload(request: Request):
+    """Crée un upload : `Upload-Length` obligatoire, nom dans `Upload-Metadata`."""
+    try:
+        length = int(request.headers["upload-length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="En-tête Upload-Length manquant ou invalide")
+    if length < 0:
+        raise HTTPException(status_code=400, detail="En-tête Upload-Length manquant ou invalide")
+    if length > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Fichier trop volumineux")
+
+    metadata = parse_upload_metadata(request.headers.get("upload-metadata", ""))
+    upload_id = uuid.uuid4().hex
+    original_name = clean_name(os.path.basename(metadata.get("filename", ""))) or "video"
+    filename = f"upload_{upload_id}_{original_name}"
+    part_file, meta_file = upload_paths(upload_id)
+    reserve_upload(upload_id, length)
+    try:
+        open(part_file, "wb").close()
+        with open(meta_file, "w") as f:
+            json.dump({"length": length, "filename": filename, "metadata": metadata}, f)
+    except OSError:
+        release_upload(upload_id)
+        raise
+
+    location = f"/api/uploads/{upload_id}"
+    if length == 0:
+        complete_upload(upload_id)
+    return JSONResponse(
+        status_code=201,
+        content={"upload_id": upload_id, "filename": filename, "location": location},
+        headers={"Location": location, "Upload-Offset": "0", "Tus-Resumable": TUS_VERSION}
+    )
+
+@app.head("/api/uploads/{upload_id}")
+def upload_status(upload_id: str):
+    meta, offset, _, _ = load_upload(upload_id)
+    return Response(status_code=200, headers={
+        "Upload-Offset": str(offset),
+        "Upload-Length": str(meta["length"]),
+        "Cache-Control": "no-store",
+        "Tus-Resumable": TUS_VERSION,
+    })
+
+@app.patch("/api/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request):
+    """
+    Ajoute un morceau à l'offset courant. Le corps est écrit au fil de
+    l'eau dans le fichier final (pas de copie intermédiaire). Avec
+    `Upload-Checksum`, un morceau corrompu est retiré et refusé (460).
+    """
+    if request.headers.get("content-type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type attendu : application/offset+octet-stream")
+    lock = _upload_locks.setdefault(upload_id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="Un autre morceau est en cours d'envoi")
+    # Bail partagé : un morceau ne peut être écrit que par un seul worker à la fois
+    lease = f"upload:{upload_id}"
+    if not await run_in_threadpool(state.acquire, lease, WORKER_ID, 3600):
+        raise HTTPException(status_code=409, detail="Un autre morceau est en cours d'envoi")
+    try:
+        async with lock:
+            meta, offset, part_file, _ = await run_in_threadpool(load_upload, upload_id)
+            try:
+                client_offset = int(request.headers["upload-offset"])
+            except (KeyError, ValueError):
+                raise HTTPException(status_code=400, detail="En-tête Upload-Offset manquant ou invalide")
+            if client_offset != offset:
+                raise HTTPException(status_code=409, detail="Upload-Offset ne correspond pas",
+                                    headers={"Upload-Offset": str(offset)})
+
+            checksum = None
+            if "upload-checksum" in request.headers:
+                algorithm, _, expected = request.headers["upload-checksum"].partition(" ")
+                if algorithm not in TUS_CHECKSUM_ALGORITHMS:
+                    raise HTTPException(status_code=400, detail="Algorithme de checksum non supporté")
+                checksum = TUS_CHECKSUM_ALGORITHMS[algorithm]()
+
+            received = 0
+            complete_chunk = False
+            # Écritures dans le threadpool : un disque lent ne bloque pas la boucle
+            f = await run_in_threadpool(open, part_file, "r+b")
+            try:
+                await run_in_threadpool(f.seek, offset)
+                try:
+                    async for chunk in request.stream():
+                        if offset + received + len(chunk) > meta["length"]:
+                            raise HTTPException(status_code=413, detail="Le morceau dépasse Upload-Length")
+                        await run_in_threadpool(f.write, chunk)
+                        received += len(chunk)
+                        if checksum is not None:
+                            checksum.update(chunk)
+                    complete_chunk = True
+                finally:
+                    # Un morceau vérifiable mais interrompu ne peut pas être conservé
+                    if checksum is not None and not complete_chunk:
+                        await run_in_threadpool(f.truncate, offset)
+                if checksum is not None and base64.b64encode(checksum.digest()).decode() != expected:
+                    await run_in_threadpool(f.truncate, offset)
+                    return JSONResponse(status_code=460, content={"detail": "Checksum invalide"},
+                                        headers={"Upload-Offset": str(offset), "Tus-Resumable": TUS_VERSION})
+            finally:
+                await run_in_threadpool(f.close)
+
+        new_offset = offset + received
+        headers = {"Upload-Offset": str(new_offset), "Tus-Resumable": TUS_VERSION}
+        if new_offset == meta["length"]:
+            headers["Upload-Filename"] = await run_in_threadpool(complete_upload, upload_id)
+            _upload_locks.pop(upload_id, None)
+        return Response(status_code=204, headers=headers)
+    finally:
+        await run_in_threadpool(state.release, lease, WORKER_ID)
+
+@app.delete("/api/uploads/{upload_id}", status_code=204)
+def delete_upload(upload_id: str):
+    _, _, part_file, meta_file = load_upload(upload_id)
+    for path in (part_file, meta_file):
+        if os.path.exists(path):
+            os.remove(path)
+    _upload_locks.pop(upload_id, None)
+    release_upload(upload_id)
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
+
+def complete_upload(upload_id: str) -> str:
+    """Renomme le fichier partiel (même dossier, sans copie) et l'indexe."""
+    meta, _, part_file, meta_file = load_upload(upload_id)
+    file_path = os.path.join(DOWNLOAD_DIR, meta["filename"])
+    os.replace(part_file, file_path)
+    os.remove(meta_file)
+    release_upload(upload_id)  # Le fichier prend la place réservée
+    media_store.add(meta["filename"])
+    schedule_probe(file_path)
+    logging.info(f"Upload terminé: {meta['filename']}")
+    return meta["filename"]
+
+def expire_uploads(max_age_seconds: float):
+    """Supprime les uploads incomplets abandonnés."""
+    limit = time.time() - max_age_seconds
+    for filename in os.listdir(DOWNLOAD_DIR):
+        if filename.startswith('.upload_'):
+            path = os.path.join(DOWNLOAD_DIR, filename)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+                    forget_upload(filename[len('.upload_'):].rsplit('.', 1)[0])
+                    logging.info(f"Upload abandonné supprimé: {filename}")
+            except FileNotFoundError:
+                pass
+
+# Dernière instruction du module : durée de son chargement
+startup_timings["import"] = time.perf_counter() - IMPORT_STARTED
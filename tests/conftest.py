@@ -0,0 +1,71 @@
+import functools
+import http.server
+import importlib.util
+import os
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(REPO_DIR, "code pour telecharger des videos.py")
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """Module de l'application chargé dans un dossier de travail temporaire."""
+    workdir = tmp_path_factory.mktemp("app")
+    for directory in ("static", "templates"):
+        os.makedirs(workdir / directory)
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        spec = importlib.util.spec_from_file_location("video_app", APP_FILE)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+    finally:
+        os.chdir(previous)
+
+
+@pytest.fixture
+def client(app_module):
+    """Client HTTP sans les événements startup/shutdown : l'arrêt fermerait le pool de jobs du module partagé."""
+    return TestClient(app_module.app)
+
+
+@pytest.fixture
+def store_file(app_module):
+    """Crée un fichier de 5000 octets indexé par le store."""
+    created = []
+
+    def make(filename: str, size: int = 5000) -> str:
+        with open(os.path.join(app_module.DOWNLOAD_DIR, filename), "wb") as f:
+            f.write(os.urandom(size))
+        app_module.media_store.add(filename)
+        created.append(filename)
+        return filename
+
+    yield make
+    for filename in created:
+        try:
+            os.remove(os.path.join(app_module.DOWNLOAD_DIR, filename))
+        except FileNotFoundError:
+            pass
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin(tmp_path):
+    """Serveur HTTP local servant un faux MP4 de 300 Ko."""
+    content = os.urandom(300_000)
+    (tmp_path / "clip.mp4").write_bytes(content)
+    handler = functools.partial(QuietHandler, directory=str(tmp_path))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/clip.mp4", content
+    server.shutdown()
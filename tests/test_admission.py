@@ -0,0 +1,77 @@
+import asyncio
+
+
+def test_media_analysis_is_served_class(app_module):
+    assert app_module.request_class("GET", "/api/media/clip.mp4") == "serve"
+    assert app_module.request_class("GET", "/api/media/clip.mp4/preview") == "serve"
+
+
+def test_slot_released_once_headers_are_sent(app_module):
+    admission = app_module.admission
+    seen = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        seen.append(admission.active["serve"])  # Pendant l'envoi du corps
+        await send({"type": "http.response.body", "body": b"x"})
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/file/clip.mp4", "headers": [],
+             "client": ("127.0.0.1", 1234)}
+    asyncio.run(app_module.AdmissionMiddleware(app)(scope, receive, send))
+    assert seen == [0]
+    assert admission.active["serve"] == 0
+
+
+async def call_app(app, path: str, query: str, send):
+    """Requête ASGI brute : `send` voit les messages au fil de l'envoi."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+             "query_string": query.encode(), "headers": [], "client": ("127.0.0.1", 1234),
+             "server": ("testserver", 80)}
+    received = []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {"type": "http.request", "body": b""}
+        await asyncio.Event().wait()  # Le client reste connecté
+
+    await app(scope, receive, send)
+
+
+def test_second_stream_rejected_while_first_streams(app_module, origin, monkeypatch):
+    url, _ = origin
+    monkeypatch.setattr(app_module, "schedule_probe", lambda path: None)
+    monkeypatch.setattr(app_module.admission, "max_active", 1)
+    monkeypatch.setattr(app_module.admission, "queue_timeout", 0.2)
+    query = f"url={url}&format=mp4"
+
+    async def scenario():
+        streaming, resume = asyncio.Event(), asyncio.Event()
+
+        async def send_first(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                streaming.set()
+                await resume.wait()
+
+        first = asyncio.create_task(call_app(app_module.app, "/download/stream", query, send_first))
+        await asyncio.wait_for(streaming.wait(), 10)
+        statuses = []
+
+        async def send_second(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        await call_app(app_module.app, "/download/stream", query, send_second)
+        resume.set()
+        await first
+        return statuses
+
+    assert asyncio.run(scenario()) == [429]
+    assert app_module.admission.active["download"] == 0
@@ -0,0 +1,45 @@
+import pytest
+
+FORMATS = [
+    {"format_id": "140", "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.2", "abr": 128},
+    {"format_id": "251", "ext": "webm", "vcodec": "none", "acodec": "opus", "abr": 160},
+    {"format_id": "18", "ext": "mp4", "vcodec": "avc1.42001E", "acodec": "mp4a.40.2", "tbr": 500},
+]
+
+
+def test_accepted_codecs_are_normalized_to_containers(app_module):
+    assert app_module.audio_targets(["AAC", ".opus", "m4a", "vorbis"]) == ["m4a", "opus", "ogg"]
+    with pytest.raises(ValueError, match="wav"):
+        app_module.audio_targets(["wav"])
+
+
+@pytest.mark.parametrize("accept, plan", [
+    (["m4a"], {"format_id": "140", "container": "m4a", "action": "none"}),
+    (["webm"], {"format_id": "251", "container": "webm", "action": "none"}),
+    (["opus", "m4a"], {"format_id": "251", "container": "opus", "action": "remux"}),
+    (["mp3", "m4a"], {"format_id": "140", "container": "m4a", "action": "none"}),
+    (["mp3"], {"format_id": "251", "container": "mp3", "action": "transcode"}),
+])
+def test_cheapest_processing_is_chosen(app_module, accept, plan):
+    assert app_module.plan_audio({"formats": FORMATS}, app_module.audio_targets(accept)) == plan
+
+
+def test_muxed_sources_are_remuxed_and_codecs_guessed_from_extension(app_module):
+    muxed = {"formats": [FORMATS[2]]}
+    assert app_module.plan_audio(muxed, ["m4a"])["action"] == "remux"
+    generic = {"formats": [{"format_id": "0", "ext": "mp3"}]}  # Extracteur générique : ni acodec ni vcodec
+    assert app_module.plan_audio(generic, ["mp3"]) == {"format_id": "0", "container": "mp3", "action": "remux"}
+    with pytest.raises(ValueError):
+        app_module.plan_audio({"formats": [{"format_id": "v", "vcodec": "vp9", "acodec": "none"}]}, ["mp3"])
+
+
+def test_convert_arguments(app_module):
+    assert app_module.audio_convert_args({"action": "remux", "container": "m4a"}) == ["-vn", "-c:a", "copy"]
+    assert app_module.audio_convert_args({"action": "transcode", "container": "mp3"}) == \
+        ["-vn", "-c:a", "libmp3lame", "-b:a", "192k"]
+
+
+def test_unsupported_accept_is_a_bad_request(client):
+    response = client.post("/download", json={"url": "https://media.example.org/a.mp3", "format": "audio",
+                                              "accept": ["wav"]})
+    assert response.status_code == 400
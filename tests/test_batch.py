@@ -0,0 +1,41 @@
+import io
+import json
+import zipfile
+
+
+def test_batch_streams_item_states_as_ndjson(app_module, client, origin, monkeypatch):
+    url, content = origin
+    monkeypatch.setattr(app_module, "schedule_probe", lambda path: None)
+    missing = url.replace("clip.mp4", "absent.mp4")
+    response = client.post("/download/batch", json={"urls": [url, missing, url], "parallelism": 2})
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[0]["type"] == "batch" and events[0]["job_id"] == response.headers["X-Job-Id"]
+    final = events[-1]
+    assert (final["type"], final["status"]) == ("batch", "finished")
+    items = final["result"]["items"]
+    # Doublon retiré ; l'échec d'un élément n'interrompt pas le lot
+    assert [(item["url"], item["status"]) for item in items] == [(url, "finished"), (missing, "failed")]
+    assert final["result"]["failed"] == 1
+    with open(f"{app_module.DOWNLOAD_DIR}/{items[0]['filename']}", "rb") as f:
+        assert f.read() == content
+    assert client.get(f"/jobs/{final['job_id']}").json()["status"] == "finished"
+
+
+def test_batch_zip_contains_files_and_manifest(app_module, client, origin, monkeypatch):
+    url, content = origin
+    monkeypatch.setattr(app_module, "schedule_probe", lambda path: None)
+    response = client.post("/download/batch", json={"urls": [url], "output": "zip"})
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].startswith('attachment; filename="batch-')
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    names = archive.namelist()
+    assert names[-1] == "batch.json" and len(names) == 2
+    assert archive.read(names[0]) == content
+    assert json.loads(archive.read("batch.json"))["result"]["failed"] == 0
+
+
+def test_invalid_batches_are_rejected(client):
+    assert client.post("/download/batch", json={"urls": []}).status_code == 400
+    assert client.post("/download/batch", json={"urls": ["https://media.example.org/v.mp4"],
+                                                "output": "tar"}).status_code == 400
@@ -0,0 +1,31 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import bench_app  # noqa: E402
+
+
+def test_summary_percentiles():
+    assert bench_app.summarize([]) == {"count": 0}
+    assert bench_app.summarize([i / 10 for i in range(20, 0, -1)]) == {
+        "count": 20, "min": 0.1, "p50": 1.05, "p95": 2.0, "max": 2.0}
+
+
+@pytest.mark.skipif(not shutil.which("ffmpeg"), reason="ffmpeg requis")
+def test_fake_origin_serves_every_source_to_the_app(client, tmp_path):
+    encoders = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+    if " libx264 " not in encoders:
+        pytest.skip("libx264 absent")
+    bench_app.generate_media(str(tmp_path), 4, "160x120")
+    server, port = bench_app.start_origin(str(tmp_path))
+    try:
+        for name, path in bench_app.SOURCES.items():
+            response = client.get("/formats", params={"url": f"http://127.0.0.1:{port}/{path}"})
+            assert response.status_code == 200, (name, response.text)
+            assert response.json()["formats"], name
+    finally:
+        server.shutdown()
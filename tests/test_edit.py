@@ -0,0 +1,106 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+requires_ffmpeg = pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")),
+                                reason="ffmpeg/ffprobe requis")
+
+
+def has_encoder(name: str) -> bool:
+    encoders = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+    return f" {name} " in encoders
+
+
+def make_source(path, video_args):
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y",
+         "-f", "lavfi", "-i", "testsrc2=duration=6:size=320x240:rate=25",
+         "-f", "lavfi", "-i", "sine=frequency=440:duration=6",
+         *video_args, "-c:a", "aac", "-shortest", str(path)],
+        check=True)
+
+
+def decode_errors(path) -> str:
+    result = subprocess.run(["ffmpeg", "-v", "error", "-i", str(path), "-f", "null", "-"],
+                            capture_output=True, text=True)
+    return result.stderr.strip() or ("" if result.returncode == 0 else f"code {result.returncode}")
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize("video_args", [
+    # PPS différent des réglages par défaut de l'encodeur
+    ["-c:v", "libx264", "-g", "25", "-profile:v", "main", "-x264-params", "cabac=0:ref=1"],
+    ["-c:v", "libx264", "-g", "25", "-profile:v", "high"],
+    ["-c:v", "libx265", "-x265-params", "keyint=25:min-keyint=25:log-level=error", "-tag:v", "hvc1"],
+])
+def test_precise_cut_decodes_cleanly(app_module, tmp_path, video_args):
+    if not has_encoder(video_args[1]):
+        pytest.skip(f"{video_args[1]} absent")
+    source = tmp_path / "source.mp4"
+    output = tmp_path / "cut.mp4"
+    make_source(source, video_args)
+    bounds = asyncio.run(app_module.cut_video(str(source), str(output), "00:00:01.3", "00:00:04.7",
+                                              precise=True))
+    assert bounds == {"start": 1.3, "end": 4.7, "precise": True}
+    assert decode_errors(output) == ""
+
+
+def stored_source(app_module, name: str) -> str:
+    path = os.path.join(app_module.DOWNLOAD_DIR, name)
+    make_source(path, ["-c:v", "libx264", "-g", "25"])
+    app_module.media_store.add(name)
+    return path
+
+
+@requires_ffmpeg
+def test_edit_updates_store_off_event_loop(app_module, client, monkeypatch):
+    if not has_encoder("libx264"):
+        pytest.skip("libx264 absent")
+    stored_source(app_module, "edit-source.mp4")
+    threads = []
+    refresh, add = app_module.media_store.refresh, app_module.media_store.add
+    monkeypatch.setattr(app_module.media_store, "refresh",
+                        lambda *a, **k: threads.append(threading.current_thread()) or refresh(*a, **k))
+    monkeypatch.setattr(app_module.media_store, "add",
+                        lambda *a, **k: threads.append(threading.current_thread()) or add(*a, **k))
+    monkeypatch.setattr(app_module, "schedule_probe", lambda path: None)
+
+    assert client.post("/api/edit/cut", json={"filename": "edit-source.mp4", "start_time": "00:00:01",
+                                              "end_time": "00:00:03"}).status_code == 200
+    assert client.post("/api/edit/divide", json={"filename": "edit-source.mp4", "segments": 2}).status_code == 200
+    assert client.post("/api/edit/pipeline", json={"filename": "edit-source.mp4",
+                                                   "operations": [{"op": "cut", "start_time": "0", "end_time": "1"}]}
+                       ).status_code == 200
+    assert len(threads) >= 4
+    assert all(thread.name.startswith("AnyIO worker") for thread in threads)
+
+
+@pytest.mark.parametrize("segments", [0, -1])
+def test_divide_rejects_non_positive_segments(client, segments):
+    response = client.post("/api/edit/divide", json={"filename": "absent.mp4", "segments": segments})
+    assert response.status_code == 422
+
+
+def test_comment_text_is_passed_through_a_file(app_module, monkeypatch):
+    text = "L'heure : 12:30, 100% \\ {x}"
+    seen = {}
+
+    async def run(cmd, job=None, duration=None):
+        graph = cmd[cmd.index('-vf') + 1]
+        seen["graph"] = graph
+        text_file = graph.split("textfile='", 1)[1].split("'", 1)[0]
+        with open(text_file, encoding="utf-8") as f:
+            seen["text"] = f.read()
+
+    async def probe_duration(path):
+        return 10.0
+
+    monkeypatch.setattr(app_module.ffmpeg_runner, "run", run)
+    monkeypatch.setattr(app_module, "probe_duration", probe_duration)
+    assert asyncio.run(app_module.add_comment_to_video("in.mp4", "out.mp4", text, "00:00:01", 2))
+    assert seen["text"] == text
+    assert "expansion=none" in seen["graph"] and "heure" not in seen["graph"]
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+
+class MemoryRemote:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+
+def test_urls_are_normalized(app_module):
+    normalize = app_module.normalize_url
+    assert normalize("https://youtu.be/dQw4w9WgXcQ") == normalize("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=3")
+    assert normalize("HTTPS://Media.Example.org/v.mp4?b=2&a=1#t=5") == "https://media.example.org/v.mp4?a=1&b=2"
+
+
+def test_concurrent_lookups_share_one_extraction(app_module):
+    cache = app_module.ExtractionCache(ttl=60, max_entries=10, max_bytes=10 ** 6)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def extract(url):
+        calls.append(url)
+        started.set()
+        release.wait(5)
+        return {"title": "clip"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get_or_extract("https://media.example.org/v.mp4", extract))) for _ in range(3)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [{"title": "clip"}] * 3 and len(calls) == 1
+    assert cache.get_or_extract("https://media.example.org/v.mp4?", extract) == {"title": "clip"}
+    stats = cache.stats()
+    assert (stats["misses"], stats["shared"], stats["hits"]) == (1, 2, 1)
+
+
+def test_entries_expire_and_are_evicted(app_module, monkeypatch):
+    cache = app_module.ExtractionCache(ttl=60, max_entries=2, max_bytes=10 ** 6)
+    calls = []
+
+    def extract(url):
+        calls.append(url)
+        return {"url": url}
+
+    for name in ("a", "b", "a", "c", "b"):
+        cache.get_or_extract(f"https://media.example.org/{name}", extract)
+    # « b » a été évincé par « c » : « a » avait été consulté plus récemment
+    assert [url.rsplit("/", 1)[1] for url in calls] == ["a", "b", "c", "b"]
+    assert cache.stats()["evictions"] == 2
+    now = time.time()
+    monkeypatch.setattr(app_module.time, "time", lambda: now + 61)
+    cache.get_or_extract("https://media.example.org/b", extract)
+    assert len(calls) == 5
+
+
+def test_failures_are_not_cached(app_module):
+    cache = app_module.ExtractionCache(ttl=60, max_entries=10, max_bytes=10 ** 6)
+
+    def fail(url):
+        raise ValueError("extraction impossible")
+
+    with pytest.raises(ValueError):
+        cache.get_or_extract("https://media.example.org/v.mp4", fail)
+    assert cache.get_or_extract("https://media.example.org/v.mp4", lambda url: {"ok": True}) == {"ok": True}
+
+
+def test_extractions_are_shared_between_workers(app_module):
+    remote = MemoryRemote()
+    first = app_module.ExtractionCache(ttl=60, max_entries=10, max_bytes=10 ** 6, remote=remote)
+    second = app_module.ExtractionCache(ttl=60, max_entries=10, max_bytes=10 ** 6, remote=remote)
+    first.get_or_extract("https://media.example.org/v.mp4", lambda url: {"title": "clip"})
+
+    def extract(url):
+        raise AssertionError("déjà extrait par un autre worker")
+
+    assert second.get_or_extract("https://media.example.org/v.mp4", extract) == {"title": "clip"}
+    assert second.stats()["remote_hits"] == 1
+
+
+MPD = """<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT4S" minBufferTime="PT2S"
+     profiles="urn:mpeg:dash:profile:isoff-live:2011">
+  <Period>
+    <AdaptationSet contentType="video" mimeType="video/mp4">
+      <Representation id="0" codecs="avc1.64001e" width="320" height="240" bandwidth="300000">
+        <SegmentTemplate timescale="1000" duration="2000" initialization="init-$RepresentationID$.m4s"
+                         media="chunk-$RepresentationID$-$Number$.m4s" startNumber="1"/>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet contentType="audio" mimeType="audio/mp4">
+      <Representation id="1" codecs="mp4a.40.2" audioSamplingRate="44100" bandwidth="96000">
+        <SegmentTemplate timescale="1000" duration="2000" initialization="init-$RepresentationID$.m4s"
+                         media="chunk-$RepresentationID$-$Number$.m4s" startNumber="1"/>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+def test_sources_without_a_combined_format_are_extracted(app_module, origin, tmp_path):
+    url, _ = origin
+    (tmp_path / "index.mpd").write_text(MPD)
+    info = app_module.extract_metadata(url.replace("clip.mp4", "index.mpd"))
+    assert sorted(f["vcodec"] != "none" for f in info["formats"]) == [False, True]
@@ -0,0 +1,103 @@
+import asyncio
+
+from starlette.requests import Request
+
+
+def pins(app_module, filename: str) -> int:
+    return app_module.media_store.get(filename).pins
+
+
+def test_full_response_unpins(app_module, client, store_file):
+    filename = store_file("full.bin")
+    response = client.get(f"/file/{filename}")
+    assert response.status_code == 200
+    assert len(response.content) == 5000
+    assert pins(app_module, filename) == 0
+
+
+def test_unsatisfiable_and_malformed_ranges_unpin(app_module, client, store_file):
+    filename = store_file("range.bin")
+    assert client.get(f"/file/{filename}", headers={"Range": "bytes=9000-"}).status_code == 416
+    assert client.get(f"/file/{filename}", headers={"Range": "octets=0-1"}).status_code == 400
+    assert pins(app_module, filename) == 0
+    assert app_module.media_store.stats()["pinned_bytes"] == 0
+
+
+def test_client_disconnect_unpins(app_module, store_file):
+    filename = store_file("disconnect.bin")
+    scope = {"type": "http", "method": "GET", "path": f"/file/{filename}", "headers": [],
+             "query_string": b""}
+    response = app_module.get_file(filename, Request(scope))
+    assert pins(app_module, filename) == 1
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            raise OSError("connexion fermée par le client")
+
+    try:
+        asyncio.run(response(scope, receive, send))
+    except OSError:
+        pass
+    assert pins(app_module, filename) == 0
+
+
+def test_ranges_and_validators(app_module, client, store_file):
+    filename = store_file("validators.bin")
+    with open(f"{app_module.DOWNLOAD_DIR}/{filename}", "rb") as f:
+        content = f.read()
+    full = client.get(f"/file/{filename}")
+    assert full.headers["accept-ranges"] == "bytes" and full.headers["cache-control"] == "no-cache"
+    etag, last_modified = full.headers["etag"], full.headers["last-modified"]
+
+    single = client.get(f"/file/{filename}", headers={"Range": "bytes=100-199"})
+    assert single.status_code == 206
+    assert single.headers["content-range"] == "bytes 100-199/5000" and single.content == content[100:200]
+    multiple = client.get(f"/file/{filename}", headers={"Range": "bytes=0-9,4990-"})
+    assert multiple.status_code == 206
+    assert multiple.headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert content[:10] in multiple.content and content[4990:] in multiple.content
+
+    for headers in ({"If-None-Match": etag}, {"If-None-Match": f'"autre", W/{etag}'}, {"If-None-Match": "*"},
+                    {"If-Modified-Since": last_modified}):
+        not_modified = client.get(f"/file/{filename}", headers=headers)
+        assert not_modified.status_code == 304 and not_modified.content == b""
+        assert not_modified.headers["etag"] == etag
+    # If-None-Match l'emporte sur If-Modified-Since
+    assert client.get(f"/file/{filename}", headers={"If-None-Match": '"autre"',
+                                                    "If-Modified-Since": last_modified}).status_code == 200
+    assert pins(app_module, filename) == 0
+
+
+def test_media_type_disposition_and_hidden_files(app_module, client, store_file):
+    filename = store_file("sans_extension")
+    with open(f"{app_module.DOWNLOAD_DIR}/{filename}", "r+b") as f:
+        f.write(b"\x00\x00\x00\x20ftypisom")
+    response = client.get(f"/file/{filename}", params={"download": "false"})
+    assert response.headers["content-type"] == "video/mp4"
+    assert response.headers["content-disposition"].startswith("inline")
+    assert client.get(f"/file/{store_file('clip.m4a')}").headers["content-type"] == "audio/mp4"
+    head = client.head(f"/file/{filename}")
+    assert head.status_code == 200 and head.headers["content-length"] == "5000" and head.content == b""
+    assert client.get("/file/.upload_x.json").status_code == 404
+    assert pins(app_module, filename) == 0
+
+
+def test_zero_copy_send_when_the_server_offers_it(app_module, store_file):
+    filename = store_file("zerocopy.bin")
+    messages = []
+    scope = {"type": "http", "method": "GET", "path": f"/file/{filename}", "query_string": b"",
+             "headers": [(b"range", b"bytes=1000-1999")], "extensions": {"http.response.zerocopysend": {}}}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append({k: v for k, v in message.items() if k != "file"})
+
+    asyncio.run(app_module.get_file(filename, Request(scope))(scope, receive, send))
+    assert messages[0]["status"] == 206
+    assert messages[1] == {"type": "http.response.zerocopysend", "offset": 1000, "count": 1000, "more_body": False}
+    assert pins(app_module, filename) == 0
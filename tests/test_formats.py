@@ -0,0 +1,50 @@
+INFO = {"duration": 100, "formats": [
+    {"format_id": "140", "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.2", "abr": 128},
+    {"format_id": "251", "ext": "webm", "vcodec": "none", "acodec": "opus", "abr": 160},
+    {"format_id": "22", "ext": "mp4", "vcodec": "avc1.64001F", "acodec": "mp4a.40.2", "height": 720, "width": 1280,
+     "fps": 30, "tbr": 1500, "abr": 128},
+    {"format_id": "137", "ext": "mp4", "vcodec": "avc1.640028", "acodec": "none", "height": 1080, "width": 1920,
+     "fps": 30, "vbr": 4000},
+    {"format_id": "248", "ext": "webm", "vcodec": "vp9", "acodec": "none", "height": 1080, "width": 1920,
+     "fps": 30, "vbr": 2500},
+    {"format_id": "399", "ext": "mp4", "vcodec": "av01.0.08M.08", "acodec": "none", "height": 1080, "width": 1920,
+     "fps": 30, "vbr": 1500},
+    {"format_id": "9", "ext": "mp4", "vcodec": "avc1", "acodec": "none", "height": 360},
+]}
+
+
+def selectors(candidates):
+    return [candidate["selector"] for candidate in candidates]
+
+
+def test_video_only_formats_are_paired_with_audio_of_the_same_container(app_module):
+    ranking = app_module.rank_formats(INFO)
+    by_selector = {candidate["selector"]: candidate for candidate in ranking["video"]}
+    assert set(by_selector) == {"137+140", "248+251", "399+140", "22", "9+140"}
+    assert (by_selector["248+251"]["ext"], by_selector["399+140"]["ext"], by_selector["22"]["ext"]) == \
+        ("webm", "mp4", "mp4")
+    assert by_selector["137+140"]["size"] == (4000 + 128) * 125 * 100
+    assert by_selector["9+140"]["fidelity"] == 0.75  # Débit inconnu
+    # Même hauteur : classés par débit équivalent H.264 (4000, 2500 × 1,4, 1500 × 1,8)
+    assert selectors(ranking["video"])[:3] == ["137+140", "248+251", "399+140"]
+    assert selectors(ranking["audio"]) == ["251", "140"]
+
+
+def test_ladder_prefers_smaller_files_of_equivalent_quality(app_module):
+    ranking = app_module.rank_formats(INFO)
+    # 248+251 est à moins de 5 % de 137+140 et bien plus léger
+    assert selectors(app_module.select_formats(ranking)) == ["248+251", "22", "9+140"]
+
+
+def test_client_constraints(app_module):
+    ranking = app_module.rank_formats(INFO)
+    assert selectors(app_module.select_formats(ranking, container="mp4"))[0] == "137+140"
+    assert selectors(app_module.select_formats(ranking, vcodecs=["av1"])) == ["399+140"]
+    assert selectors(app_module.select_formats(ranking, max_height=720)) == ["22", "9+140"]
+    assert selectors(app_module.select_formats(ranking, max_filesize=20_000_000)) == ["22", "9+140"]
+
+
+def test_selector_falls_back_to_best(app_module):
+    info = {**INFO, "_ranking": app_module.rank_formats(INFO)}
+    assert app_module.best_format_selector(info, container="mp4") == "137+140/best"
+    assert app_module.best_format_selector(info, max_height=100) == "best"
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import shutil
+import subprocess
+
+import pytest
+
+requires_ffmpeg = pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")),
+                                     reason="ffmpeg/ffprobe requis")
+
+
+def test_segments_start_on_keyframes_and_split_before_the_next(app_module):
+    segments = app_module.hls_segments([i * 2.0 for i in range(8)], 15.0, 6)
+    assert segments == [(0.0, 6.0, 5.0), (6.0, 6.0, 5.0), (12.0, 3.0, 2.5)]
+
+
+def test_segments_without_video_are_evenly_spaced(app_module):
+    assert [segment[:2] for segment in app_module.hls_segments([], 13.0, 6)] == [(0.0, 6.0), (6.0, 6.0), (12.0, 1.0)]
+
+
+def test_renditions_copy_compatible_streams_and_add_a_proxy(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "HLS_PROXY_HEIGHT", 360)
+    monkeypatch.setattr(app_module, "HLS_PROXY_BITRATE", 600000)
+    entry = {"bit_rate": 5000000, "size": 0, "duration": 10.0, "streams": [
+        {"codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080},
+        {"codec_type": "audio", "codec_name": "aac"}]}
+    assert app_module.hls_renditions(entry) == {
+        "source": {"video": "copy", "audio": "copy", "width": 1920, "height": 1080, "bandwidth": 5000000},
+        "proxy": {"video": "proxy", "audio": "aac", "width": 640, "height": 360, "bandwidth": 696000},
+    }
+    entry = {"bit_rate": None, "size": 1000000, "duration": 8.0, "streams": [
+        {"codec_type": "video", "codec_name": "vp9", "width": 320, "height": 240},
+        {"codec_type": "audio", "codec_name": "opus"}]}
+    renditions = app_module.hls_renditions(entry)
+    assert list(renditions) == ["source"]
+    assert (renditions["source"]["video"], renditions["source"]["audio"], renditions["source"]["bandwidth"]) == \
+        ("h264", "aac", 1000000)
+    with pytest.raises(ValueError):
+        app_module.hls_renditions({"bit_rate": None, "size": 0, "duration": 1.0, "streams": []})
+
+
+def test_playlists(app_module):
+    packager = app_module.HlsPackager("unused", 0, 6)
+    assert packager.master_playlist({
+        "source": {"bandwidth": 5000000, "width": 1920, "height": 1080},
+        "audio": {"bandwidth": 128000, "width": None, "height": None},
+    }) == ("#EXTM3U\n#EXT-X-VERSION:3\n"
+           "#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080\nsource.m3u8\n"
+           "#EXT-X-STREAM-INF:BANDWIDTH=128000\naudio.m3u8\n")
+    assert packager.media_playlist("source", "abc", [(0.0, 6.0, 5.0), (6.0, 6.4, 5.0)]).split("\n") == [
+        "#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:7", "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXTINF:6.000,", "source/abc/0.ts", "#EXTINF:6.400,", "source/abc/1.ts",
+        "#EXT-X-ENDLIST", ""]
+
+
+def test_least_recently_served_segments_are_evicted(app_module, tmp_path):
+    packager = app_module.HlsPackager(str(tmp_path), 250, 6)
+    paths = []
+    for index in range(3):
+        path = tmp_path / "fp" / "source" / f"{index}.ts"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"\0" * 100)
+        paths.append(str(path))
+    packager._touch(paths[0], 100)
+    packager._touch(paths[1], 100)
+    packager._touch(paths[0], 100)  # Servi à nouveau : le plus récent
+    packager._touch(paths[2], 100)
+    packager._evict(keep=paths[2])
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
+    assert packager.stats() == {"segments": 2, "bytes": 200, "max_bytes": 250}
+
+
+@pytest.mark.parametrize("video, priority", [("copy", "serve"), ("h264", "serve"), ("proxy", "download")])
+def test_proxy_segments_queue_behind_served_ones(app_module, tmp_path, monkeypatch, video, priority):
+    seen = []
+
+    def segment_args(path, rendition, segment, work_dir):
+        output = os.path.join(work_dir, "out.ts")
+        return ["-i", path, output], output
+
+    async def run(args, job=None, duration=None, timeout=None, priority="edit"):
+        seen.append(priority)
+        with open(args[-1], "wb") as f:
+            f.write(b"\0" * 188)
+
+    monkeypatch.setattr(app_module, "hls_segment_args", segment_args)
+    monkeypatch.setattr(app_module.ffmpeg_runner, "run", run)
+    packager = app_module.HlsPackager(str(tmp_path), 10 ** 6, 4)
+    target = str(tmp_path / "fp" / "v" / "0.ts")
+    os.makedirs(os.path.dirname(target))
+    rendition = {"video": video, "audio": "aac", "width": 640, "height": 360}
+    assert asyncio.run(packager.segment("in.mp4", "fp", "v", rendition, [(0.0, 4.0, 4.0)], 0)) == target
+    assert seen == [priority]
+
+
+@requires_ffmpeg
+def test_hls_endpoints_package_a_stored_file(app_module, client):
+    encoders = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+    if " libx264 " not in encoders:
+        pytest.skip("libx264 absent")
+    name = "hls_source.mp4"
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=duration=10:size=320x240:rate=25",
+                    "-f", "lavfi", "-i", "sine=frequency=440:duration=10", "-c:v", "libx264", "-g", "50",
+                    "-c:a", "aac", "-shortest", os.path.join(app_module.DOWNLOAD_DIR, name)], check=True)
+    app_module.media_store.add(name)
+    master = client.get(f"/api/hls/{name}/master.m3u8")
+    assert master.status_code == 200, master.text
+    assert master.text.splitlines()[-1] == "source.m3u8"
+    assert client.get(f"/api/hls/{name}/proxy.m3u8").status_code == 404
+    playlist = client.get(f"/api/hls/{name}/source.m3u8").text
+    uris = [line for line in playlist.splitlines() if line.endswith(".ts")]
+    assert len(uris) == 2 and playlist.rstrip().endswith("#EXT-X-ENDLIST")
+    segment = client.get(f"/api/hls/{name}/{uris[1]}")
+    assert segment.status_code == 200 and segment.content[:1] == b"\x47"
+    assert client.get(f"/api/hls/{name}/{uris[1]}").content == segment.content
+    stale = uris[0].replace(uris[0].split("/")[1], "0" * 32)
+    assert client.get(f"/api/hls/{name}/{stale}").status_code == 404
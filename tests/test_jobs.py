@@ -0,0 +1,72 @@
+import threading
+
+
+def wait_all(jobs, timeout=5):
+    for job in jobs:
+        assert job.done_event.wait(timeout)
+
+
+def test_jobs_are_bounded_per_host_and_queued_jobs_cancel_without_running(app_module):
+    manager = app_module.JobManager(max_workers=2, per_host_limit=1)
+    release = threading.Event()
+    ran = []
+
+    def work(job, name):
+        ran.append(name)
+        release.wait(5)
+        return {"name": name}
+
+    try:
+        first = manager.submit("download", work, "a1", host="a")
+        second = manager.submit("download", work, "a2", host="a")
+        third = manager.submit("download", work, "b1", host="b")
+        cancelled = manager.submit("download", work, "a3", host="a")
+        # Le domaine « a » est saturé : b1 passe devant a2
+        assert [job.status for job in (first, second, third)] == ["running", "queued", "running"]
+        assert manager.cancel(cancelled.id).status == "cancelled"
+        release.set()
+        wait_all([first, second, third])
+        assert sorted(ran) == ["a1", "a2", "b1"]
+        assert second.snapshot().result == {"name": "a2"} and second.snapshot().progress == 1.0
+    finally:
+        release.set()
+        manager.shutdown()
+
+
+def test_failures_and_cancellations_are_reported(app_module):
+    manager = app_module.JobManager(max_workers=1, per_host_limit=1)
+    started = threading.Event()
+
+    def fail(job):
+        raise RuntimeError("origine injoignable")
+
+    def cancellable(job):
+        started.set()
+        job.cancel_event.wait(5)
+        raise app_module.JobCancelled()
+
+    try:
+        failed = manager.submit("download", fail)
+        running = manager.submit("download", cancellable)
+        assert started.wait(5)
+        manager.cancel(running.id)
+        wait_all([failed, running])
+        assert (failed.status, failed.error) == ("failed", "origine injoignable")
+        assert running.status == "cancelled"
+    finally:
+        manager.shutdown()
+
+
+def test_download_is_accepted_as_a_job(app_module, client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(app_module.job_manager, "submit",
+                        lambda kind, func, *args, host=None: submitted.append((kind, host)) or app_module.Job(kind))
+    response = client.post("/download", json={"url": "https://media.example.org/clip.mp4"})
+    assert response.status_code == 202
+    assert response.json()["status"] == "queued"
+    assert submitted == [("download", "media.example.org")]
+
+
+def test_unknown_job_is_not_found(client):
+    assert client.get("/jobs/inconnu").status_code == 404
+    assert client.delete("/jobs/inconnu").status_code == 404
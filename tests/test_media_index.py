@@ -0,0 +1,42 @@
+import asyncio
+import json
+import threading
+
+
+class RecordingConnection:
+    def __init__(self, conn, threads):
+        self.conn = conn
+        self.threads = threads
+
+    def execute(self, *args):
+        self.threads.add(threading.current_thread().name)
+        return self.conn.execute(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_index_queries_run_off_event_loop(app_module, tmp_path, monkeypatch):
+    probes = []
+
+    async def probe(args, timeout=None):
+        probes.append(args[-1])
+        return json.dumps({"format": {"duration": "2.5", "bit_rate": "1000", "format_name": "mp3"},
+                           "streams": [{"index": 0, "codec_type": "audio"}]}).encode()
+
+    monkeypatch.setattr(app_module.ffmpeg_runner, "probe", probe)
+    index = app_module.MediaIndex(str(tmp_path / "media_index.db"))
+    threads = set()
+    index._conn = RecordingConnection(index._conn, threads)
+    media = tmp_path / "clip.mp3"
+    media.write_bytes(b"\0" * 100)
+
+    async def run():
+        first = await index.get(str(media))
+        second = await index.get(str(media))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second and first["duration"] == 2.5
+    assert len(probes) == 1
+    assert threads and all(name != threading.main_thread().name for name in threads)
@@ -0,0 +1,32 @@
+def test_registry_renders_prometheus_text(app_module):
+    registry = app_module.Metrics()
+    registry.counter("jobs_total", "Jobs")
+    registry.histogram("wait_seconds", "Attente")
+    registry.gauge("queue", "File", lambda: {(("kind", 'a"b'),): 3})
+    registry.gauge("broken", "Toujours en erreur", lambda: 1 / 0)
+    registry.inc("jobs_total", kind="download")
+    registry.inc("jobs_total", 2, kind="download")
+    bounds = app_module.LATENCY_BUCKETS
+    registry.observe("wait_seconds", bounds[1], stage="x")
+    registry.observe("wait_seconds", bounds[-1] * 2, stage="x")
+    lines = registry.render().splitlines()
+    assert lines[:3] == ["# HELP jobs_total Jobs", "# TYPE jobs_total counter", 'jobs_total{kind="download"} 3']
+    buckets = [line for line in lines if line.startswith("wait_seconds_bucket")]
+    # Buckets cumulatifs : la borne atteinte compte, +Inf compte tout
+    assert buckets[0] == f'wait_seconds_bucket{{stage="x",le="{bounds[0]}"}} 0'
+    assert buckets[1] == f'wait_seconds_bucket{{stage="x",le="{bounds[1]}"}} 1'
+    assert buckets[-1] == 'wait_seconds_bucket{stage="x",le="+Inf"} 2'
+    assert 'wait_seconds_count{stage="x"} 2' in lines
+    assert 'queue{kind="a\\"b"} 3' in lines
+    assert lines[-2:] == ["# HELP broken Toujours en erreur", "# TYPE broken gauge"]
+
+
+def test_requests_are_counted_per_route_template(client):
+    client.get("/health")
+    client.get("/jobs/inconnu")
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'http_requests_total{method="GET",route="/health",status="200"}' in text
+    assert 'http_requests_total{method="GET",route="/jobs/{job_id}",status="404"}' in text
+    assert 'http_request_duration_seconds_count{route="/health"}' in text
@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+requires_ffmpeg = pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")),
+                                     reason="ffmpeg/ffprobe requis")
+
+
+def ops(app_module, *operations):
+    return [app_module.PipelineOperation(**operation) for operation in operations]
+
+
+def test_cuts_compose_and_comments_follow_the_output_timeline(app_module):
+    plan = app_module.plan_pipeline(ops(
+        app_module,
+        {"op": "cut", "start_time": "10", "end_time": "50"},
+        {"op": "comment", "text": "avant", "time": "0", "duration": 5},
+        {"op": "cut", "start_time": "00:03", "end_time": "00:20"},
+        {"op": "comment", "text": "après", "time": "1", "duration": 30},
+        {"op": "export", "format": ".MP4"},
+    ), 60.0, "mkv")
+    assert (plan["start"], plan["end"], plan["container"]) == (13.0, 30.0, "mp4")
+    # Le premier commentaire (10-15 s en source) est rogné par la seconde coupe
+    assert plan["comments"] == [("avant", 0.0, 2.0), ("après", 1.0, 17.0)]
+
+
+def test_comments_outside_the_cut_are_dropped(app_module):
+    plan = app_module.plan_pipeline(ops(
+        app_module,
+        {"op": "comment", "text": "hors champ", "time": "40", "duration": 5},
+        {"op": "cut", "start_time": "0", "end_time": "30"},
+    ), 60.0, "webm")
+    assert plan["comments"] == [] and plan["container"] == "webm"
+
+
+@pytest.mark.parametrize("operation, message", [
+    ({"op": "cut", "start_time": "5"}, "requis"),
+    ({"op": "cut", "start_time": "5", "end_time": "5"}, "postérieure"),
+    ({"op": "cut", "start_time": "70", "end_time": "80"}, "hors de la vidéo"),
+    ({"op": "comment", "text": "x", "time": "1"}, "requis"),
+    ({"op": "export", "format": "avi"}, "non supporté"),
+    ({"op": "blur"}, "inconnue"),
+])
+def test_invalid_operations_are_rejected(app_module, operation, message):
+    with pytest.raises(ValueError, match=message):
+        app_module.plan_pipeline(ops(app_module, operation), 60.0, "mkv")
+
+
+def test_invalid_pipeline_is_a_bad_request(app_module, client, tmp_path):
+    name = "pipeline_invalide.mkv"
+    with open(os.path.join(app_module.DOWNLOAD_DIR, name), "wb") as f:
+        f.write(b"\0")
+    try:
+        response = client.post("/api/edit/pipeline", json={"filename": name, "operations": [{"op": "blur"}]})
+        assert response.status_code == 400
+        assert client.post("/api/edit/pipeline", json={"filename": name, "operations": []}).status_code == 400
+    finally:
+        os.remove(os.path.join(app_module.DOWNLOAD_DIR, name))
+
+
+def test_streams_are_copied_unless_filtered_or_unsupported(app_module):
+    streams = [{"codec_type": "video", "codec_name": "h264"}, {"codec_type": "audio", "codec_name": "opus"}]
+    assert app_module.pipeline_codec_args(streams, "mp4", False) == (["-c:v", "copy", "-c:a", "aac"], "copy", "aac")
+    args, video, audio = app_module.pipeline_codec_args(streams, "mkv", True)
+    assert (video, audio) == ("libx264", "copy")
+    args, video, audio = app_module.pipeline_codec_args(streams, "webm", False)
+    assert (video, audio) == ("libvpx-vp9", "copy")
+
+
+def test_versions_are_numbered_per_source(app_module):
+    first, version = app_module.versioned_filename("numerotation.v3.mp4", "mkv")
+    try:
+        assert (first, version) == ("numerotation.v1.mkv", 1)
+        second, version = app_module.versioned_filename("numerotation.mp4", "mp4")
+        os.remove(os.path.join(app_module.DOWNLOAD_DIR, second))
+        assert (second, version) == ("numerotation.v2.mp4", 2)
+    finally:
+        os.remove(os.path.join(app_module.DOWNLOAD_DIR, first))
+
+
+@requires_ffmpeg
+def test_pipeline_cuts_and_exports_in_one_pass(app_module, client):
+    name = "pipeline_source.mp4"
+    source = os.path.join(app_module.DOWNLOAD_DIR, name)
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=duration=6:size=320x240:rate=25",
+                    "-f", "lavfi", "-i", "sine=frequency=440:duration=6", "-c:v", "mpeg4", "-g", "25",
+                    "-c:a", "aac", "-shortest", source], check=True)
+    app_module.media_store.add(name)
+    response = client.post("/api/edit/pipeline", json={"filename": name, "operations": [
+        {"op": "cut", "start_time": "2", "end_time": "5"},
+        {"op": "export", "format": "mkv"},
+    ]})
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert (result["filename"], result["container"], result["video"]) == ("pipeline_source.v1.mkv", "mkv", "copy")
+    output = os.path.join(app_module.DOWNLOAD_DIR, result["filename"])
+    probe = json.loads(subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "json",
+                                       output], capture_output=True, text=True, check=True).stdout)
+    assert abs(float(probe["format"]["duration"]) - 3.0) < 0.5
+    assert os.path.exists(source)
+    assert app_module.media_store.get(result["filename"]).meta["source"] == name
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import shutil
+import subprocess
+
+import pytest
+
+requires_ffmpeg = pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")),
+                                     reason="ffmpeg/ffprobe requis")
+
+
+def test_vtt_timestamps(app_module):
+    assert app_module.vtt_timestamp(0) == "00:00:00.000"
+    assert app_module.vtt_timestamp(3725.0456) == "01:02:05.046"
+
+
+def test_preview_frames_are_spaced_over_the_duration(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "PREVIEW_MAX_TILES", 10)
+    threshold, times = app_module.select_preview_frames([i * 0.5 for i in range(200)], 100.0)
+    assert threshold == pytest.approx(9.999)
+    assert times == [0.0, 10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0, 80.0, 90.0]
+    # Images clés plus espacées que le seuil : toutes sont retenues
+    assert app_module.select_preview_frames([0.0, 4.0], 8.0)[1] == [0.0, 4.0]
+
+
+def test_previews_are_rendered_once_and_indexed_in_vtt(app_module, tmp_path, monkeypatch):
+    runs = []
+
+    async def get(path):
+        return {"duration": 30.0, "keyframes": [0.0, 10.0, 20.0],
+                "streams": [{"codec_type": "video", "width": 640, "height": 360}]}
+
+    async def run(args, job=None, duration=None, timeout=None, priority="edit"):
+        runs.append(args)
+        await asyncio.sleep(0.05)
+        for name in ("sprite.jpg", "poster.jpg"):
+            output = next(arg for arg in args if arg.endswith(name))
+            with open(output, "wb") as f:
+                f.write(b"jpeg")
+
+    monkeypatch.setattr(app_module.media_index, "get", get)
+    monkeypatch.setattr(app_module.ffmpeg_runner, "run", run)
+    source = tmp_path / "video.mp4"
+    source.write_bytes(os.urandom(1000))
+    cache = app_module.PreviewCache(str(tmp_path / "previews"))
+    os.makedirs(cache.directory)
+
+    async def twice():
+        return await asyncio.gather(cache.get(str(source)), cache.get(str(source)))
+
+    first, second = asyncio.run(twice())
+    assert first == second and len(runs) == 1
+    assert (first["tiles"], first["columns"], first["tile_width"], first["tile_height"]) == (3, 3, 160, 90)
+    assert first["vtt"] == f"/api/previews/{first['fingerprint']}/sprite.vtt"
+    with open(cache.path(first["fingerprint"], "sprite.vtt")) as f:
+        assert f.read().split("\n") == [
+            "WEBVTT", "",
+            "00:00:00.000 --> 00:00:10.000", "sprite.jpg#xywh=0,0,160,90", "",
+            "00:00:10.000 --> 00:00:20.000", "sprite.jpg#xywh=160,0,160,90", "",
+            "00:00:20.000 --> 00:00:30.000", "sprite.jpg#xywh=320,0,160,90", ""]
+    # Déjà sur disque : plus de passe ffmpeg
+    assert asyncio.run(cache.get(str(source))) == first and len(runs) == 1
+    assert not [name for name in os.listdir(cache.directory) if name.startswith(".")]
+
+
+@pytest.mark.parametrize("path", ["/api/previews/nothex/sprite.jpg", f"/api/previews/{'0' * 32}/manifest.json",
+                                  f"/api/previews/{'0' * 32}/sprite.jpg"])
+def test_unknown_preview_files_are_not_found(client, path):
+    assert client.get(path).status_code == 404
+
+
+@requires_ffmpeg
+def test_preview_endpoint_serves_sprite_and_vtt(app_module, client):
+    name = "apercu_source.mp4"
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=duration=4:size=320x240:rate=25",
+                    "-c:v", "mpeg4", "-g", "25", os.path.join(app_module.DOWNLOAD_DIR, name)], check=True)
+    app_module.media_store.add(name)
+    response = client.get(f"/api/media/{name}/preview")
+    assert response.status_code == 200, response.text
+    manifest = response.json()
+    assert manifest["tiles"] == 4
+    assert client.get(f"/api/media/{name}/preview", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    sprite = client.get(manifest["sprite"])
+    assert sprite.headers["content-type"] == "image/jpeg" and sprite.content[:2] == b"\xff\xd8"
+    assert client.get(manifest["poster"]).content[:2] == b"\xff\xd8"
+    assert client.get(manifest["vtt"]).text.startswith("WEBVTT")
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+
+def test_subscribers_receive_only_the_latest_state(app_module, monkeypatch):
+    hub = app_module.ProgressHub(0.01)
+    monkeypatch.setattr(app_module, "progress_hub", hub)
+    job = app_module.job_manager.register("edit")
+
+    async def scenario():
+        fast, slow = hub.subscribe(job.id), hub.subscribe(job.id)
+        runner = asyncio.create_task(hub.run())
+        try:
+            for progress in (0.1, 0.2, 0.3):
+                job.update(progress=progress)
+            done, message = await asyncio.wait_for(fast.get(), 1)
+            assert not done and json.loads(message.split("data: ", 1)[1])["progress"] == 0.3
+            # Sans changement, rien n'est renvoyé
+            await asyncio.sleep(0.05)
+            assert fast.empty()
+            job.update(progress=0.6)
+            done, message = await asyncio.wait_for(fast.get(), 1)
+            assert not done and json.loads(message.split("data: ", 1)[1])["progress"] == 0.6
+            job.finish(app_module.JOB_FINISHED, result={"filename": "x.mp4"})
+            done, message = await asyncio.wait_for(fast.get(), 1)
+            assert done and message.startswith("event: done\n")
+            # L'abonné qui n'a rien lu ne garde que le dernier message
+            assert slow.qsize() == 1 and (await slow.get())[1] == message
+        finally:
+            runner.cancel()
+            hub.unsubscribe(job.id, fast)
+            hub.unsubscribe(job.id, slow)
+        assert hub.subscribers == 0
+
+    asyncio.run(scenario())
+
+
+def test_events_of_a_finished_job(app_module, client):
+    job = app_module.job_manager.register("edit")
+    job.finish(app_module.JOB_FINISHED, result={"filename": "x.mp4"})
+    response = client.get(f"/jobs/{job.id}/events")
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    retry, event, data = response.text.split("\n")[:3]
+    assert (retry, event) == (f"retry: {app_module.SSE_RETRY_MS}", "event: done")
+    assert json.loads(data[len("data: "):])["result"] == {"filename": "x.mp4"}
+    assert client.get("/jobs/inconnu/events").status_code == 404
+    assert app_module.progress_hub.subscribers == 0
+
+
+def test_download_hook_reports_progress_and_cancels(app_module):
+    import yt_dlp
+
+    job = app_module.Job("download")
+    hook = app_module.make_progress_hook(job)
+    hook({"status": "downloading", "filename": "f", "downloaded_bytes": 500, "total_bytes": 1000,
+          "speed": 250.0, "eta": 2, "fragment_index": 3, "fragment_count": 6})
+    snapshot = job.snapshot()
+    assert (snapshot.stage, snapshot.progress, snapshot.fragment_index) == ("downloading", 0.5, 3)
+    job.cancel_event.set()
+    with pytest.raises(yt_dlp.utils.DownloadCancelled):
+        hook({"status": "downloading", "filename": "f"})
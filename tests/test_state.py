@@ -0,0 +1,63 @@
+import threading
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.values = {}
+        self.threads = set()
+
+    def set(self, key, value, ttl=None):
+        self.threads.add(threading.current_thread().name)
+        self.values[key] = value
+
+    def delete(self, key):
+        self.threads.add(threading.current_thread().name)
+        self.values.pop(key, None)
+
+
+def test_state_writer_merges_and_writes_off_caller_thread(app_module):
+    backend = RecordingBackend()
+    writer = app_module.StateWriter(backend)
+    writer.set("a", "1")
+    writer.set("a", "2")
+    writer.set("b", "3")
+    writer.delete("b")
+    writer.flush()
+    assert backend.values == {"a": "2"}
+    assert backend.threads == {"state-writer"}
+
+
+def test_job_publish_goes_through_writer(app_module, monkeypatch):
+    backend = RecordingBackend()
+    monkeypatch.setattr(app_module, "state_writer", app_module.StateWriter(backend))
+    job = app_module.Job("download")
+    job.publish(force=True)
+    app_module.state_writer.flush()
+    assert f"job:{job.id}" in backend.values
+    assert threading.current_thread().name not in backend.threads
+
+
+def test_leases_are_exclusive_until_released_or_expired(app_module, tmp_path):
+    backend = app_module.SQLiteState(str(tmp_path / "state.db"))
+    assert backend.acquire("leader:cleanup", "a", 60)
+    assert not backend.acquire("leader:cleanup", "b", 60)
+    assert backend.acquire("leader:cleanup", "a", 60)  # Prolongé par son détenteur
+    backend.release("leader:cleanup", "b")  # Sans effet : autre détenteur
+    assert not backend.acquire("leader:cleanup", "b", 60)
+    backend.release("leader:cleanup", "a")
+    assert backend.acquire("leader:cleanup", "b", -1)
+    assert backend.acquire("leader:cleanup", "a", 60)  # Bail de b expiré
+
+
+def test_jobs_of_other_workers_are_visible_and_cancellable(app_module, client, tmp_path, monkeypatch):
+    backend = app_module.SQLiteState(str(tmp_path / "state.db"))
+    monkeypatch.setattr(app_module, "state", backend)
+    monkeypatch.setattr(app_module, "state_writer", app_module.StateWriter(backend))
+    job = app_module.Job("download")  # Connu d'un autre worker seulement
+    job.update(status=app_module.JOB_RUNNING, downloaded_bytes=500, total_bytes=1000)
+    app_module.state_writer.flush()
+    snapshot = client.get(f"/jobs/{job.id}").json()
+    assert (snapshot["status"], snapshot["progress"]) == ("running", 0.5)
+    assert client.delete(f"/jobs/{job.id}").status_code == 200
+    # La demande est déposée dans l'état partagé pour le worker qui exécute le job
+    assert backend.get(f"job-cancel:{job.id}") == app_module.WORKER_ID
@@ -0,0 +1,150 @@
+import json
+import os
+
+
+def make_worker(app_module, directory, index_file, backend, worker_id, leader):
+    store = app_module.MediaStore(str(directory), str(index_file), 10000, 3600, remote=backend)
+    store.worker_id = worker_id
+    store.leader = leader
+    return store
+
+
+def write(directory, filename, size):
+    with open(os.path.join(directory, filename), "wb") as f:
+        f.write(b"\0" * size)
+
+
+def test_quota_is_global_and_respects_other_workers_pins(app_module, tmp_path):
+    directory = tmp_path / "downloads"
+    directory.mkdir()
+    index_file = tmp_path / "index.json"
+    backend = app_module.SQLiteState(str(tmp_path / "state.db"))
+    leader = make_worker(app_module, directory, index_file, backend, "a", True)
+    other = make_worker(app_module, directory, index_file, backend, "b", False)
+
+    write(directory, "served.bin", 6000)
+    other.add("served.bin")
+    other.pin("served.bin")
+    write(directory, "idle.bin", 6000)
+    leader.add("idle.bin")
+    assert sorted(os.listdir(directory)) == ["idle.bin", "served.bin"]  # Le leader ignore encore served.bin
+
+    leader.sync()
+    # Au-delà du quota : le fichier épinglé par l'autre worker est conservé
+    assert os.listdir(directory) == ["served.bin"]
+    with open(index_file) as f:
+        assert [e["filename"] for e in json.load(f)] == ["served.bin"]
+
+    other.unpin("served.bin")
+    with other.reserve(8000):
+        leader.sync()
+        assert not leader.has_room(3000)
+        assert os.listdir(directory) == []  # Place faite pour la réservation de l'autre worker
+
+
+def test_only_leader_writes_index(app_module, tmp_path):
+    directory = tmp_path / "downloads"
+    directory.mkdir()
+    index_file = tmp_path / "index.json"
+    backend = app_module.SQLiteState(str(tmp_path / "state.db"))
+    other = make_worker(app_module, directory, index_file, backend, "b", False)
+    write(directory, "file.bin", 100)
+    other.add("file.bin")
+    assert not index_file.exists()
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.calls = []
+
+    def set(self, key, value, ttl=None):
+        self.calls.append(("set", key))
+
+    def delete(self, key):
+        self.calls.append(("delete", key))
+
+
+def test_store_keys_are_written_through_the_writer(app_module, tmp_path):
+    directory = tmp_path / "downloads"
+    directory.mkdir()
+    backend = app_module.SQLiteState(str(tmp_path / "state.db"))
+    writer = RecordingWriter()
+    store = app_module.MediaStore(str(directory), str(tmp_path / "index.json"), 10000, 3600,
+                                  remote=backend, writer=writer)
+    write(directory, "file.bin", 100)
+    store.add("file.bin", key="k")
+    write(directory, "file.bin", 200)
+    store.refresh("file.bin")
+    assert ("set", "store:k") in writer.calls
+    assert ("delete", "store:k") in writer.calls
+    assert backend.get("store:k") is None  # Rien d'écrit depuis le thread appelant
+
+
+def test_index_is_written_in_batches(app_module, tmp_path):
+    directory = tmp_path / "downloads"
+    directory.mkdir()
+    index_file = tmp_path / "index.json"
+    store = app_module.MediaStore(str(directory), str(index_file), 10000, 3600)
+    for name in ("a.bin", "b.bin", "c.bin"):
+        write(directory, name, 100)
+        store.add(name)
+    assert not index_file.exists()  # Pas une écriture complète par ajout
+    store.sync()
+    with open(index_file) as f:
+        assert sorted(e["filename"] for e in json.load(f)) == ["a.bin", "b.bin", "c.bin"]
+    mtime = index_file.stat().st_mtime_ns
+    store.sync()
+    assert index_file.stat().st_mtime_ns == mtime  # Rien n'a changé
+
+
+def test_load_skips_malformed_entries(app_module, tmp_path):
+    directory = tmp_path / "downloads"
+    directory.mkdir()
+    index_file = tmp_path / "index.json"
+    write(directory, "good.bin", 100)
+    write(directory, "stale.bin", 50)
+    with open(index_file, "w") as f:
+        json.dump([{"filename": "good.bin", "key": "k", "size": 100},
+                   {"filename": "stale.bin", "size": 50, "unknown_field": 1},
+                   "pas une entrée"], f)
+    store = app_module.MediaStore(str(directory), str(index_file), 10000, 3600)
+    store.load()
+    assert store.lookup("k").filename == "good.bin"
+    assert store.get("stale.bin") is not None  # Réadopté depuis le dossier
+
+
+def test_orphan_temporary_files_are_swept(app_module, tmp_path):
+    temp, downloads = tmp_path / "temp", tmp_path / "downloads"
+    temp.mkdir()
+    downloads.mkdir()
+    files = app_module.TempFiles(str(temp), str(downloads))
+    active = files.claim("cut")
+    old = 1_000_000_000
+    for path in (f"{active}.mp4", temp / "export_orphelin.mp4", downloads / "video.mp4.part",
+                 downloads / "video.f137.mp4.part-Frag3", downloads / "video.mp4"):
+        write(os.path.dirname(path), os.path.basename(path), 10)
+        os.utime(path, (old, old))
+    write(temp, "stream_recent.source", 10)
+    assert files.sweep(60) == (3, 30)
+    assert sorted(os.listdir(temp)) == sorted([os.path.basename(active) + ".mp4", "stream_recent.source"])
+    assert os.listdir(downloads) == ["video.mp4"]
+    files.release(active)
+    assert os.listdir(temp) == ["stream_recent.source"]
+
+
+def test_idle_files_expire_and_pinned_ones_stay(app_module, tmp_path, monkeypatch):
+    directory = tmp_path / "downloads"
+    directory.mkdir()
+    store = app_module.MediaStore(str(directory), str(tmp_path / "index.json"), 10000, 3600)
+    store.leader = True
+    for filename in ("idle.bin", "pinned.bin"):
+        write(directory, filename, 100)
+        store.add(filename)
+    store.pin("pinned.bin")
+    later = app_module.time.time() + 7200
+    monkeypatch.setattr(app_module.time, "time", lambda: later)
+    write(directory, "recent.bin", 100)
+    store.add("recent.bin")
+    assert store.evict() == ["idle.bin"]
+    assert sorted(os.listdir(directory)) == ["pinned.bin", "recent.bin"]
+    assert store.total_bytes == 200
@@ -0,0 +1,37 @@
+import os
+
+
+def test_stream_is_downloaded_in_process_and_stored(app_module, client, origin, monkeypatch):
+    url, content = origin
+
+    async def no_subprocess(*args, **kwargs):
+        raise AssertionError("le streaming ne doit pas lancer de processus")
+
+    monkeypatch.setattr(app_module.asyncio, "create_subprocess_exec", no_subprocess)
+    monkeypatch.setattr(app_module, "schedule_probe", lambda path: None)
+    before = set(app_module.job_manager.jobs)
+    response = client.get("/download/stream", params={"url": url, "format": "mp4"})
+    assert response.status_code == 200
+    assert response.content == content
+    # Le téléchargement est un job : nombre de workers et limite par domaine de job_manager
+    jobs = [job for job_id, job in app_module.job_manager.jobs.items() if job_id not in before]
+    assert [job.kind for job in jobs] == ["stream"]
+    assert [job.status for job in jobs] == ["finished"]
+    # Deuxième demande : servie depuis le store, avec les requêtes Range
+    stored = client.get("/download/stream", params={"url": url, "format": "mp4"})
+    assert stored.content == content
+    assert stored.headers["accept-ranges"] == "bytes"
+    assert not [name for name in os.listdir(app_module.TEMP_DIR) if name.startswith("stream")]
+    assert app_module.media_store.stats()["reserved_bytes"] == 0
+
+
+def test_downloads_and_streams_share_store_entries(app_module, client, origin, monkeypatch):
+    url, content = origin
+    monkeypatch.setattr(app_module, "schedule_probe", lambda path: None)
+    results = [app_module.run_download(app_module.Job("download"), app_module.DownloadRequest(url=url, format=fmt))
+               for fmt in ("mp4", "best")]
+    # Même format résolu : un seul fichier, réutilisé par le streaming
+    assert results[0]["filename"] == results[1]["filename"]
+    streamed = client.get("/download/stream", params={"url": url, "format": "mp4"})
+    assert streamed.content == content
+    assert streamed.headers["accept-ranges"] == "bytes"
@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import os
+import threading
+
+TUS = {"Tus-Resumable": "1.0.0"}
+
+
+def create(client, length: int, name: str = "clip.mp4"):
+    metadata = "filename " + base64.b64encode(name.encode()).decode()
+    return client.post("/api/uploads", headers={**TUS, "Upload-Length": str(length), "Upload-Metadata": metadata})
+
+
+def patch(client, location: str, offset: int, body: bytes, checksum: str = None):
+    headers = {**TUS, "Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"}
+    if checksum:
+        headers["Upload-Checksum"] = checksum
+    return client.patch(location, headers=headers, content=body)
+
+
+def test_chunks_are_written_off_event_loop(app_module, client, monkeypatch):
+    writers = set()
+    real_open = open
+
+    class RecordingFile:
+        def __init__(self, f):
+            self.f = f
+
+        def write(self, data):
+            writers.add(threading.current_thread().name)
+            return self.f.write(data)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.f.close()
+
+        def __getattr__(self, name):
+            return getattr(self.f, name)
+
+    monkeypatch.setattr(app_module, "open", lambda *a, **k: RecordingFile(real_open(*a, **k)), raising=False)
+    body = os.urandom(3000)
+    location = create(client, len(body)).headers["Location"]
+    assert patch(client, location, 0, body[:1000]).headers["Upload-Offset"] == "1000"
+    bad = "sha1 " + base64.b64encode(hashlib.sha1(b"autre").digest()).decode()
+    assert patch(client, location, 1000, body[1000:], bad).status_code == 460
+    good = "sha1 " + base64.b64encode(hashlib.sha1(body[1000:]).digest()).decode()
+    response = patch(client, location, 1000, body[1000:], good)
+    assert response.status_code == 204
+    monkeypatch.undo()
+    with open(os.path.join(app_module.DOWNLOAD_DIR, response.headers["Upload-Filename"]), "rb") as f:
+        assert f.read() == body
+    assert writers and all(name.startswith("AnyIO worker") for name in writers)
+
+
+def test_upload_length_is_reserved_until_the_upload_ends(app_module, client, monkeypatch):
+    store = app_module.media_store
+    monkeypatch.setattr(store, "max_bytes", store._committed() + 5000)
+    first = create(client, 4000)
+    assert first.status_code == 201
+    assert store._reserved >= 4000
+    second = create(client, 4000)
+    assert second.status_code == 507
+    assert second.headers["Retry-After"]
+    assert client.delete(first.headers["Location"], headers=TUS).status_code == 204
+    assert store._reserved == 0
+
+    body = os.urandom(4000)
+    location = create(client, len(body)).headers["Location"]
+    response = patch(client, location, 0, body)
+    assert response.status_code == 204
+    assert store._reserved == 0
+    assert not app_module._upload_reservations
+
+
+def test_expired_uploads_forget_their_lock(app_module, client):
+    location = create(client, 2000).headers["Location"]
+    upload_id = location.rstrip("/").rsplit("/", 1)[-1]
+    assert patch(client, location, 0, os.urandom(1000)).status_code == 204
+    assert upload_id in app_module._upload_locks
+    app_module.expire_uploads(-1)
+    assert upload_id not in app_module._upload_locks
+    assert upload_id not in app_module._upload_reservations
+    assert client.head(location, headers=TUS).status_code == 404
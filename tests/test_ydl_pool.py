@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(REPO_DIR, "code pour telecharger des videos.py")
+PROFILES = {"probe": {"quiet": True, "format": "best"}}
+
+
+def test_instances_are_reused_and_reset_between_leases(app_module):
+    pool = app_module.YoutubeDLPool(PROFILES, max_idle=2, idle_timeout=60)
+    hook = lambda d: None  # noqa: E731
+    with pool.lease("probe", {"format": "bestaudio", "outtmpl": "x.%(ext)s", "progress_hooks": [hook],
+                              "ratelimit": 1000}) as ydl:
+        first = ydl
+        assert ydl.params["format"] == "bestaudio" and ydl.params["ratelimit"] == 1000
+        assert ydl.params["outtmpl"]["default"] == "x.%(ext)s" and hook in ydl._progress_hooks
+    with pool.lease("probe") as ydl:
+        assert ydl is first
+        assert ydl.params["format"] == "best" and "ratelimit" not in ydl.params
+        assert not ydl._progress_hooks
+    assert pool.stats() == {"probe": 1}
+    pool.close()
+
+
+def test_idle_instances_are_bounded_and_expire(app_module, monkeypatch):
+    pool = app_module.YoutubeDLPool(PROFILES, max_idle=1, idle_timeout=60)
+    closed = []
+    with pool.lease("probe") as first, pool.lease("probe") as second:
+        assert first is not second
+        for ydl in (first, second):
+            monkeypatch.setattr(ydl, "close", lambda ydl=ydl: closed.append(ydl))
+    # `second`, rendue la première, est gardée ; au-delà de max_idle, `first` est fermée
+    assert closed == [first] and pool.stats() == {"probe": 1}
+    pool.prune()
+    assert pool.stats() == {"probe": 1}
+    pool.idle_timeout = -1
+    pool.prune()
+    assert closed == [first, second] and pool.stats() == {"probe": 0}
+
+
+def test_construction_options_must_be_in_the_profile(app_module):
+    pool = app_module.YoutubeDLPool(PROFILES, max_idle=1, idle_timeout=60)
+    with pytest.raises(ValueError, match="proxy"):
+        with pool.lease("probe", {"proxy": "http://127.0.0.1:1"}):
+            pass
+    pool.close()
+
+
+def test_module_import_does_not_load_yt_dlp(tmp_path):
+    for directory in ("static", "templates"):
+        os.makedirs(tmp_path / directory)
+    code = ("import importlib.util, sys\n"
+            f"spec = importlib.util.spec_from_file_location('app', {APP_FILE!r})\n"
+            "spec.loader.exec_module(importlib.util.module_from_spec(spec))\n"
+            "print('yt_dlp' in sys.modules)\n")
+    result = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, capture_output=True, text=True, timeout=60)
+    assert result.stdout.strip().splitlines()[-1] == "False", result.stderr